@@ -0,0 +1,158 @@
+#####################################################################################
+# Filename       : bitstamp_analytics.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Rolling vwap, volatility, buy/sell imbalance and trade size
+#                percentiles per pair from numpy ring buffers of live trades.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import threading
+
+# numpy is loaded by the first pair with analytics, processes without trades never import it
+np = None
+
+# Trades kept per pair, about 25 bytes each
+ANALYTICS_SIZE = 65536
+
+# Rolling windows in seconds, ending at the newest trade
+ANALYTICS_HORIZONS = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600}
+
+# Trade size percentiles reported for every window
+SIZE_PERCENTILES = (50, 90, 99)
+
+
+def load_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+class TradeAnalytics:
+    # Fixed size column ring buffers for one pair.  add() is O(1), stats()
+    # slices every window out of the ring and computes it with vectorized
+    # numpy, so memory is bounded at size trades whatever the trade rate.
+    # A window longer than the ring holds is reported with complete False.
+    def __init__(self, currency_pair, size=ANALYTICS_SIZE, horizons=ANALYTICS_HORIZONS):
+        load_numpy()
+        self.currency_pair = currency_pair
+        self.size = size
+        self.horizons = horizons
+        self.price = np.zeros(size, dtype=np.float64)
+        self.amount = np.zeros(size, dtype=np.float64)
+        self.side = np.zeros(size, dtype=np.int8)
+        self.microtimestamp = np.zeros(size, dtype=np.int64)
+        self.count = 0
+        self.last_trade_id = 0
+        self.lock = threading.Lock()
+
+    def add(self, trade):
+        with self.lock:
+            # Several watchers can feed the same pair, count each trade once
+            if trade.id <= self.last_trade_id:
+                return
+            self.last_trade_id = trade.id
+            i = self.count % self.size
+            self.price[i] = float(trade.price)
+            self.amount[i] = float(trade.amount)
+            self.side[i] = trade.type
+            self.microtimestamp[i] = trade.microtimestamp
+            self.count += 1
+
+    def _columns(self):
+        # Copies of the buffered trades, oldest first
+        with self.lock:
+            if self.count <= self.size:
+                end = self.count
+                return (self.price[:end].copy(), self.amount[:end].copy(), self.side[:end].copy(),
+                        self.microtimestamp[:end].copy(), False)
+            start = self.count % self.size
+            order = np.r_[start:self.size, 0:start]
+            return self.price[order], self.amount[order], self.side[order], self.microtimestamp[order], True
+
+    def stats(self, horizons=None):
+        price, amount, side, microtimestamp, wrapped = self._columns()
+        result = {"currency_pair": self.currency_pair, "trades_buffered": len(price), "windows": {}}
+        if not len(price):
+            return result
+        end = int(microtimestamp[-1])
+        result["as_of"] = end
+        for name in horizons or self.horizons:
+            seconds = self.horizons[name]
+            # Trades arrive in time order so the window start is a binary search
+            first = int(np.searchsorted(microtimestamp, end - seconds * 1000000, side="left"))
+            window = window_stats(price[first:], amount[first:], side[first:])
+            window["complete"] = not (wrapped and first == 0)
+            result["windows"][name] = window
+        return result
+
+
+def window_stats(price, amount, side):
+    volume = float(amount.sum())
+    buys = float(amount[side == 0].sum())
+    sells = volume - buys
+    stats = {"trades": len(price), "volume": volume, "buy_volume": buys, "sell_volume": sells,
+             "imbalance": (buys - sells) / volume if volume else 0.0}
+    if not len(price):
+        return stats
+    stats["vwap"] = float((price * amount).sum() / volume) if volume else float(price[-1])
+    stats["high"] = float(price.max())
+    stats["low"] = float(price.min())
+    stats["last"] = float(price[-1])
+    # Standard deviation of trade to trade log returns
+    returns = np.diff(np.log(price))
+    stats["volatility"] = float(returns.std()) if len(returns) else 0.0
+    stats["size_percentiles"] = {str(p): float(value)
+                                 for p, value in zip(SIZE_PERCENTILES, np.percentile(amount, SIZE_PERCENTILES))}
+    return stats
+
+
+def format_stats(stats):
+    # One console line per window
+    lines = []
+    for name, window in stats["windows"].items():
+        if not window["trades"]:
+            continue
+        sizes = " ".join(f"p{p}={value:.8g}" for p, value in window["size_percentiles"].items())
+        lines.append(f'    {stats["currency_pair"]} {name}: trades={window["trades"]} vwap={window["vwap"]:.2f} '
+                     f'vol={window["volume"]:.8g} volatility={window["volatility"]:.6f} '
+                     f'imbalance={window["imbalance"]:+.3f} {sizes}'
+                     f'{"" if window["complete"] else " (partial)"}')
+    return lines
+
+
+# Analytics shared by every watcher, keyed by currency pair
+trade_analytics = {}
+trade_analytics_lock = threading.Lock()
+
+
+def get_trade_analytics(currency_pair):
+    with trade_analytics_lock:
+        if currency_pair not in trade_analytics:
+            trade_analytics[currency_pair] = TradeAnalytics(currency_pair)
+        return trade_analytics[currency_pair]
@@ -0,0 +1,404 @@
+#####################################################################################
+# Filename       : bitstamp_bench.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Throughput benchmark replaying bitstamp frames from a local
+#                websocket server through the watchers or the command line tool.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import sys
+import os
+import getopt
+import json
+import time
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import resource
+import statistics
+import subprocess
+import multiprocessing
+import websockets
+import bitstamp_workers as workers
+import bitstamp_websocket as cli
+from bitstamp_mux import WatcherEngine
+from bitstamp_sql import TradeBatchWriter
+from bitstamp_files import CsvTradeWriter, ColumnarTradeWriter
+from bitstamp_sinks import CsvSink, ColumnarSink, SqlSink, register_sink, close_sinks, parse_outputs
+
+# Benchmark modes
+# engine - bitstamp_workers.Watcher on the multiplexed WatcherEngine
+# thread - bitstamp_workers.WatcherThread, one socket per pair
+# cli    - bitstamp_websocket.main, one per pair
+# startup - import cost of the entry modules in a fresh interpreter
+BENCH_MODES = ["engine", "thread", "cli", "startup"]
+
+# Modules every process start pays for, the cli and each supervisor worker restart
+STARTUP_MODULES = ["bitstamp_websocket", "bitstamp_workers", "bitstamp_supervisor"]
+
+# Seconds to wait for every frame to be handled before giving up
+BENCH_TIMEOUT = 120
+
+
+def make_trade_frame(channel, trade_id):
+    # microtimestamp is the send time so the receiver can measure end to end latency
+    now = time.time()
+    return (f'{{"data": {{"buy_order_id": {trade_id * 2}, "amount_str": "0.06400000", "timestamp": "{int(now)}", '
+            f'"microtimestamp": "{int(now * 1000000)}", "id": {trade_id}, "amount": 0.064, '
+            f'"sell_order_id": {trade_id * 2 + 1}, "price_str": "30859.03", "type": {trade_id % 2}, '
+            f'"price": 30859.03}}, "event": "trade", "channel": "{channel}"}}')
+
+
+def load_frames(path):
+    # Recorded frames, one json frame per line.  Only trade frames are replayed.
+    frames = []
+    with open(path) as f:
+        for line in f:
+            frame = json.loads(line)
+            if frame.get("event") == "trade":
+                frames.append(frame)
+    return frames
+
+
+def restamp_frame(frame, channel, trade_id):
+    # Recorded frames are re-sent with a fresh id, channel and microtimestamp
+    now = time.time()
+    data = dict(frame["data"], id=trade_id, timestamp=str(int(now)), microtimestamp=str(int(now * 1000000)))
+    return json.dumps({"data": data, "event": "trade", "channel": channel})
+
+
+def run_server(port_queue, messages, rate, frames_path):
+    # Runs in its own process so sending frames does not compete with the receiver for the GIL
+    frames = load_frames(frames_path) if frames_path else None
+
+    async def replay(ws, channel):
+        start = time.monotonic()
+        for i in range(messages):
+            trade_id = i + 1
+            if frames:
+                await ws.send(restamp_frame(frames[i % len(frames)], channel, trade_id))
+            else:
+                await ws.send(make_trade_frame(channel, trade_id))
+            if rate and i % 100 == 99:
+                # Keep to the requested rate, checked every 100 frames
+                delay = start + (i + 1) / rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % 1000 == 999:
+                await asyncio.sleep(0)
+
+    async def handler(ws, path=None):
+        tasks = []
+        try:
+            async for message in ws:
+                request = json.loads(message)
+                if request["event"] == "bts:subscribe":
+                    tasks.append(asyncio.ensure_future(replay(ws, request["data"]["channel"])))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def serve():
+        server = await websockets.serve(handler, "127.0.0.1", 0)
+        port_queue.put(server.sockets[0].getsockname()[1])
+        await asyncio.Future()
+
+    asyncio.get_event_loop().run_until_complete(serve())
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.latencies = []
+        self.first = None
+        self.last = None
+        self.done = threading.Event()
+        self.expected = 0
+
+    def record(self, trade):
+        now = time.time()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.latencies.append(now - trade.microtimestamp / 1000000)
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        elapsed = (self.last - self.first) if count > 1 else 0
+        return {
+            "messages": count,
+            "msgs_per_sec": round(count / elapsed, 1) if elapsed else None,
+            "p50_ms": round(latencies[count // 2] * 1000, 3) if count else None,
+            "p99_ms": round(latencies[min(count - 1, int(count * 0.99))] * 1000, 3) if count else None,
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+class SqliteTrades:
+    # Stand in for BitStampMySql with the calls the watchers and batch writer make
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.tables = set()
+
+    def ensure_trade_table(self, table):
+        with self.lock:
+            self._ensure_trade_table(table)
+        return True
+
+    def _ensure_trade_table(self, table):
+        if table not in self.tables:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (id INTEGER, buy_order_id INTEGER, '
+                              f'sell_order_id INTEGER, amount TEXT, price TEXT, type INTEGER, '
+                              f'timestamp INTEGER, PRIMARY KEY (timestamp, id))')
+            self.tables.add(table)
+
+    def create_trades(self, trades, table):
+        with self.lock:
+            self._ensure_trade_table(table)
+            self.conn.executemany(f'INSERT OR IGNORE INTO {table} (id, buy_order_id, sell_order_id, amount, price, '
+                                  f'type, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)', [trade[:7] for trade in trades])
+            self.conn.commit()
+            return True
+
+    def create_candles(self, candles, merge=False):
+        with self.lock:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS candles (currency_pair TEXT, interval TEXT, start INTEGER, '
+                              'open REAL, high REAL, low REAL, close REAL, volume REAL, vwap REAL, trades INTEGER, '
+                              'PRIMARY KEY (currency_pair, interval, start))')
+            if merge:
+                self.conn.executemany(
+                    'INSERT INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (currency_pair, interval, start) DO UPDATE SET high = max(high, excluded.high), '
+                    'low = min(low, excluded.low), close = excluded.close, volume = volume + excluded.volume, '
+                    'vwap = CASE WHEN volume + excluded.volume > 0 THEN (vwap * volume + excluded.vwap * '
+                    'excluded.volume) / (volume + excluded.volume) ELSE excluded.vwap END, '
+                    'trades = trades + excluded.trades', candles)
+            else:
+                self.conn.executemany('INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', candles)
+            self.conn.commit()
+            return True
+
+    def create_watcher(self, name, channel, currency_pair, output=None):
+        pass
+
+    def delete_watcher(self, name):
+        pass
+
+
+class BenchWatcher(workers.Watcher):
+    recorder = None
+
+    def _handle_trade(self, trade):
+        # Only trades the watcher passes on to the sinks are timed
+        handled = super()._handle_trade(trade)
+        if handled:
+            self.recorder.record(trade)
+        return handled
+
+
+class BenchWatcherThread(BenchWatcher, workers.WatcherThread):
+    pass
+
+
+def register_sinks(directory, sql_writer):
+    # File outputs go to the bench directory and sql to the sqlite stand in
+    register_sink(cli.VALID_OUTPUTS[1], lambda: CsvSink(CsvTradeWriter(directory)))
+    register_sink(cli.VALID_OUTPUTS[2], lambda: SqlSink(sql_writer))
+    for file_format in cli.VALID_OUTPUTS[3:5]:
+        register_sink(file_format, lambda file_format=file_format: ColumnarSink(
+            file_format, ColumnarTradeWriter(directory, file_format=file_format)))
+
+
+def parse_importtime(stderr):
+    # {module: (self seconds, cumulative seconds)} from python -X importtime
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            imports[name.strip()] = (int(own) / 1000000, int(cumulative) / 1000000)
+    return imports
+
+
+def bench_startup(modules=STARTUP_MODULES, runs=5):
+    # Runs each import in a new interpreter, reporting the median wall time and
+    # the dependencies that cost the most in the last run
+    result = {}
+    code = "import resource, {module}; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    for module in modules:
+        times = []
+        rss = 0
+        for i in range(runs):
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code.format(module=module)],
+                                  capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(time.perf_counter() - start)
+            if proc.returncode:
+                raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+            rss = max(rss, int(proc.stdout.split()[-1]))
+        imports = parse_importtime(proc.stderr)
+        heaviest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:5]
+        result[module] = {"wall_seconds_p50": round(statistics.median(times), 4),
+                          "import_seconds": round(imports.get(module, (0, 0))[1], 4),
+                          "max_rss_kb": rss,
+                          "heaviest_imports": {name: round(own, 4) for name, (own, cumulative) in heaviest}}
+    return result
+
+
+def bench(mode, output, pairs, messages, rate, connections, frames_path):
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_server, args=(port_queue, messages, rate, frames_path), daemon=True)
+    server.start()
+    uri = f"ws://127.0.0.1:{port_queue.get()}/"
+
+    recorder = LatencyRecorder()
+    recorder.expected = len(pairs) * messages
+    directory = tempfile.mkdtemp(prefix="bitstamp_bench_")
+    stand_in = SqliteTrades(os.path.join(directory, "trades.db"))
+    stdout = sys.stdout
+    if cli.VALID_OUTPUTS[0] in parse_outputs(output):
+        sys.stdout = open(os.devnull, "w")
+
+    if mode == BENCH_MODES[2]:
+        # The command line tool handles one pair per main(), run one per pair
+        cli.URI = uri
+        cli.writer = TradeBatchWriter(stand_in)
+        register_sinks(directory, cli.writer)
+        cli.sinks = cli.make_sinks(output)
+        handle_trade = cli.handle_trade
+
+        def timed_handle_trade(trade, currency):
+            handle_trade(trade, currency)
+            recorder.record(trade)
+
+        cli.handle_trade = timed_handle_trade
+        for pair in pairs:
+            threading.Thread(target=cli.main, args=(cli.VALID_CHANNELS[0], pair), daemon=True).start()
+        recorder.done.wait(BENCH_TIMEOUT)
+        cli.close_writer()
+    else:
+        workers.db = stand_in
+        workers.trade_writer = TradeBatchWriter(stand_in, batch_size=workers.SQL_BATCH_SIZE,
+                                                batch_interval=workers.SQL_BATCH_INTERVAL)
+        register_sinks(directory, workers.trade_writer)
+        BenchWatcher.recorder = recorder
+        watchers = []
+        if mode == BENCH_MODES[0]:
+            engine = WatcherEngine(uri, connections=connections)
+            engine.start()
+            for pair in pairs:
+                watcher = BenchWatcher(f"{pair}-bench", workers.VALID_CHANNELS[0], pair, output)
+                engine.add_watcher(watcher)
+                watchers.append(watcher)
+        else:
+            workers.URI = uri
+            for pair in pairs:
+                watcher = BenchWatcherThread(f"{pair}-bench", workers.VALID_CHANNELS[0], pair, output)
+                watcher.start()
+                watchers.append(watcher)
+        recorder.done.wait(BENCH_TIMEOUT)
+        for watcher in watchers:
+            watcher.end(remove=False)
+        for watcher in watchers:
+            watcher.join_worker()
+        if mode == BENCH_MODES[0]:
+            engine.stop()
+        close_sinks()
+        workers.trade_writer.close()
+    sys.stdout = stdout
+
+    server.terminate()
+    result = recorder.report()
+    result.update({"mode": mode, "output": output, "pairs": len(pairs), "rate": rate})
+    if len(recorder.latencies) < recorder.expected:
+        print(f"Timed out, {len(recorder.latencies)} of {recorder.expected} trades handled.")
+    return result
+
+
+if __name__ == "__main__":
+
+    # Set defaults
+    mode = BENCH_MODES[0]
+    output = cli.VALID_OUTPUTS[2]
+    pair_count = 1
+    messages = 10000
+    rate = 0
+    connections = 1
+    frames_path = None
+    as_json = False
+
+    cmd_example = (f'bitstamp_bench.py -m <engine, thread, cli or startup> -o <output> -p <pair count> -n <messages per pair> '
+                   f'-r <msgs/sec per pair, 0 for unthrottled> --connections=<mux connections> '
+                   f'--frames=<recorded frames file> --json')
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hm:o:p:n:r:",
+                                   ["mode=", "output=", "pairs=", "messages=", "rate=", "connections=", "frames=",
+                                    "json", "help"])
+    except getopt.GetoptError:
+        print(cmd_example)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(cmd_example)
+            sys.exit(0)
+        elif opt in ("-m", "--mode"):
+            if arg not in BENCH_MODES:
+                print(f'Mode not valid.  Use one of {", ".join(BENCH_MODES)}.')
+                sys.exit(2)
+            mode = arg
+        elif opt in ("-o", "--output"):
+            if not cli.check_output(arg):
+                print(f'Output not valid.  Use one of {", ".join(cli.VALID_OUTPUTS)}.')
+                sys.exit(2)
+            output = arg
+        elif opt in ("-p", "--pairs"):
+            pair_count = int(arg)
+        elif opt in ("-n", "--messages"):
+            messages = int(arg)
+        elif opt in ("-r", "--rate"):
+            rate = float(arg)
+        elif opt == "--connections":
+            connections = int(arg)
+        elif opt == "--frames":
+            frames_path = arg
+        elif opt == "--json":
+            as_json = True
+
+    if mode == BENCH_MODES[3]:
+        result = bench_startup()
+    else:
+        result = bench(mode, output, cli.VALID_PAIRS[:pair_count], messages, rate, connections, frames_path)
+    if as_json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f'{key}: {value}')
@@ -0,0 +1,187 @@
+#####################################################################################
+# Filename       : bitstamp_candles.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Incremental OHLCV candles built from live trades and flushed to
+#                the candles rollup table.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import threading
+from collections import deque
+
+# Candle intervals in seconds
+CANDLE_INTERVALS = {"1s": 1, "1m": 60, "5m": 300, "1h": 3600}
+
+# Closed candles kept in memory per pair and interval
+CANDLE_HISTORY = 1000
+
+# Seconds between flushes of closed candles to the database
+CANDLE_FLUSH_INTERVAL = 5
+
+# Closed candles held for the next flush while the database is down, the oldest go first
+CANDLE_MAX_UNWRITTEN = 100000
+
+
+class Candle:
+    __slots__ = ("start", "open", "high", "low", "close", "volume", "quote_volume", "trades")
+
+    def __init__(self, start, price, amount):
+        self.start = start
+        self.open = self.high = self.low = self.close = price
+        self.volume = amount
+        self.quote_volume = price * amount
+        self.trades = 1
+
+    def add(self, price, amount):
+        if price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += amount
+        self.quote_volume += price * amount
+        self.trades += 1
+
+    def vwap(self):
+        return self.quote_volume / self.volume if self.volume else self.close
+
+    def to_dict(self):
+        return {"start": self.start, "open": self.open, "high": self.high, "low": self.low, "close": self.close,
+                "volume": self.volume, "vwap": self.vwap(), "trades": self.trades}
+
+
+class CandleAggregator:
+    # Candles for one pair over every interval.  Each trade updates the open
+    # candle of each interval in O(1), a trade in a later bucket closes it.
+    # Buckets with no trades produce no candle.  Trades older than the open
+    # candle (possible after a backfill) are counted in late_trades and skipped.
+    def __init__(self, currency_pair, intervals=CANDLE_INTERVALS, history=CANDLE_HISTORY):
+        self.currency_pair = currency_pair
+        self.intervals = intervals
+        self.current = {}
+        self.recent = {name: deque(maxlen=history) for name in intervals}
+        self.closed = []
+        self.last_trade_id = 0
+        self.late_trades = 0
+        self.lock = threading.Lock()
+
+    def add(self, trade):
+        price = float(trade.price)
+        amount = float(trade.amount)
+        with self.lock:
+            # Several watchers can feed the same pair, count each trade once
+            if trade.id <= self.last_trade_id:
+                return
+            self.last_trade_id = trade.id
+            for name, seconds in self.intervals.items():
+                start = trade.timestamp - trade.timestamp % seconds
+                candle = self.current.get(name)
+                if candle is None or start > candle.start:
+                    if candle is not None:
+                        self.recent[name].append(candle)
+                        self.closed.append((name, candle))
+                    self.current[name] = Candle(start, price, amount)
+                elif start == candle.start:
+                    candle.add(price, amount)
+                else:
+                    self.late_trades += 1
+
+    def take_closed(self):
+        with self.lock:
+            closed = self.closed
+            self.closed = []
+        return closed
+
+    def take_open(self):
+        # The open candles, handed over at shutdown.  Later trades in the same
+        # buckets start new candles that are merged into the written rows.
+        with self.lock:
+            current = list(self.current.items())
+            self.current = {}
+        return current
+
+    def candles(self, interval, limit=100):
+        # Most recent closed candles followed by the open one
+        with self.lock:
+            candles = [candle.to_dict() for candle in list(self.recent[interval])[-limit:]]
+            if interval in self.current:
+                current = self.current[interval].to_dict()
+                current["open_candle"] = True
+                candles.append(current)
+        return candles
+
+
+# Aggregators shared by every watcher, keyed by currency pair
+candle_aggregators = {}
+candle_aggregators_lock = threading.Lock()
+
+
+def get_candle_aggregator(currency_pair):
+    with candle_aggregators_lock:
+        if currency_pair not in candle_aggregators:
+            candle_aggregators[currency_pair] = CandleAggregator(currency_pair)
+        return candle_aggregators[currency_pair]
+
+
+class CandleFlusher(threading.Thread):
+    # Writes closed candles from every aggregator to the database in bulk.
+    # Candles from a failed write are kept and written with the next flush.
+    # On stop the open candles are written too.  Rows are merged into any
+    # candle already stored for the bucket, e.g. the part written before a
+    # restart, rather than replacing it.
+    def __init__(self, db_conn, flush_interval=CANDLE_FLUSH_INTERVAL, max_unwritten=CANDLE_MAX_UNWRITTEN):
+        super().__init__(name="candle-flusher", daemon=True)
+        self.db_conn = db_conn
+        self.flush_interval = flush_interval
+        self.unwritten = deque(maxlen=max_unwritten)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.flush(include_open=True)
+
+    def flush(self, include_open=False):
+        for aggregator in list(candle_aggregators.values()):
+            candles = aggregator.take_closed()
+            if include_open:
+                candles.extend(aggregator.take_open())
+            for interval, candle in candles:
+                self.unwritten.append((aggregator.currency_pair, interval, candle.start, candle.open, candle.high,
+                                       candle.low, candle.close, candle.volume, candle.vwap(), candle.trades))
+        if not self.unwritten:
+            return True
+        rows = list(self.unwritten)
+        if not self.db_conn.create_candles(rows, merge=True):
+            return False
+        for row in rows:
+            self.unwritten.popleft()
+        return True
@@ -0,0 +1,299 @@
+#####################################################################################
+# Filename       : bitstamp_capture.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Capture raw websocket frames to compressed append only segment
+#                files and replay them through the trade handlers.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import sys
+import os
+import getopt
+import glob
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Segment layout
+# A .seg file is a run of blocks, each a BLOCK_HEADER followed by the compressed
+# records.  A record is RECORD_HEADER (receive time in microseconds, frame
+# length) followed by the raw frame bytes.  The matching .idx file holds one
+# INDEX_ENTRY per block so a reader can seek straight to a time range.
+BLOCK_MAGIC = b"BSCB"
+BLOCK_HEADER = struct.Struct("<4sBIIqq")
+RECORD_HEADER = struct.Struct("<qI")
+INDEX_ENTRY = struct.Struct("<QqqI")
+
+# Codecs, the best one installed is used for writing
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+CODEC_LZ4 = 2
+
+BLOCK_SIZE = 1024 * 1024
+BLOCK_INTERVAL = 1.0
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+def best_codec():
+    if zstandard is not None:
+        return CODEC_ZSTD
+    if lz4 is not None:
+        return CODEC_LZ4
+    return CODEC_ZLIB
+
+
+def compress(codec, data):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == CODEC_LZ4:
+        return lz4.frame.compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(codec, data):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_LZ4:
+        return lz4.frame.decompress(data)
+    return zlib.decompress(data)
+
+
+class FrameCapture:
+    # Appends frames to {directory}/{name}-{start time}-{part}.seg.  Frames are
+    # buffered into blocks of about block_size bytes, a block is also cut once
+    # block_interval seconds have passed, and a new segment is started once
+    # the current one reaches segment_size bytes.  A timer thread cuts the
+    # block when the stream goes quiet, so frames already received are on
+    # disk within about block_interval seconds.
+    def __init__(self, directory, name="capture", block_size=BLOCK_SIZE, block_interval=BLOCK_INTERVAL,
+                 segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.name = name
+        self.block_size = block_size
+        self.block_interval = block_interval
+        self.segment_size = segment_size
+        self.codec = best_codec()
+        self.buffer = bytearray()
+        self.count = 0
+        self.first_ts = 0
+        self.last_ts = 0
+        self.block_started = time.monotonic()
+        self.segment = None
+        self.index = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.stopped = threading.Event()
+        self.cutter = threading.Thread(target=self._run, name=f"{name}-block-cutter", daemon=True)
+        self.cutter.start()
+
+    def write(self, frame, recv_ts=None):
+        # frame is the raw str or bytes from recv(), recv_ts microseconds since the epoch
+        if recv_ts is None:
+            recv_ts = time.time_ns() // 1000
+        if isinstance(frame, str):
+            frame = frame.encode()
+        with self.lock:
+            if not self.count:
+                self.first_ts = recv_ts
+                self.block_started = time.monotonic()
+            self.buffer += RECORD_HEADER.pack(recv_ts, len(frame))
+            self.buffer += frame
+            self.count += 1
+            self.last_ts = recv_ts
+            if len(self.buffer) >= self.block_size or time.monotonic() - self.block_started >= self.block_interval:
+                self._write_block()
+
+    def flush(self):
+        with self.lock:
+            self._write_block()
+
+    def close(self):
+        self.stopped.set()
+        self.cutter.join()
+        with self.lock:
+            self._write_block()
+            if self.segment is not None:
+                self.segment.close()
+                self.index.close()
+                self.segment = None
+
+    def _run(self):
+        while not self.stopped.wait(self.block_interval):
+            with self.lock:
+                if self.count and time.monotonic() - self.block_started >= self.block_interval:
+                    self._write_block()
+
+    def _write_block(self):
+        if not self.count:
+            return
+        if self.segment is None or self.segment.tell() >= self.segment_size:
+            self._rotate()
+        payload = compress(self.codec, bytes(self.buffer))
+        offset = self.segment.tell()
+        self.segment.write(BLOCK_HEADER.pack(BLOCK_MAGIC, self.codec, len(payload), self.count, self.first_ts,
+                                             self.last_ts))
+        self.segment.write(payload)
+        self.segment.flush()
+        self.index.write(INDEX_ENTRY.pack(offset, self.first_ts, self.last_ts, self.count))
+        self.index.flush()
+        self.buffer = bytearray()
+        self.count = 0
+
+    def _rotate(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+        stamp = datetime.utcfromtimestamp(self.first_ts / 1000000).strftime("%Y%m%d%H%M%S")
+        # Zero padded part numbers keep segments in capture order when sorted by name
+        part = 0
+        path = os.path.join(self.directory, f"{self.name}-{stamp}-{part:04d}.seg")
+        while os.path.exists(path):
+            part += 1
+            path = os.path.join(self.directory, f"{self.name}-{stamp}-{part:04d}.seg")
+        self.segment = open(path, "ab")
+        self.index = open(path[:-4] + ".idx", "ab")
+
+
+def read_index(index_path):
+    entries = []
+    with open(index_path, "rb") as f:
+        data = f.read()
+    for start in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+        entries.append(INDEX_ENTRY.unpack_from(data, start))
+    return entries
+
+
+def read_frames(directory, name="capture", start_ts=None, end_ts=None):
+    # Yields (recv_ts, frame bytes) in capture order, skipping blocks outside
+    # start_ts..end_ts (microseconds) using the index files.
+    for segment_path in sorted(glob.glob(os.path.join(directory, f"{name}-*.seg"))):
+        index_path = segment_path[:-4] + ".idx"
+        with open(segment_path, "rb") as segment:
+            if os.path.exists(index_path):
+                offsets = [offset for offset, first_ts, last_ts, count in read_index(index_path)
+                           if (start_ts is None or last_ts >= start_ts) and (end_ts is None or first_ts <= end_ts)]
+            else:
+                offsets = None
+            for block in _read_blocks(segment, offsets):
+                for recv_ts, frame in block:
+                    if start_ts is not None and recv_ts < start_ts:
+                        continue
+                    if end_ts is not None and recv_ts > end_ts:
+                        continue
+                    yield recv_ts, frame
+
+
+def _read_blocks(segment, offsets):
+    # With no index the segment is read block by block from the start
+    while True:
+        if offsets is not None:
+            if not offsets:
+                return
+            segment.seek(offsets.pop(0))
+        header = segment.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            return
+        magic, codec, length, count, first_ts, last_ts = BLOCK_HEADER.unpack(header)
+        if magic != BLOCK_MAGIC:
+            print(f"Corrupt block in {segment.name}, skipping rest of segment.")
+            return
+        payload = segment.read(length)
+        if len(payload) < length:
+            # Block cut short by a crash while writing
+            return
+        data = decompress(codec, payload)
+        records = []
+        position = 0
+        for i in range(count):
+            recv_ts, size = RECORD_HEADER.unpack_from(data, position)
+            position += RECORD_HEADER.size
+            records.append((recv_ts, data[position:position + size]))
+            position += size
+        yield records
+
+
+def replay(directory, handler, name="capture", start_ts=None, end_ts=None):
+    # Feeds every captured frame, decoded, to handler(resp) as fast as possible
+    from bitstamp_decode import loads
+    count = 0
+    for recv_ts, frame in read_frames(directory, name=name, start_ts=start_ts, end_ts=end_ts):
+        resp = loads(frame)
+        if resp:
+            handler(resp)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    # Replay a capture through the bitstamp_websocket outputs
+    import bitstamp_websocket as cli
+    from bitstamp_decode import parse_trade
+
+    directory = "capture"
+    name = "capture"
+    output = cli.VALID_OUTPUTS[0]
+    cmd_example = 'bitstamp_capture.py -d <capture directory> -n <capture name> -o <output>'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hd:n:o:", ["directory=", "name=", "output=", "help"])
+    except getopt.GetoptError:
+        print(cmd_example)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(cmd_example)
+            sys.exit(0)
+        elif opt in ("-d", "--directory"):
+            directory = arg
+        elif opt in ("-n", "--name"):
+            name = arg
+        elif opt in ("-o", "--output"):
+            if not cli.check_output(arg):
+                print(f'Output not valid.  Use one or more of {", ".join(cli.VALID_OUTPUTS)} separated by commas.')
+                sys.exit(2)
+            output = arg
+    cli.sinks = cli.make_sinks(output)
+
+    def handle(resp):
+        if resp.get('event') == 'trade':
+            cli.handle_trade(parse_trade(resp['data']), resp['channel'].split("_")[2])
+
+    start = time.monotonic()
+    frames = replay(directory, handle, name=name)
+    cli.close_writer()
+    elapsed = time.monotonic() - start
+    print(f'Replayed {frames} frames in {elapsed:.2f} seconds.')
@@ -0,0 +1,48 @@
+#####################################################################################
+# Filename       : bitstamp_config.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Load config.json once for every module that reads settings.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import os
+import json
+
+# Settings file, BITSTAMP_CONFIG points somewhere else e.g. for a second deployment
+CONFIG_PATH = os.environ.get("BITSTAMP_CONFIG", "config.json")
+
+
+def load_config(path=CONFIG_PATH):
+    # Missing file means every setting takes its default
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.loads(f.read())
+
+
+# Shared by every module, read with config.get('setting', default)
+config = load_config()
@@ -0,0 +1,204 @@
+#####################################################################################
+# Filename       : bitstamp_cross.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Last trade and top of book table shared by every pair, with time
+#                aligned snapshots, implied cross rates and triangular spreads.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import threading
+import time
+from collections import deque
+from itertools import combinations
+
+# Quote currencies, longest match wins so btcusdc splits as btc/usdc.  The order
+# is also the preference for the currency a triangle is priced through.
+QUOTES = ("usd", "eur", "gbp", "usdc", "pax", "btc", "eth")
+
+# Seconds between snapshots, snapshots are taken on multiples of the interval
+CROSS_SNAPSHOT_INTERVAL = 1.0
+
+# Snapshots kept in memory
+CROSS_HISTORY = 300
+
+# A leg older than this many seconds at snapshot time marks its triangle stale
+CROSS_MAX_AGE = 10.0
+
+
+def split_pair(currency_pair):
+    for quote in sorted(QUOTES, key=len, reverse=True):
+        if currency_pair.endswith(quote) and len(currency_pair) > len(quote):
+            return currency_pair[:-len(quote)], quote
+    raise ValueError(f"Unknown quote currency in {currency_pair}")
+
+
+def quote_rank(currency):
+    return QUOTES.index(currency) if currency in QUOTES else len(QUOTES)
+
+
+def find_triangles(currency_pairs):
+    # (direct pair, base, quote, via, base/via pair, quote/via pair) for every
+    # three currencies quoted against each other.  The triangle is priced
+    # through the most quote-like of the three, so btcusd, ethusd and ethbtc
+    # give ethbtc against ethusd / btcusd.
+    legs = {}
+    for currency_pair in currency_pairs:
+        try:
+            legs[frozenset(split_pair(currency_pair))] = currency_pair
+        except ValueError:
+            continue
+    currencies = sorted({currency for leg in legs for currency in leg})
+    triangles = []
+    for three in combinations(currencies, 3):
+        if not all(frozenset(two) in legs for two in combinations(three, 2)):
+            continue
+        via = min(three, key=quote_rank)
+        base, quote = split_pair(legs[frozenset(c for c in three if c != via)])
+        triangles.append((f"{base}{quote}", base, quote, via, legs[frozenset((base, via))],
+                          legs[frozenset((quote, via))]))
+    return triangles
+
+
+class CrossPairTable:
+    # Latest trade price and best bid/ask of every pair.  Updates replace one
+    # dict entry with a new tuple, trades and books are kept in separate dicts
+    # so each entry has a single writer and no lock is needed.  Readers copy
+    # the dicts, a snapshot sees every pair as of the moment it was taken.
+    def __init__(self, max_age=CROSS_MAX_AGE):
+        self.max_age = max_age
+        self.trades = {}
+        self.books = {}
+        self.triangles = []
+        self.triangle_pairs = frozenset()
+
+    def update_trade(self, currency_pair, price, microtimestamp):
+        self.trades[currency_pair] = (price, microtimestamp)
+
+    def update_book(self, currency_pair, bid, ask, microtimestamp):
+        if bid is not None and ask is not None:
+            self.books[currency_pair] = (bid, ask, microtimestamp)
+
+    def state(self):
+        # Copies of the trade and book entries, as read by snapshot
+        return dict(self.trades), dict(self.books)
+
+    def snapshot(self, now=None, trades=None, books=None):
+        # trades and books default to the table's own entries, pass a state
+        # from merge_states to snapshot several tables as one
+        now = int(now * 1000000) if now is not None else time.time_ns() // 1000
+        if trades is None:
+            trades, books = self.state()
+        pairs = {}
+        prices = {}
+        for currency_pair in trades.keys() | books.keys():
+            entry = {}
+            if currency_pair in trades:
+                price, microtimestamp = trades[currency_pair]
+                entry.update(last=price, last_age=(now - microtimestamp) / 1000000)
+            if currency_pair in books:
+                bid, ask, microtimestamp = books[currency_pair]
+                entry.update(bid=bid, ask=ask, mid=(bid + ask) / 2, book_age=(now - microtimestamp) / 1000000)
+            # Mid price when there is a book, else the last trade
+            if "mid" in entry:
+                prices[currency_pair] = (entry["mid"], entry["book_age"])
+            else:
+                prices[currency_pair] = (entry["last"], entry["last_age"])
+            pairs[currency_pair] = entry
+        return {"microtimestamp": now, "pairs": pairs, "triangles": self._triangles(prices)}
+
+    def _triangles(self, prices):
+        # The triangle list only changes when a pair is first seen
+        if prices.keys() != self.triangle_pairs:
+            self.triangle_pairs = frozenset(prices)
+            self.triangles = find_triangles(self.triangle_pairs)
+        results = []
+        for direct, base, quote, via, base_leg, quote_leg in self.triangles:
+            base_rate = rate(prices, base_leg, base)
+            quote_rate = rate(prices, quote_leg, quote)
+            if not base_rate or not quote_rate:
+                continue
+            implied = base_rate / quote_rate
+            price, age = prices[direct]
+            oldest = max(age, prices[base_leg][1], prices[quote_leg][1])
+            results.append({"pair": direct, "via": via, "legs": [base_leg, quote_leg], "direct": price,
+                            "implied": implied, "spread_bps": (price / implied - 1) * 10000,
+                            "stale": oldest > self.max_age})
+        return results
+
+
+def rate(prices, currency_pair, currency):
+    # Price of currency in the other currency of currency_pair
+    price = prices[currency_pair][0]
+    if not price:
+        return None
+    return price if split_pair(currency_pair)[0] == currency else 1 / price
+
+
+# Table shared by every watcher in the process
+cross_table = CrossPairTable()
+
+
+def merge_states(states, limit=1):
+    # Combines (time, trades, books) states from several processes into one
+    # per time, newest first.  Watchers for a pair share a process, so a pair
+    # is only ever in one of the states for a time.
+    merged = {}
+    for now, trades, books in states:
+        entry = merged.setdefault(now, ({}, {}))
+        entry[0].update(trades)
+        entry[1].update(books)
+    return [(now,) + merged[now] for now in sorted(merged, reverse=True)[:limit]]
+
+
+class CrossSnapshotter(threading.Thread):
+    # Copies the table's state on every multiple of interval seconds, keeping
+    # the last history.  Each state is keyed by its interval boundary so the
+    # states from different processes line up for merge_states.
+    def __init__(self, table=cross_table, interval=CROSS_SNAPSHOT_INTERVAL, history=CROSS_HISTORY):
+        super().__init__(name="cross-snapshotter", daemon=True)
+        self.table = table
+        self.interval = interval
+        self.history = deque(maxlen=history)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval - time.time() % self.interval):
+            if self.table.trades or self.table.books:
+                boundary = round(time.time() / self.interval) * self.interval
+                self.history.append((boundary,) + self.table.state())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def states(self, limit=1):
+        # (time, trades, books), newest first
+        return list(self.history)[:-limit - 1:-1]
+
+    def latest(self, limit=1):
+        # Snapshots of the newest states
+        return [self.table.snapshot(now, trades, books) for now, trades, books in self.states(limit)]
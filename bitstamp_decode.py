@@ -0,0 +1,108 @@
+#####################################################################################
+# Filename       : bitstamp_decode.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Decode websocket frames with the fastest json library available
+#                and parse trade and order payloads into compact records.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import json
+import time
+from typing import NamedTuple
+from bitstamp_metrics import Histogram
+
+# Prefer orjson, then ujson, then the standard library
+try:
+    import orjson
+    loads = orjson.loads
+    DECODER = "orjson"
+except ImportError:
+    try:
+        import ujson
+        loads = ujson.loads
+        DECODER = "ujson"
+    except ImportError:
+        loads = json.loads
+        DECODER = "json"
+
+
+DECODE_SECONDS = Histogram("bitstamp_decode_seconds", "Time to decode one websocket frame.", labels=("socket",))
+
+
+def timed_loads(frame, label_values):
+    # loads() recording its duration against the socket the frame arrived on
+    start = time.perf_counter()
+    resp = loads(frame)
+    DECODE_SECONDS.observe(time.perf_counter() - start, label_values)
+    return resp
+
+
+class Trade(NamedTuple):
+    # Field order matches the trade table columns so trade[:7] can be passed
+    # straight to an INSERT.  amount and price are the exact decimal strings
+    # from amount_str/price_str rather than the rounded floats.
+    id: int
+    buy_order_id: int
+    sell_order_id: int
+    amount: str
+    price: str
+    type: int
+    timestamp: int
+    microtimestamp: int
+
+
+def parse_trade(trade_data):
+    # Sample trade_data
+    # {"buy_order_id": 1314580971991040, "amount_str": "0.06400000", "timestamp": "1609777594",
+    #  "microtimestamp": "1609777594772000", "id": 139255607, "amount": 0.064,
+    #  "sell_order_id": 1314580969922560, "price_str": "30859.03", "type": 0, "price": 30859.03}
+    return Trade(trade_data["id"], trade_data["buy_order_id"], trade_data["sell_order_id"],
+                 trade_data["amount_str"], trade_data["price_str"], trade_data["type"],
+                 int(trade_data["timestamp"]), int(trade_data["microtimestamp"]))
+
+
+# live_orders events and the code stored for each in the order event tables
+ORDER_EVENTS = {"order_created": 0, "order_changed": 1, "order_deleted": 2}
+
+
+class Order(NamedTuple):
+    # order_type is 0 for a buy and 1 for a sell, amount is what is left open
+    id: int
+    order_type: int
+    amount: str
+    price: str
+    datetime: int
+    microtimestamp: int
+
+
+def parse_order(order_data):
+    # Sample order_data
+    # {"id": 1314580971991040, "id_str": "1314580971991040", "order_type": 1, "datetime": "1609777594",
+    #  "microtimestamp": "1609777594772000", "amount": 0.5, "amount_str": "0.50000000", "price": 30861.12,
+    #  "price_str": "30861.12"}
+    return Order(order_data["id"], order_data["order_type"], order_data["amount_str"], order_data["price_str"],
+                 int(order_data["datetime"]), int(order_data["microtimestamp"]))
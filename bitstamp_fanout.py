@@ -0,0 +1,185 @@
+#####################################################################################
+# Filename       : bitstamp_fanout.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Re-publish the frames received from Bitstamp to local
+#                subscribers over a websocket so one ingest process feeds many.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import asyncio
+import json
+import threading
+import time
+import websockets
+from bitstamp_metrics import Counter
+
+# Frames queued per subscriber before the oldest are dropped
+FANOUT_QUEUE_SIZE = 1000
+
+# A subscriber whose queue stays full this many seconds is disconnected
+FANOUT_SLOW_SECONDS = 10
+
+# Subscribing to this channel receives every frame
+ALL_CHANNELS = "*"
+
+# Metrics
+FANOUT_SENT = Counter("bitstamp_fanout_sent_total", "Frames sent to fan-out subscribers.")
+FANOUT_DROPPED = Counter("bitstamp_fanout_dropped_total", "Frames dropped for slow fan-out subscribers.")
+
+
+class FanoutClient:
+    # One subscriber.  Frames wait in a bounded queue drained by send_loop so a
+    # slow reader never holds up the publisher or the other subscribers.
+    def __init__(self, ws, queue_size):
+        self.ws = ws
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.channels = set()
+        self.full_since = None
+        self.dropped = 0
+
+    def offer(self, frame):
+        # Returns False once the client has been too slow for too long
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            FANOUT_DROPPED.inc()
+            now = time.monotonic()
+            if self.full_since is None:
+                self.full_since = now
+            elif now - self.full_since >= FANOUT_SLOW_SECONDS:
+                return False
+        elif self.queue.qsize() < self.queue.maxsize // 2:
+            # Only a reader that catches up clears the slow timer
+            self.full_since = None
+        self.queue.put_nowait(frame)
+        return True
+
+    async def send_loop(self):
+        while True:
+            frame = await self.queue.get()
+            await self.ws.send(frame)
+            FANOUT_SENT.inc()
+
+
+class FanoutServer:
+    # Accepts Bitstamp style bts:subscribe / bts:unsubscribe requests, so a
+    # client written for ws.bitstamp.net only needs its uri changed.  Published
+    # frames are the raw text received from Bitstamp, the same object is queued
+    # to every subscriber of its channel and never re-encoded per client.
+    def __init__(self, host="127.0.0.1", port=0, unix_path=None, queue_size=FANOUT_QUEUE_SIZE):
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.queue_size = queue_size
+        self.channels = {}
+        self.clients = set()
+        self.server = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="fanout-server", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._serve(), self.loop).result()
+        where = self.unix_path or f"{self.host}:{self.port}"
+        print(f"Fan-out server listening on {where}.")
+
+    def stop(self):
+        if not self.thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def publish(self, channel, frame):
+        # Safe to call from any thread, frame is the str received from Bitstamp
+        if self.clients:
+            self.loop.call_soon_threadsafe(self._dispatch, channel, frame)
+
+    def stats(self):
+        return {"clients": len(self.clients),
+                "channels": {channel: len(clients) for channel, clients in self.channels.items()}}
+
+    def _dispatch(self, channel, frame):
+        for client in list(self.channels.get(channel, ())) + list(self.channels.get(ALL_CHANNELS, ())):
+            if not client.offer(frame):
+                print(f"Disconnecting slow fan-out subscriber({client.dropped} frames dropped).")
+                self._remove(client)
+                asyncio.ensure_future(client.ws.close(code=1008, reason="slow consumer"))
+
+    async def _serve(self):
+        if self.unix_path:
+            self.server = await websockets.unix_serve(self._handle_client, self.unix_path)
+        else:
+            self.server = await websockets.serve(self._handle_client, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle_client(self, ws, path=None):
+        client = FanoutClient(ws, self.queue_size)
+        self.clients.add(client)
+        sender = asyncio.ensure_future(client.send_loop())
+        try:
+            async for message in ws:
+                try:
+                    request = json.loads(message)
+                    event = request['event']
+                    channel = request['data']['channel']
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if event == 'bts:subscribe':
+                    self.channels.setdefault(channel, set()).add(client)
+                    client.channels.add(channel)
+                    reply = 'bts:subscription_succeeded'
+                elif event == 'bts:unsubscribe':
+                    self.channels.get(channel, set()).discard(client)
+                    client.channels.discard(channel)
+                    reply = 'bts:unsubscription_succeeded'
+                else:
+                    continue
+                client.offer(json.dumps({"event": reply, "channel": channel, "data": {}}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            self._remove(client)
+
+    def _remove(self, client):
+        self.clients.discard(client)
+        for channel in client.channels:
+            subscribers = self.channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.channels[channel]
+        client.channels = set()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
@@ -0,0 +1,239 @@
+#####################################################################################
+# Filename       : bitstamp_files.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Buffered file outputs for trades, csv through a held open file
+#                handle and columnar parquet/arrow files rotated per pair per hour.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import os
+import csv
+import threading
+from array import array
+from datetime import datetime
+
+# pyarrow is optional and slow to import, it is loaded by the first columnar writer
+pa = pq = ipc = None
+
+# Header written to new csv files, matches the original pandas output
+CSV_HEADER = ["trade_pair", "id", "buy_order_id", "sell_order_id", "amount", "price", "timestamp"]
+
+# Rows buffered before they are written out
+CSV_BATCH_SIZE = 1000
+CSV_FLUSH_INTERVAL = 1.0
+ROW_GROUP_SIZE = 50000
+
+# Columnar file formats
+COLUMNAR_FORMATS = ["parquet", "arrow"]
+
+
+class CsvTradeWriter:
+    # Appends trades to {directory}/{pair}.csv, keeping one file handle open
+    # per pair and writing rows in batches.  A flusher thread writes whatever
+    # is buffered every flush_interval seconds, even when no trades arrive.
+    def __init__(self, directory=".", batch_size=CSV_BATCH_SIZE, flush_interval=CSV_FLUSH_INTERVAL):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.files = {}
+        self.buffers = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self._run, name="csv-flusher", daemon=True)
+        self.flusher.start()
+
+    def add(self, trade, currency):
+        with self.lock:
+            rows = self.buffers.setdefault(currency, [])
+            rows.append((currency, trade.id, trade.buy_order_id, trade.sell_order_id, trade.amount, trade.price,
+                         trade.timestamp))
+            if len(rows) >= self.batch_size:
+                self._write(currency)
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
+        with self.lock:
+            for handle, writer in self.files.values():
+                handle.close()
+            self.files = {}
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def _flush(self):
+        for currency in list(self.buffers):
+            self._write(currency)
+        for handle, writer in self.files.values():
+            handle.flush()
+
+    def _write(self, currency):
+        rows = self.buffers.pop(currency, None)
+        if not rows:
+            return
+        if currency not in self.files:
+            path = os.path.join(self.directory, f'{currency}.csv')
+            new_file = not os.path.isfile(path)
+            handle = open(path, mode="a", newline="")
+            writer = csv.writer(handle)
+            if new_file:
+                writer.writerow(CSV_HEADER)
+            self.files[currency] = (handle, writer)
+        self.files[currency][1].writerows(rows)
+
+
+class TradeColumns:
+    # Typed column buffers for one pair, appended to row by row and handed to
+    # arrow as a single record batch.
+    def __init__(self):
+        self.id = array('q')
+        self.buy_order_id = array('q')
+        self.sell_order_id = array('q')
+        self.amount = array('d')
+        self.price = array('d')
+        self.type = array('b')
+        self.timestamp = array('q')
+        self.microtimestamp = array('q')
+
+    def __len__(self):
+        return len(self.id)
+
+    def append(self, trade):
+        self.id.append(trade.id)
+        self.buy_order_id.append(trade.buy_order_id)
+        self.sell_order_id.append(trade.sell_order_id)
+        self.amount.append(float(trade.amount))
+        self.price.append(float(trade.price))
+        self.type.append(trade.type)
+        self.timestamp.append(trade.timestamp)
+        self.microtimestamp.append(trade.microtimestamp)
+
+    def to_batch(self):
+        return pa.record_batch([
+            pa.array(self.id, type=pa.int64()),
+            pa.array(self.buy_order_id, type=pa.int64()),
+            pa.array(self.sell_order_id, type=pa.int64()),
+            pa.array(self.amount, type=pa.float64()),
+            pa.array(self.price, type=pa.float64()),
+            pa.array(self.type, type=pa.int8()),
+            pa.array(self.timestamp, type=pa.int64()),
+            pa.array(self.microtimestamp, type=pa.int64()),
+        ], schema=trade_schema())
+
+
+def load_pyarrow():
+    global pa, pq, ipc
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+            import pyarrow.ipc
+        except ImportError:
+            raise ImportError("pyarrow is required for columnar output")
+        pa, pq, ipc = pyarrow, pyarrow.parquet, pyarrow.ipc
+    return pa
+
+
+def trade_schema():
+    return pa.schema([("id", pa.int64()), ("buy_order_id", pa.int64()), ("sell_order_id", pa.int64()),
+                      ("amount", pa.float64()), ("price", pa.float64()), ("type", pa.int8()),
+                      ("timestamp", pa.int64()), ("microtimestamp", pa.int64())])
+
+
+class ColumnarTradeWriter:
+    # Streams trades into {directory}/{pair}/{pair}-YYYYMMDDHH.parquet (or .arrow),
+    # one file per pair per hour of trade time.  Each flush of row_group_size
+    # buffered rows becomes one row group / record batch in the open file.
+    def __init__(self, directory=".", file_format="parquet", row_group_size=ROW_GROUP_SIZE):
+        load_pyarrow()
+        if file_format not in COLUMNAR_FORMATS:
+            raise ValueError(f"Unknown columnar format {file_format}")
+        self.directory = directory
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.columns = {}
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def add(self, trade, currency):
+        hour = datetime.utcfromtimestamp(trade.timestamp).strftime("%Y%m%d%H")
+        with self.lock:
+            writer = self.writers.get(currency)
+            if writer is not None and writer[0] != hour:
+                # Trade belongs to a new hour, finish the current file first
+                self._write(currency)
+                writer[1].close()
+                del self.writers[currency]
+            columns = self.columns.setdefault(currency, TradeColumns())
+            columns.append(trade)
+            if currency not in self.writers:
+                self.writers[currency] = (hour, self._open(currency, hour))
+            if len(columns) >= self.row_group_size:
+                self._write(currency)
+
+    def flush(self):
+        with self.lock:
+            for currency in list(self.columns):
+                self._write(currency)
+
+    def close(self):
+        with self.lock:
+            for currency in list(self.columns):
+                self._write(currency)
+            for hour, writer in self.writers.values():
+                writer.close()
+            self.writers = {}
+
+    def _open(self, currency, hour):
+        directory = os.path.join(self.directory, currency)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{currency}-{hour}.{self.file_format}')
+        # Never append to an existing file, a restart in the same hour starts a new part
+        part = 1
+        while os.path.exists(path):
+            path = os.path.join(directory, f'{currency}-{hour}-{part}.{self.file_format}')
+            part += 1
+        if self.file_format == "parquet":
+            return pq.ParquetWriter(path, trade_schema(), compression="snappy")
+        return ipc.new_file(path, trade_schema())
+
+    def _write(self, currency):
+        columns = self.columns.pop(currency, None)
+        if not columns:
+            return
+        writer = self.writers[currency][1]
+        batch = columns.to_batch()
+        if self.file_format == "parquet":
+            writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
@@ -0,0 +1,220 @@
+#####################################################################################
+# Filename       : bitstamp_import.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Bulk import historical trades from csv output files or rest
+#                transaction dumps into the per pair trade tables.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import sys
+import os
+import getopt
+import json
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from bitstamp_config import config
+from bitstamp_sql import BitStampMySql as SQL, WriteRejected
+
+# Load methods
+# insert - multi-row INSERT through the connection pool, duplicate trades are skipped
+# infile - LOAD DATA LOCAL INFILE ... IGNORE, needs local_infile enabled on the server
+IMPORT_METHODS = ["insert", "infile"]
+
+# Rows parsed per chunk and rows per INSERT statement
+CHUNK_ROWS = 100000
+INSERT_ROWS = 10000
+
+# Trade table columns in insert order
+TRADE_COLUMNS = ["id", "buy_order_id", "sell_order_id", "amount", "price", "type", "timestamp"]
+
+
+def pair_from_path(path):
+    # btcusd.csv, btcusd-2021.json and the like
+    return os.path.basename(path).split(".")[0].split("-")[0].lower()
+
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS):
+    # DataFrames of at most chunk_rows rows.  amount and price stay strings so
+    # the exact decimals reach the database.
+    if path.endswith(".json"):
+        with open(path) as f:
+            first = f.read(1)
+        if first == "[":
+            # A saved /api/v2/transactions response
+            with open(path) as f:
+                frame = pd.DataFrame(json.load(f), dtype=str)
+            for start in range(0, len(frame), chunk_rows):
+                yield frame.iloc[start:start + chunk_rows]
+        else:
+            yield from pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=str)
+        return
+    yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str)
+
+
+def normalize(frame):
+    # Turns either input into the trade table columns, dropping unparseable
+    # rows and repeated ids
+    if "tid" in frame.columns:
+        # Rest transactions have no order ids
+        frame = frame.rename(columns={"tid": "id", "date": "timestamp"})
+        frame = frame.assign(buy_order_id="0", sell_order_id="0")
+    frame = frame.dropna(subset=[column for column in TRADE_COLUMNS if column in frame.columns])
+    ids = {}
+    for column in ("id", "buy_order_id", "sell_order_id", "timestamp"):
+        ids[column] = pd.to_numeric(frame[column], errors="coerce")
+    valid = np.logical_and.reduce([values.notna().to_numpy() for values in ids.values()])
+    frame = frame[valid]
+    ids = {column: values[valid].astype(np.int64) for column, values in ids.items()}
+    if "type" in frame.columns:
+        trade_type = pd.to_numeric(frame["type"], errors="coerce").fillna(0).astype(np.int8)
+    else:
+        # The csv output has no type, the taker's order is the newer one and
+        # order ids grow over time, so a larger buy order id means a buy
+        trade_type = np.where(ids["buy_order_id"] > ids["sell_order_id"], 0, 1).astype(np.int8)
+    frame = pd.DataFrame({"id": ids["id"], "buy_order_id": ids["buy_order_id"],
+                          "sell_order_id": ids["sell_order_id"], "amount": frame["amount"],
+                          "price": frame["price"], "type": trade_type, "timestamp": ids["timestamp"]})
+    return frame.drop_duplicates("id")
+
+
+def split_pairs(frame, pair):
+    # csv output files carry the pair on every row
+    if "trade_pair" not in frame.columns:
+        return [(pair, frame)]
+    return [(group.lower(), rows) for group, rows in frame.groupby("trade_pair", sort=False)]
+
+
+def load_insert(db, frame, table):
+    rows = list(frame.itertuples(index=False, name=None))
+    failed = 0
+    for start in range(0, len(rows), INSERT_ROWS):
+        batch = rows[start:start + INSERT_ROWS]
+        try:
+            if not db.create_trades(batch, table):
+                failed += len(batch)
+        except WriteRejected:
+            failed += len(batch)
+    return failed
+
+
+def load_infile(db, frame, table):
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+        frame.to_csv(f, header=False, index=False)
+    try:
+        return 0 if db.load_trades_file(f.name, table) else len(frame)
+    finally:
+        os.unlink(f.name)
+
+
+def import_pair(pair, paths, method=IMPORT_METHODS[0], chunk_rows=CHUNK_ROWS):
+    # Runs in its own process, one per pair.  Returns (rows read, rows failed, seconds).
+    db = SQL(config.get('sql_host'), config.get('sql_user'), config.get('sql_pass'), config.get('sql_db'),
+             pool_size=2)
+    load = load_infile if method == IMPORT_METHODS[1] else load_insert
+    ensured = set()
+    rows = 0
+    failed = 0
+    start = time.monotonic()
+    for path in paths:
+        for chunk in read_chunks(path, chunk_rows):
+            for table, frame in split_pairs(chunk, pair):
+                frame = normalize(frame)
+                if table not in ensured:
+                    db.ensure_trade_table(table)
+                    ensured.add(table)
+                failed += load(db, frame, table)
+                rows += len(frame)
+            elapsed = time.monotonic() - start
+            print(f"{pair}: {rows:,} rows in {elapsed:.1f} seconds ({rows / elapsed if elapsed else 0:,.0f} rows/sec)",
+                  flush=True)
+    db.pool.close()
+    return rows, failed, time.monotonic() - start
+
+
+def run_import(paths, pair=None, method=IMPORT_METHODS[0], jobs=None, chunk_rows=CHUNK_ROWS):
+    # Files are grouped by pair and each pair is imported by its own process
+    by_pair = {}
+    for path in paths:
+        by_pair.setdefault(pair or pair_from_path(path), []).append(path)
+    start = time.monotonic()
+    total = 0
+    total_failed = 0
+    with ProcessPoolExecutor(max_workers=jobs or min(len(by_pair), os.cpu_count() or 1)) as executor:
+        futures = {executor.submit(import_pair, name, files, method, chunk_rows): name
+                   for name, files in by_pair.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                rows, failed, seconds = future.result()
+            except Exception as e:
+                print(f"{name}: import failed({e}).")
+                continue
+            total += rows
+            total_failed += failed
+            print(f"{name}: done, {rows:,} rows ({failed:,} failed) in {seconds:.1f} seconds.")
+    elapsed = time.monotonic() - start
+    print(f"Imported {total:,} rows ({total_failed:,} failed) in {elapsed:.1f} seconds "
+          f"({total / elapsed if elapsed else 0:,.0f} rows/sec).")
+    return total, total_failed
+
+
+if __name__ == "__main__":
+    pair = None
+    method = IMPORT_METHODS[0]
+    jobs = None
+    chunk_rows = CHUNK_ROWS
+    cmd_example = ('bitstamp_import.py -p <currency_pair> -m <insert or infile> -j <parallel pairs> '
+                   '--chunk=<rows per chunk> <csv or json files>')
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hp:m:j:", ["pair=", "method=", "jobs=", "chunk=", "help"])
+    except getopt.GetoptError:
+        print(cmd_example)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(cmd_example)
+            sys.exit(0)
+        elif opt in ("-p", "--pair"):
+            pair = arg
+        elif opt in ("-m", "--method"):
+            if arg not in IMPORT_METHODS:
+                print(f'Method not valid.  Use one of {", ".join(IMPORT_METHODS)}.')
+                sys.exit(2)
+            method = arg
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
+        elif opt == "--chunk":
+            chunk_rows = int(arg)
+    if not args:
+        print(cmd_example)
+        sys.exit(2)
+
+    total, failed = run_import(args, pair=pair, method=method, jobs=jobs, chunk_rows=chunk_rows)
+    sys.exit(1 if failed else 0)
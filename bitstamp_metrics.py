@@ -0,0 +1,150 @@
+#####################################################################################
+# Filename       : bitstamp_metrics.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Counters and latency histograms for the watcher pipeline,
+#                rendered in the prometheus text format.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import threading
+from bisect import bisect_left
+
+# Default histogram buckets in seconds, 10us to 10s
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+# Every metric created, in creation order
+REGISTRY = []
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    # Monotonic counter with one value per label tuple, e.g. inc(("btcusd-ab12c",))
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, label_values=(), amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+
+    def samples(self, labels=(), label_values=()):
+        # labels and label_values are put in front of every series, e.g. the worker process
+        names = labels + self.labels
+        with self.lock:
+            return [f"{self.name}{format_labels(names, label_values + values)} {value}"
+                    for values, value in self.values.items()]
+
+
+class Histogram:
+    # Fixed bucket histogram.  observe() costs one bisect and three additions.
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, label_values=()):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                # bucket counts, then the +Inf bucket, sum and count
+                series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+
+    def samples(self, labels=(), label_values=()):
+        names = labels + self.labels
+        lines = []
+        with self.lock:
+            for values, series in self.values.items():
+                values = label_values + values
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{format_labels(names + ('le',), values + (bound,))} "
+                                 f"{cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(names, values)} {series[-2]}")
+                lines.append(f"{self.name}_count{format_labels(names, values)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    # Value read when the metrics are rendered, collect returns {label_values: value}
+    def __init__(self, name, documentation, collect, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+
+    def samples(self, labels=(), label_values=()):
+        names = labels + self.labels
+        return [f"{self.name}{format_labels(names, label_values + values)} {value}"
+                for values, value in self.collect().items()]
+
+
+def metric_samples(labels=(), label_values=()):
+    # {metric name: (header lines, sample lines)} for every metric in this process
+    return {metric.name: (metric.header(), metric.samples(labels, label_values)) for metric in REGISTRY}
+
+
+def render_metrics(remote=()):
+    # remote holds metric_samples() from other processes, e.g. the watcher
+    # workers, listed under the metric of the same name in this process
+    metrics = metric_samples()
+    for samples in remote:
+        for name, (header, lines) in samples.items():
+            metrics.setdefault(name, (header, []))[1].extend(lines)
+    lines = []
+    for header, samples in metrics.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,209 @@
+#####################################################################################
+# Filename       : bitstamp_mux.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Asyncio engine multiplexing every watcher subscription over a
+#                small pool of websocket connections.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import asyncio
+import json
+import socket
+import threading
+import websockets
+from bitstamp_decode import timed_loads
+from bitstamp_reconnect import backoff_delay
+
+def make_subscribe_json(channel, event="bts:subscribe"):
+    subscription = {
+        "event": event,
+        "data": {
+            "channel": channel
+        }
+    }
+    return json.dumps(subscription)
+
+
+class MuxConnection:
+    # One websocket carrying many bts:subscribe channels.  Messages are routed
+    # by their channel field to every watcher subscribed to that channel.
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+        self.routes = {}
+        self.ws = None
+        self.subscribed = None
+        self.task = None
+
+    def watcher_count(self):
+        return sum(len(watchers) for watchers in self.routes.values())
+
+    async def subscribe(self, watcher):
+        channel = watcher.subscription_channel()
+        watchers = self.routes.setdefault(channel, [])
+        watchers.append(watcher)
+        self.subscribed.set()
+        if len(watchers) == 1 and self.ws is not None:
+            await self._send(make_subscribe_json(channel))
+        if self.ws is not None:
+            watcher.on_connect()
+
+    async def unsubscribe(self, watcher):
+        channel = watcher.subscription_channel()
+        watchers = self.routes.get(channel, [])
+        if watcher in watchers:
+            watchers.remove(watcher)
+        if not watchers:
+            self.routes.pop(channel, None)
+            if self.ws is not None:
+                await self._send(make_subscribe_json(channel, event="bts:unsubscribe"))
+        if not self.routes:
+            self.subscribed.clear()
+
+    async def run(self):
+        attempt = 0
+        while self.engine.running:
+            # Only hold a socket open while there is something to watch
+            await self.subscribed.wait()
+            try:
+                async with websockets.connect(self.engine.uri) as ws:
+                    self.ws = ws
+                    for channel in list(self.routes):
+                        await ws.send(make_subscribe_json(channel))
+                    for watchers in list(self.routes.values()):
+                        for watcher in watchers:
+                            watcher.on_connect()
+                    attempt = 0
+                    await self._monitor(ws)
+            except asyncio.CancelledError:
+                raise
+            except (ConnectionError, TimeoutError, websockets.ConnectionClosed):
+                print(f'Connection {self.index} to server has been lost, attempting to reconnect...')
+            except socket.gaierror:
+                print(f'Network connection is down, will retry when network connection is re-established.')
+            except Exception as e:
+                print(f"ERROR: {type(e)} {e}")
+            finally:
+                self.ws = None
+                for watchers in list(self.routes.values()):
+                    for watcher in watchers:
+                        watcher.on_disconnect()
+            # Wait before reconnecting, backing off while the server stays unreachable
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    async def _monitor(self, ws):
+        label_values = (f"mux-{self.index}",)
+        capture = self.engine.capture
+        fanout = self.engine.fanout
+        async for message in ws:
+            if capture is not None:
+                capture.write(message)
+            resp = timed_loads(message, label_values)
+            if not resp:
+                print("empty")
+                continue
+            if resp['event'] == 'bts:request_reconnect':
+                return
+            if fanout is not None:
+                fanout.publish(resp.get('channel'), message)
+            for watcher in self.routes.get(resp.get('channel'), ()):
+                try:
+                    watcher.handle_message(resp)
+                except Exception as e:
+                    print(f"ERROR: {watcher.name} {type(e)} {e}")
+
+    async def _send(self, message):
+        try:
+            await self.ws.send(message)
+        except websockets.ConnectionClosed:
+            # run() resubscribes every channel on reconnect
+            pass
+
+
+class WatcherEngine:
+    # Runs an asyncio loop in a background thread.  Watchers are spread over
+    # the connection pool, always joining the least loaded connection.
+    def __init__(self, uri, connections=1, capture=None, fanout=None):
+        self.uri = uri
+        self.capture = capture
+        self.fanout = fanout
+        self.running = False
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="watcher-engine", daemon=True)
+        self.pool = [MuxConnection(self, i) for i in range(max(1, connections))]
+        self.watchers = {}
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        for conn in self.pool:
+            conn.task = self._call(self._start_connection(conn))
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        for conn in self.pool:
+            self._call(self._stop_connection(conn))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def add_watcher(self, watcher):
+        conn = min(self.pool, key=lambda c: c.watcher_count())
+        self.watchers[watcher.name] = (watcher, conn)
+        self._call(conn.subscribe(watcher))
+
+    def remove_watcher(self, name):
+        watcher, conn = self.watchers.pop(name, (None, None))
+        if watcher is not None:
+            self._call(conn.unsubscribe(watcher))
+        return watcher
+
+    def get_watcher(self, name):
+        return self.watchers.get(name, (None, None))[0]
+
+    def list_watchers(self):
+        return [watcher for watcher, conn in self.watchers.values()]
+
+    async def _start_connection(self, conn):
+        conn.subscribed = asyncio.Event()
+        return asyncio.ensure_future(conn.run())
+
+    async def _stop_connection(self, conn):
+        if conn.task is not None:
+            conn.task.cancel()
+        if conn.ws is not None:
+            await conn.ws.close()
+
+    def _call(self, coro):
+        # Run a coroutine on the engine loop from any thread and wait for the result
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
@@ -0,0 +1,222 @@
+#####################################################################################
+# Filename       : bitstamp_orderbook.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : In memory order books kept up to date from the order_book,
+#                detail_order_book and diff_order_book channels.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from bitstamp_reconnect import backoff_delay
+
+# Rest endpoint used to fetch a full book when resynchronising diff_order_book
+ORDER_BOOK_URL = "https://www.bitstamp.net/api/v2/order_book/{currency_pair}/"
+
+# Diffs held while a snapshot is being fetched
+MAX_PENDING_DIFFS = 10000
+
+
+def fetch_order_book(currency_pair, url=ORDER_BOOK_URL, timeout=10):
+    # urllib.request is imported on first use, most processes never call it
+    from urllib.request import urlopen
+    with urlopen(url.format(currency_pair=currency_pair), timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+class BookSide:
+    # Price levels for one side of the book.  prices is kept sorted ascending
+    # and located with bisect, amounts are looked up by price in a dict.  The
+    # best bid is the last price and the best ask the first, both O(1).
+    def __init__(self, is_bid):
+        self.is_bid = is_bid
+        self.prices = []
+        self.amounts = {}
+
+    def __len__(self):
+        return len(self.prices)
+
+    def load(self, entries):
+        # Replace the side from a snapshot.  detail_order_book lists one entry per
+        # order, [price, amount, order_id], so amounts at the same price are summed.
+        amounts = {}
+        for entry in entries:
+            price = float(entry[0])
+            amounts[price] = amounts.get(price, 0) + float(entry[1])
+        self.amounts = amounts
+        self.prices = sorted(amounts)
+
+    def update(self, price, amount):
+        # An amount of zero removes the level
+        if amount == 0:
+            if self.amounts.pop(price, None) is not None:
+                del self.prices[bisect_left(self.prices, price)]
+        else:
+            if price not in self.amounts:
+                self.prices.insert(bisect_left(self.prices, price), price)
+            self.amounts[price] = amount
+
+    def best(self):
+        if not self.prices:
+            return None
+        return self.prices[-1] if self.is_bid else self.prices[0]
+
+    def top(self, depth):
+        prices = self.prices[:-depth - 1:-1] if self.is_bid else self.prices[:depth]
+        return [[price, self.amounts[price]] for price in prices]
+
+
+class OrderBook:
+    # Book for one channel and currency pair.  order_book/detail_order_book messages
+    # replace the book, diff_order_book messages are applied level by level.
+    # Bitstamp diffs carry no sequence number, so a diff older than the book,
+    # a crossed book or a reconnect marks the book stale and it is rebuilt from
+    # a rest snapshot while newer diffs are held in pending.  Failed snapshot
+    # fetches back off, a diff arriving sooner does not fetch again.
+    def __init__(self, channel, currency_pair, snapshot_url=ORDER_BOOK_URL):
+        self.channel = channel
+        self.currency_pair = currency_pair
+        self.snapshot_url = snapshot_url
+        self.bids = BookSide(is_bid=True)
+        self.asks = BookSide(is_bid=False)
+        self.microtimestamp = 0
+        self.synced = False
+        self.resyncing = False
+        self.attempt = 0
+        self.retry_at = 0
+        self.pending = deque(maxlen=MAX_PENDING_DIFFS)
+        self.lock = threading.Lock()
+
+    def apply_snapshot(self, data):
+        with self.lock:
+            self._load(data)
+            self.synced = True
+
+    def apply_diff(self, data):
+        with self.lock:
+            if not self.synced:
+                self.pending.append(data)
+                self._resync()
+                return False
+            if int(data["microtimestamp"]) < self.microtimestamp:
+                print(f"Order book {self.currency_pair} out of sequence, resynchronising.")
+                self.invalidate()
+                self.pending.append(data)
+                self._resync()
+                return False
+            self._apply(data)
+            if self.bids.prices and self.asks.prices and self.bids.best() >= self.asks.best():
+                print(f"Order book {self.currency_pair} crossed, resynchronising.")
+                self.invalidate()
+                self._resync()
+                return False
+            return True
+
+    def invalidate(self):
+        # Called on reconnect, any diffs missed while disconnected make the book unusable
+        self.synced = False
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def mid(self):
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return (bid + ask) / 2
+
+    def spread(self):
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return ask - bid
+
+    def depth(self, levels=10):
+        with self.lock:
+            return {"channel": self.channel, "currency_pair": self.currency_pair, "synced": self.synced,
+                    "microtimestamp": self.microtimestamp, "bids": self.bids.top(levels),
+                    "asks": self.asks.top(levels), "mid": self.mid(), "spread": self.spread()}
+
+    def _load(self, data):
+        self.bids.load(data["bids"])
+        self.asks.load(data["asks"])
+        self.microtimestamp = int(data["microtimestamp"])
+
+    def _apply(self, data):
+        for level in data["bids"]:
+            self.bids.update(float(level[0]), float(level[1]))
+        for level in data["asks"]:
+            self.asks.update(float(level[0]), float(level[1]))
+        self.microtimestamp = int(data["microtimestamp"])
+
+    def _resync(self):
+        # Fetch the snapshot off the receive path, diffs keep queueing meanwhile
+        if self.resyncing or time.monotonic() < self.retry_at:
+            return
+        self.resyncing = True
+        threading.Thread(target=self._fetch_snapshot, name=f"order-book-{self.currency_pair}", daemon=True).start()
+
+    def _fetch_snapshot(self):
+        try:
+            snapshot = fetch_order_book(self.currency_pair, url=self.snapshot_url)
+        except Exception as e:
+            print(f"Failed to fetch order book snapshot for {self.currency_pair}({e}).")
+            snapshot = None
+        with self.lock:
+            self.resyncing = False
+            if snapshot is None:
+                self.retry_at = time.monotonic() + backoff_delay(self.attempt)
+                self.attempt += 1
+                return
+            self.attempt = 0
+            self._load(snapshot)
+            # Replay held diffs newer than the snapshot
+            while self.pending:
+                data = self.pending.popleft()
+                if int(data["microtimestamp"]) > self.microtimestamp:
+                    self._apply(data)
+            self.synced = True
+
+
+# Books shared by every watcher, keyed by (channel, currency pair).  The channels
+# carry different depths, a top of book snapshot must not replace a full book.
+order_books = {}
+order_books_lock = threading.Lock()
+
+
+def get_order_book(channel, currency_pair):
+    with order_books_lock:
+        key = (channel, currency_pair)
+        if key not in order_books:
+            order_books[key] = OrderBook(channel, currency_pair)
+        return order_books[key]
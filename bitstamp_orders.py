@@ -0,0 +1,128 @@
+#####################################################################################
+# Filename       : bitstamp_orders.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Open orders per pair maintained from the live_orders channel
+#                and the order flow statistics derived from them.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import threading
+import time
+from collections import deque
+
+# Seconds of events the arrival and cancel rates are averaged over
+RATE_WINDOW = 60
+
+BUY = 0
+SELL = 1
+SIDES = ("buy", "sell")
+
+
+class OpenOrders:
+    # Open orders for one pair keyed by order id, each event is a dict update.
+    # Resting size and order count per side are kept as running totals and
+    # event counts in one second buckets, so stats() never scans the orders.
+    # order_deleted is sent for fills as well as cancels, the stream does not
+    # say which.  Orders placed before the subscription started are unknown
+    # until they change, changes and deletes for them are counted as unseen.
+    def __init__(self, currency_pair, window=RATE_WINDOW):
+        self.currency_pair = currency_pair
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Orders missed while disconnected would leave the table wrong, start again
+        with self.lock:
+            self.orders = {}
+            self.resting = [0.0, 0.0]
+            self.counts = [0, 0]
+            self.totals = {"created": 0, "changed": 0, "deleted": 0, "unseen": 0}
+            self.buckets = deque()
+            self.since = time.time()
+
+    def apply(self, event, order):
+        # event is order_created, order_changed or order_deleted
+        amount = float(order.amount)
+        with self.lock:
+            old = self.orders.pop(order.id, None)
+            if old is not None:
+                self.resting[old[0]] -= old[1]
+                self.counts[old[0]] -= 1
+            elif event != "order_created":
+                self.totals["unseen"] += 1
+            if event != "order_deleted":
+                self.orders[order.id] = (order.order_type, amount, order.price)
+                self.resting[order.order_type] += amount
+                self.counts[order.order_type] += 1
+            name = event[6:]
+            self.totals[name] += 1
+            self._count(order.datetime, name)
+
+    def get(self, order_id):
+        # (order_type, amount, price) or None
+        return self.orders.get(order_id)
+
+    def stats(self, now=None):
+        # Buckets are only pruned as events arrive, a quiet stream would keep
+        # counting old events so they are dropped against the clock here too
+        with self.lock:
+            if self.buckets:
+                now = int(time.time() if now is None else now)
+                self._prune(max(now, self.buckets[-1][0]))
+            rates = {"created": 0, "changed": 0, "deleted": 0}
+            for second, counts in self.buckets:
+                for name, count in counts.items():
+                    rates[name] += count
+            return {"currency_pair": self.currency_pair, "since": self.since,
+                    "open_orders": dict(zip(SIDES, self.counts)),
+                    "resting_amount": dict(zip(SIDES, self.resting)),
+                    "rates_per_second": {name: count / self.window for name, count in rates.items()},
+                    "totals": dict(self.totals)}
+
+    def _count(self, second, name):
+        if not self.buckets or second > self.buckets[-1][0]:
+            self.buckets.append((second, {"created": 0, "changed": 0, "deleted": 0}))
+            self._prune(second)
+        # An event out of order is counted in the newest bucket
+        self.buckets[-1][1][name] += 1
+
+    def _prune(self, second):
+        while self.buckets and self.buckets[0][0] <= second - self.window:
+            self.buckets.popleft()
+
+
+# Open order tables shared by every watcher, keyed by currency pair
+open_orders = {}
+open_orders_lock = threading.Lock()
+
+
+def get_open_orders(currency_pair):
+    with open_orders_lock:
+        if currency_pair not in open_orders:
+            open_orders[currency_pair] = OpenOrders(currency_pair)
+        return open_orders[currency_pair]
@@ -0,0 +1,139 @@
+#####################################################################################
+# Filename       : bitstamp_queue.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Bounded ingest queue between the socket receive loop and the
+#                workers writing to the outputs.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import os
+import pickle
+import threading
+from collections import deque
+
+# Backpressure policies when the queue is full
+# block       - the receive loop waits for a worker to make room
+# drop_oldest - the oldest queued message is discarded
+# spill       - new messages are appended to a spill file and read back in order
+QUEUE_POLICIES = ["block", "drop_oldest", "spill"]
+
+QUEUE_SIZE = 10000
+SPILL_DIR = "spill"
+
+
+class IngestQueue:
+    # Bounded FIFO ring buffer.  Once anything has spilled, every new message
+    # goes to the spill file as well until it has been read back, so messages
+    # always come out in the order they were received.
+    def __init__(self, name, maxsize=QUEUE_SIZE, policy=QUEUE_POLICIES[0], spill_dir=SPILL_DIR):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.buffer = deque()
+        self.closed = False
+        self.lock = threading.Condition()
+        self.spill_path = os.path.join(spill_dir, f"{name}.spill")
+        self.spill_file = None
+        self.spill_read = 0
+        self.spill_pending = 0
+        # Counters reported by stats()
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_water = 0
+
+    def put(self, item):
+        with self.lock:
+            if self.policy == QUEUE_POLICIES[2] and (self.spill_pending or len(self.buffer) >= self.maxsize):
+                self._spill(item)
+            else:
+                if len(self.buffer) >= self.maxsize:
+                    if self.policy == QUEUE_POLICIES[0]:
+                        while len(self.buffer) >= self.maxsize and not self.closed:
+                            self.lock.wait()
+                    else:
+                        self.buffer.popleft()
+                        self.dropped += 1
+                self.buffer.append(item)
+                self.high_water = max(self.high_water, len(self.buffer))
+            self.enqueued += 1
+            self.lock.notify_all()
+
+    def get_many(self, max_items=500, timeout=None):
+        # Returns up to max_items messages, an empty list once closed and drained
+        with self.lock:
+            while not self.buffer and not self.spill_pending and not self.closed:
+                if not self.lock.wait(timeout):
+                    return []
+            if not self.buffer and self.spill_pending:
+                self._unspill(self.maxsize)
+            items = []
+            while self.buffer and len(items) < max_items:
+                items.append(self.buffer.popleft())
+            self.dequeued += len(items)
+            self.lock.notify_all()
+            return items
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    def depth(self):
+        return len(self.buffer) + self.spill_pending
+
+    def stats(self):
+        return {"depth": self.depth(), "max_size": self.maxsize, "policy": self.policy,
+                "high_water": self.high_water, "enqueued": self.enqueued, "dequeued": self.dequeued,
+                "dropped": self.dropped, "spilled": self.spilled, "spill_pending": self.spill_pending}
+
+    def _spill(self, item):
+        if self.spill_file is None:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            self.spill_file = open(self.spill_path, "w+b")
+            self.spill_read = 0
+        self.spill_file.seek(0, os.SEEK_END)
+        pickle.dump(item, self.spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.spill_pending += 1
+        self.spilled += 1
+
+    def _unspill(self, count):
+        self.spill_file.flush()
+        self.spill_file.seek(self.spill_read)
+        while self.spill_pending and count:
+            self.buffer.append(pickle.load(self.spill_file))
+            self.spill_pending -= 1
+            count -= 1
+        self.spill_read = self.spill_file.tell()
+        if not self.spill_pending:
+            # Everything has been read back, start the next spill from an empty file
+            self.spill_file.close()
+            self.spill_file = None
+            os.remove(self.spill_path)
@@ -0,0 +1,79 @@
+#####################################################################################
+# Filename       : bitstamp_recent.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : In memory ring buffer of the most recent trades per pair so
+#                latest trade requests are served without a database query.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import threading
+from collections import deque
+from itertools import islice
+
+# Trades kept in memory per pair
+RECENT_TRADES = 1000
+
+
+def trade_to_dict(trade):
+    # trade is a Trade or a trade table row, both start with the table columns
+    return {"id": trade[0], "buy_order_id": trade[1], "sell_order_id": trade[2], "amount": str(trade[3]),
+            "price": str(trade[4]), "type": trade[5], "timestamp": trade[6]}
+
+
+class RecentTrades:
+    # Fixed size ring of the newest trades for one pair, the oldest trade
+    # falls out when a new one is added
+    def __init__(self, currency_pair, size=RECENT_TRADES):
+        self.currency_pair = currency_pair
+        self.trades = deque(maxlen=size)
+        self.last_trade_id = 0
+        self.lock = threading.Lock()
+
+    def add(self, trade):
+        with self.lock:
+            # Several watchers can feed the same pair, keep each trade once
+            if trade.id <= self.last_trade_id:
+                return
+            self.last_trade_id = trade.id
+            self.trades.append(trade)
+
+    def latest(self, limit=100):
+        # Newest first
+        with self.lock:
+            return list(islice(reversed(self.trades), limit))
+
+
+# Buffers shared by every watcher, keyed by currency pair
+recent_trades = {}
+recent_trades_lock = threading.Lock()
+
+
+def get_recent_trades(currency_pair):
+    with recent_trades_lock:
+        if currency_pair not in recent_trades:
+            recent_trades[currency_pair] = RecentTrades(currency_pair)
+        return recent_trades[currency_pair]
@@ -0,0 +1,83 @@
+#####################################################################################
+# Filename       : bitstamp_reconnect.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Reconnect backoff and rest backfill of trades missed while a
+#                websocket was down.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import random
+import time
+from bitstamp_decode import loads, Trade
+
+# Rest endpoint listing recent trades, time is one of minute, hour or day
+TRANSACTIONS_URL = "https://www.bitstamp.net/api/v2/transactions/{currency_pair}/?time={time}"
+
+# Reconnect backoff in seconds
+BACKOFF_BASE = 1
+BACKOFF_CAP = 60
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # Exponential backoff with full jitter, attempt counts from 0
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def fetch_transactions(currency_pair, period, url=TRANSACTIONS_URL, timeout=10):
+    # urllib.request is imported on first use, most processes never call it
+    from urllib.request import urlopen
+    with urlopen(url.format(currency_pair=currency_pair, time=period), timeout=timeout) as resp:
+        return loads(resp.read())
+
+
+def parse_transaction(transaction):
+    # Sample transaction
+    # {"date": "1609777594", "tid": "139255607", "amount": "0.06400000", "price": "30859.03", "type": "0"}
+    # The rest api does not return order ids or microtimestamps, order ids are
+    # stored as 0 and the microtimestamp is taken from the whole second.
+    timestamp = int(transaction["date"])
+    return Trade(int(transaction["tid"]), 0, 0, transaction["amount"], transaction["price"],
+                 int(transaction["type"]), timestamp, timestamp * 1000000)
+
+
+def backfill_trades(currency_pair, last_trade_id, last_microtimestamp, url=TRANSACTIONS_URL):
+    # Returns the trades after last_trade_id in id order.  The smallest rest
+    # window covering the gap is requested, gaps over a day are only partly
+    # recoverable.
+    gap = time.time() - last_microtimestamp / 1000000
+    if gap < 60:
+        period = "minute"
+    elif gap < 3600:
+        period = "hour"
+    else:
+        period = "day"
+        if gap > 86400:
+            print(f"Trade gap for {currency_pair} is over a day, only the last day can be backfilled.")
+    trades = [parse_transaction(t) for t in fetch_transactions(currency_pair, period, url=url)]
+    trades = [t for t in trades if t.id > last_trade_id]
+    trades.sort(key=lambda t: t.id)
+    return trades
@@ -0,0 +1,323 @@
+#####################################################################################
+# Filename       : bitstamp_retention.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Archive trades older than the retention window to parquet, keep
+#                downsampled candles for them and delete them in small batches.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import sys
+import os
+import getopt
+import threading
+import time
+from array import array
+import bitstamp_files
+from bitstamp_candles import Candle
+from bitstamp_decode import Trade
+from bitstamp_files import TradeColumns, load_pyarrow, trade_schema
+from bitstamp_sql import check_table_name
+
+# Days of trades kept in the trade tables
+RETENTION_DAYS = 90
+
+# Seconds between maintenance runs
+RETENTION_INTERVAL = 3600
+
+ARCHIVE_DIR = "archive"
+
+# Rows read from the database per page and written per parquet row group
+ARCHIVE_PAGE_SIZE = 50000
+
+# Rows per DELETE and the pause between them, small batches keep row locks short
+DELETE_BATCH_SIZE = 5000
+DELETE_PAUSE = 0.05
+
+# Candles kept for archived trades, written to the candles table
+DOWNSAMPLE_INTERVALS = {"1m": 60, "1h": 3600}
+CANDLE_BATCH_SIZE = 1000
+
+# File in each pair's archive directory holding the cutoff the candles were last written up to
+DOWNSAMPLED_FILE = "downsampled_before"
+
+
+def retention_cutoff(now, days=RETENTION_DAYS):
+    # Unix time trades older than are archived, on an hour so every candle is complete
+    cutoff = int(now) - days * 86400
+    return cutoff - cutoff % 3600
+
+
+def read_downsampled(directory, currency_pair):
+    # Trades older than this already have their candles, 0 when none do
+    try:
+        with open(os.path.join(directory, currency_pair, DOWNSAMPLED_FILE)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_downsampled(directory, currency_pair, cutoff):
+    path = os.path.join(directory, currency_pair, DOWNSAMPLED_FILE)
+    with open(path + ".tmp", "w") as f:
+        f.write(str(cutoff))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class Downsampler:
+    # Candles for trades read in timestamp order, add returns the candles it closed
+    def __init__(self, currency_pair, intervals=DOWNSAMPLE_INTERVALS):
+        self.currency_pair = currency_pair
+        self.intervals = intervals
+        self.current = {}
+
+    def add(self, timestamp, price, amount):
+        closed = []
+        for name, seconds in self.intervals.items():
+            start = timestamp - timestamp % seconds
+            candle = self.current.get(name)
+            if candle is None or start > candle.start:
+                if candle is not None:
+                    closed.append(self._row(name, candle))
+                self.current[name] = Candle(start, price, amount)
+            else:
+                candle.add(price, amount)
+        return closed
+
+    def finish(self):
+        closed = [self._row(name, candle) for name, candle in self.current.items()]
+        self.current = {}
+        return closed
+
+    def _row(self, name, candle):
+        return (self.currency_pair, name, candle.start, candle.open, candle.high, candle.low, candle.close,
+                candle.volume, candle.vwap(), candle.trades)
+
+
+def archive_trades(db_conn, currency_pair, cutoff, directory=ARCHIVE_DIR, page_size=ARCHIVE_PAGE_SIZE,
+                   delete_batch_size=DELETE_BATCH_SIZE, stopped=None):
+    # Streams trades older than cutoff into {directory}/{pair}/{pair}-{cutoff}.parquet,
+    # writes their candles, then deletes the exported rows by id in batches of
+    # delete_batch_size.  A row that lands in the same time range after it was read,
+    # e.g. from an import, is left for the next run.  The exported ids are held as 8
+    # byte ints until the deletes.  Nothing is deleted unless the file and the
+    # candles were written.  If stopped is set part way through the deletes the
+    # remaining rows are archived again by the next run, so archives can overlap and
+    # readers should de-duplicate on id.  Candles are only built for trades newer
+    # than the previous run's cutoff, the leftovers of an interrupted run are a part
+    # of candles written from every trade.
+    table = check_table_name(currency_pair)
+    load_pyarrow()
+    os.makedirs(os.path.join(directory, currency_pair), exist_ok=True)
+    path = os.path.join(directory, currency_pair, f"{currency_pair}-{cutoff}.parquet")
+    part = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, currency_pair, f"{currency_pair}-{cutoff}-{part}.parquet")
+        part += 1
+    temp_path = path + ".tmp"
+    downsampled = read_downsampled(directory, currency_pair)
+    downsampler = Downsampler(currency_pair)
+    columns = TradeColumns()
+    candles = []
+    batches = []
+    ids = array('q')
+    first = last = None
+    archived = 0
+    candle_count = 0
+    writer = bitstamp_files.pq.ParquetWriter(temp_path, trade_schema(), compression="zstd")
+    try:
+        for row in db_conn.iter_trades(table, end=cutoff, page_size=page_size):
+            if not ids:
+                first = row[6]
+            last = row[6]
+            ids.append(row[0])
+            if len(ids) == delete_batch_size:
+                batches.append((first, last, ids))
+                ids = array('q')
+            # The tables keep whole seconds, microtimestamp is rebuilt from timestamp
+            columns.append(Trade(*row[:7], row[6] * 1000000))
+            archived += 1
+            if row[6] >= downsampled:
+                candles.extend(downsampler.add(row[6], float(row[4]), float(row[3])))
+            if len(columns) >= page_size:
+                writer.write_table(bitstamp_files.pa.Table.from_batches([columns.to_batch()]))
+                columns = TradeColumns()
+            if len(candles) >= CANDLE_BATCH_SIZE:
+                if not db_conn.create_candles(candles):
+                    raise RuntimeError("Failed to write downsampled candles")
+                candle_count += len(candles)
+                candles = []
+        if len(columns):
+            writer.write_table(bitstamp_files.pa.Table.from_batches([columns.to_batch()]))
+        candles.extend(downsampler.finish())
+        if candles:
+            if not db_conn.create_candles(candles):
+                raise RuntimeError("Failed to write downsampled candles")
+            candle_count += len(candles)
+    except BaseException:
+        writer.close()
+        os.remove(temp_path)
+        raise
+    writer.close()
+    if not archived:
+        os.remove(temp_path)
+        return {"currency_pair": currency_pair, "archived": 0, "deleted": 0, "candles": 0, "file": None}
+    if cutoff > downsampled:
+        write_downsampled(directory, currency_pair, cutoff)
+    if ids:
+        batches.append((first, last, ids))
+    # The file is complete on disk before any row is deleted
+    with open(temp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    deleted = 0
+    for first, last, ids in batches:
+        if stopped is not None and stopped.is_set():
+            break
+        deleted += db_conn.delete_trades(table, first, last, ids)
+        time.sleep(DELETE_PAUSE)
+    return {"currency_pair": currency_pair, "archived": archived, "deleted": deleted, "candles": candle_count,
+            "file": path}
+
+
+class RetentionJob(threading.Thread):
+    # Trade table maintenance once every interval seconds.  Partitions are
+    # topped up for every table returned by tables(), the trade tables of
+    # pairs() by default, so a long running process never writes into pmax.
+    # When days is set every pair returned by pairs() is archived as well and
+    # partitions left empty by the archive are dropped.
+    def __init__(self, db_conn, pairs, days=RETENTION_DAYS, directory=ARCHIVE_DIR, interval=RETENTION_INTERVAL,
+                 tables=None):
+        super().__init__(name="retention-job", daemon=True)
+        self.db_conn = db_conn
+        self.pairs = pairs
+        self.tables = tables if tables is not None else pairs
+        self.days = days
+        self.directory = directory
+        self.interval = interval
+        self.last_run = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.run_once()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def run_once(self):
+        self.add_partitions()
+        if not self.days:
+            return []
+        cutoff = retention_cutoff(time.time(), self.days)
+        try:
+            pairs = self.pairs()
+        except Exception as e:
+            print(f"Failed to list pairs to archive({e}).")
+            return []
+        results = []
+        for currency_pair in pairs:
+            if self.stopped.is_set():
+                break
+            try:
+                result = archive_trades(self.db_conn, currency_pair, cutoff, directory=self.directory,
+                                        stopped=self.stopped)
+            except Exception as e:
+                print(f"Failed to archive {currency_pair}({e}).")
+                continue
+            if result["archived"]:
+                print(f'Archived {result["archived"]} {currency_pair} trades to {result["file"]}, '
+                      f'deleted {result["deleted"]}.')
+            if result["deleted"] == result["archived"]:
+                self.drop_partitions(currency_pair, cutoff)
+            results.append(result)
+        self.last_run = results
+        return results
+
+    def add_partitions(self):
+        try:
+            tables = self.tables()
+        except Exception as e:
+            print(f"Failed to list tables for partition maintenance({e}).")
+            return
+        for table in tables:
+            try:
+                added = self.db_conn.add_partitions(table)
+            except Exception as e:
+                print(f"Failed to add partitions to {table}({e}).")
+                continue
+            if added:
+                print(f"Added partitions {', '.join(added)} to {table}.")
+
+    def drop_partitions(self, currency_pair, cutoff):
+        # Only once nothing is left before the cutoff, a trade stored there after
+        # the archive read past it would go with the partition
+        try:
+            if self.db_conn.get_trades(currency_pair, end=cutoff, limit=1):
+                return
+            dropped = self.db_conn.drop_partitions(currency_pair, cutoff)
+        except Exception as e:
+            print(f"Failed to drop partitions from {currency_pair}({e}).")
+            return
+        if dropped:
+            print(f"Dropped partitions {', '.join(dropped)} from {currency_pair}.")
+
+
+if __name__ == "__main__":
+    # One maintenance run for the given pairs
+    from bitstamp_config import config
+    from bitstamp_sql import BitStampMySql as SQL
+
+    pairs = []
+    days = config.get('retention_days', RETENTION_DAYS)
+    directory = config.get('archive_dir', ARCHIVE_DIR)
+    cmd_example = 'bitstamp_retention.py -p <currency_pair> -d <retention days> -a <archive directory>'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hp:d:a:", ["pair=", "days=", "archive=", "help"])
+    except getopt.GetoptError:
+        print(cmd_example)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(cmd_example)
+            sys.exit(0)
+        elif opt in ("-p", "--pair"):
+            pairs.append(arg)
+        elif opt in ("-d", "--days"):
+            days = int(arg)
+        elif opt in ("-a", "--archive"):
+            directory = arg
+    if not pairs:
+        print(cmd_example)
+        sys.exit(2)
+
+    db = SQL(config.get('sql_host'), config.get('sql_user'), config.get('sql_pass'), config.get('sql_db'))
+    job = RetentionJob(db, lambda: pairs, days=days, directory=directory)
+    job.run_once()
+    db.pool.close()
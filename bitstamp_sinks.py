@@ -0,0 +1,239 @@
+#####################################################################################
+# Filename       : bitstamp_sinks.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Trade outputs behind one batch interface, registered by name and
+#                fanned out per watcher with a worker for each sink.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import threading
+import time
+from datetime import datetime
+from bitstamp_analytics import get_trade_analytics, format_stats
+from bitstamp_files import CsvTradeWriter, ColumnarTradeWriter
+from bitstamp_metrics import Counter, Histogram
+from bitstamp_queue import IngestQueue, QUEUE_POLICIES, SPILL_DIR
+
+# Batches queued per sink when a watcher writes to several sinks
+SINK_QUEUE_SIZE = 1000
+
+# Seconds between rolling analytics lines in the console output
+ANALYTICS_PRINT_INTERVAL = 10
+
+SINK_WRITE_SECONDS = Histogram("bitstamp_sink_write_seconds", "Time for a sink to write one batch of trades.",
+                               labels=("sink",))
+SINK_ERRORS = Counter("bitstamp_sink_errors_total", "Batches a sink failed to write.", labels=("sink",))
+
+
+class Sink:
+    # An output for trades.  write_many gets a list of Trade records for one
+    # pair in trade order.  One sink of each kind is shared by every watcher in
+    # the process, so implementations must be thread safe.
+    def write_many(self, trades, currency_pair):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class ConsoleSink(Sink):
+    def __init__(self, print_interval=ANALYTICS_PRINT_INTERVAL):
+        self.print_interval = print_interval
+        self.printed = {}
+        self.lock = threading.Lock()
+
+    def write_many(self, trades, currency_pair):
+        lines = []
+        for trade in trades:
+            lines.extend([f"Trade data",
+                          f'    id: {trade.id}',
+                          f'    buy_order_id: {trade.buy_order_id}',
+                          f'    sell_order_id: {trade.sell_order_id}',
+                          f'    amount: {trade.amount}',
+                          f'    price: {trade.price}',
+                          f'    time: {datetime.fromtimestamp(trade.timestamp)}'])
+        analytics = get_trade_analytics(currency_pair)
+        for trade in trades:
+            analytics.add(trade)
+        now = time.monotonic()
+        with self.lock:
+            if now - self.printed.get(currency_pair, 0) >= self.print_interval:
+                self.printed[currency_pair] = now
+                lines.append(f"Rolling analytics")
+                lines.extend(format_stats(analytics.stats()))
+            print("\n".join(lines))
+
+
+class CsvSink(Sink):
+    def __init__(self, writer=None):
+        self.writer = writer if writer is not None else CsvTradeWriter()
+
+    def write_many(self, trades, currency_pair):
+        for trade in trades:
+            self.writer.add(trade, currency_pair)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+class ColumnarSink(Sink):
+    def __init__(self, file_format, writer=None):
+        self.writer = writer if writer is not None else ColumnarTradeWriter(file_format=file_format)
+
+    def write_many(self, trades, currency_pair):
+        for trade in trades:
+            self.writer.add(trade, currency_pair)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+class SqlSink(Sink):
+    # writer is a TradeBatchWriter, it belongs to whoever created it so
+    # closing the sink only flushes it
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write_many(self, trades, currency_pair):
+        self.writer.add_many(trades, currency_pair)
+
+    def flush(self):
+        self.writer.flush()
+
+
+def no_sql_sink():
+    raise RuntimeError("The sql sink needs a database writer, register one with register_sink")
+
+
+# Sink factories by output name, a process replaces or adds its own with register_sink
+SINKS = {"console": ConsoleSink, "csv": CsvSink, "sql": no_sql_sink,
+         "parquet": lambda: ColumnarSink("parquet"), "arrow": lambda: ColumnarSink("arrow")}
+
+# Sinks created in this process, keyed by output name
+sinks = {}
+sinks_lock = threading.Lock()
+
+
+def register_sink(name, factory):
+    SINKS[name] = factory
+
+
+def parse_outputs(output):
+    # "sql" or "sql,csv" to ["sql", "csv"]
+    outputs = list(dict.fromkeys(name.strip() for name in output.split(",") if name.strip()))
+    unknown = [name for name in outputs if name not in SINKS]
+    if not outputs or unknown:
+        raise ValueError(f'Output not valid.  Use one or more of {", ".join(SINKS)}.')
+    return outputs
+
+
+def get_sink(name):
+    with sinks_lock:
+        if name not in sinks:
+            sinks[name] = SINKS[name]()
+        return sinks[name]
+
+
+def close_sinks():
+    with sinks_lock:
+        closing = list(sinks.values())
+        sinks.clear()
+    for sink in closing:
+        sink.close()
+
+
+class SinkFanout:
+    # Hands each batch of trades to every sink in output.  A single sink is
+    # written inline.  With several, each sink has its own queue and worker
+    # thread so a slow sink only holds up itself, with the queue policy
+    # deciding what happens once its queue is full.
+    def __init__(self, name, output, queue_size=SINK_QUEUE_SIZE, policy=QUEUE_POLICIES[0], spill_dir=SPILL_DIR):
+        self.name = name
+        self.outputs = parse_outputs(output)
+        self.sinks = [get_sink(output) for output in self.outputs]
+        self.queues = []
+        self.workers = []
+        if len(self.sinks) > 1:
+            for output, sink in zip(self.outputs, self.sinks):
+                queue = IngestQueue(f"{name}-{output}", maxsize=queue_size, policy=policy, spill_dir=spill_dir)
+                worker = threading.Thread(target=self._run, args=(output, sink, queue), name=f"{name}-{output}",
+                                          daemon=True)
+                worker.start()
+                self.queues.append(queue)
+                self.workers.append(worker)
+
+    def write_many(self, trades, currency_pair):
+        if not trades:
+            return
+        if not self.queues:
+            self._write(self.outputs[0], self.sinks[0], trades, currency_pair)
+            return
+        for queue in self.queues:
+            queue.put((currency_pair, trades))
+
+    def close(self):
+        # Workers write whatever is still queued and then exit
+        for queue in self.queues:
+            queue.close()
+        for worker in self.workers:
+            worker.join()
+
+    def stats(self):
+        return {output: queue.stats() for output, queue in zip(self.outputs, self.queues)}
+
+    def _run(self, output, sink, queue):
+        while True:
+            items = queue.get_many()
+            if not items:
+                return
+            # Batches queued for the same pair are written together
+            currency_pair, trades = items[0]
+            for next_pair, next_trades in items[1:]:
+                if next_pair == currency_pair:
+                    trades = trades + next_trades
+                    continue
+                self._write(output, sink, trades, currency_pair)
+                currency_pair, trades = next_pair, next_trades
+            self._write(output, sink, trades, currency_pair)
+
+    def _write(self, output, sink, trades, currency_pair):
+        start = time.perf_counter()
+        try:
+            sink.write_many(trades, currency_pair)
+        except Exception as e:
+            SINK_ERRORS.inc((output,))
+            print(f"ERROR: {self.name} {output} sink {type(e)} {e}")
+        SINK_WRITE_SECONDS.observe(time.perf_counter() - start, (output,))
@@ -0,0 +1,285 @@
+#####################################################################################
+# Filename       : bitstamp_spool.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Write ahead spool of database bound rows, drained into mysql in
+#                bulk so a database outage never blocks ingest or loses rows.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import os
+import glob
+import pickle
+import struct
+import threading
+import zlib
+from bitstamp_metrics import Counter, Gauge
+from bitstamp_reconnect import backoff_delay
+from bitstamp_sql import WriteRejected
+
+# Segment layout
+# A .wal file is a run of records, each RECORD_HEADER (payload length, crc32 of
+# the payload) followed by a pickled (table, rows) batch.  Segments are named
+# {name}-{sequence}.wal and drained in sequence order.
+RECORD_HEADER = struct.Struct("<II")
+
+SPOOL_DIR = "spool"
+
+# Rows the database refused are moved to this directory under the spool directory,
+# in the same record format, so they can be fixed and replayed by hand
+REJECTED_DIR = "rejected"
+
+SPOOL_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Seconds between drains while the database is keeping up
+SPOOL_DRAIN_INTERVAL = 1.0
+
+# Rows per write when draining
+SPOOL_DRAIN_ROWS = 5000
+
+SPOOL_ROWS = Counter("bitstamp_spool_rows_total", "Rows appended to the write ahead spool.", labels=("spool",))
+SPOOL_DRAINED = Counter("bitstamp_spool_drained_rows_total", "Rows drained from the spool into the database.",
+                        labels=("spool",))
+SPOOL_FAILURES = Counter("bitstamp_spool_drain_failures_total", "Drains stopped by a failed database write.",
+                         labels=("spool",))
+SPOOL_REJECTED = Counter("bitstamp_spool_rejected_rows_total", "Rows refused by the database and set aside.",
+                         labels=("spool",))
+
+# Every spool created in this process, for the backlog gauge
+spools = []
+
+
+class WriteAheadSpool:
+    # append(rows, table) has the same signature as the database write it
+    # protects so it can be handed to TradeBatchWriter as write.  Each batch is
+    # one record and one fsync, then append returns without touching the
+    # database.  A drainer thread seals the open segment every drain_interval
+    # seconds, replays sealed segments through write in drain_rows chunks and
+    # deletes each segment once all of it is written.  A failed write leaves the
+    # segment in place and the drain is retried with backoff, meanwhile new
+    # batches keep going to the open segment.  Rows write rejects with
+    # WriteRejected would fail on every retry, they are set aside in REJECTED_DIR
+    # and the drain carries on.  prepare(table), e.g. ensure_trade_table, runs
+    # before the first rows for a table are drained and again after a failed
+    # write.  It is best effort, the rows are written even when it fails, so a
+    # user without CREATE or ALTER still drains into existing tables and a
+    # table dropped since is created again after the write that found it
+    # missing.  Segments left by a crash are
+    # drained on start.  write must be idempotent (skip duplicates) because a
+    # segment that failed part way is replayed from its start.
+    def __init__(self, directory, write, name="spool", segment_size=SPOOL_SEGMENT_SIZE,
+                 drain_interval=SPOOL_DRAIN_INTERVAL, drain_rows=SPOOL_DRAIN_ROWS, prepare=None):
+        self.directory = directory
+        self.write = write
+        self.prepare = prepare
+        self.prepared = set()
+        self.name = name
+        self.segment_size = segment_size
+        self.drain_interval = drain_interval
+        self.drain_rows = drain_rows
+        self.segment = None
+        self.pending_rows = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self.sealed = self._recover()
+        self.sequence = max([self._sequence(path) for path in self.sealed], default=0)
+        self.drainer = threading.Thread(target=self._run, name=f"{name}-drainer", daemon=True)
+        self.drainer.start()
+        spools.append(self)
+
+    def append(self, rows, table):
+        if not rows:
+            return True
+        record = encode_record(table, rows)
+        try:
+            with self.lock:
+                if self.segment is None:
+                    self._open_segment()
+                self.segment.write(record)
+                self.segment.flush()
+                os.fsync(self.segment.fileno())
+                self.pending_rows += len(rows)
+                if self.segment.tell() >= self.segment_size:
+                    self._seal()
+        except OSError as e:
+            # Disk full or gone, fall back to writing straight to the database
+            print(f"Failed to spool {len(rows)} rows for {table}({e}), writing directly.")
+            with self.lock:
+                # The segment may end in a torn record, later batches go to a new one
+                try:
+                    self._seal()
+                except OSError:
+                    self.segment = None
+            try:
+                return self.write(rows, table)
+            except WriteRejected as e:
+                print(f"Database rejected {len(rows)} rows for {table}({e}).")
+                return False
+        SPOOL_ROWS.inc((self.name,), len(rows))
+        return True
+
+    def stats(self):
+        with self.lock:
+            sealed = list(self.sealed)
+            rows = self.pending_rows
+        size = 0
+        for path in sealed:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return {"segments": len(sealed), "bytes": size, "rows": rows}
+
+    def close(self):
+        # Seal the open segment and make one last attempt to drain, anything not
+        # written stays on disk for the next start
+        self.stopped.set()
+        self.drainer.join()
+        with self.lock:
+            self._seal()
+        self.drain()
+        spools.remove(self)
+
+    def drain(self):
+        # Writes sealed segments oldest first, stops at the first failure
+        while True:
+            with self.lock:
+                if not self.sealed:
+                    return True
+                path = self.sealed[0]
+            if not self._drain_segment(path):
+                SPOOL_FAILURES.inc((self.name,))
+                return False
+            os.remove(path)
+            with self.lock:
+                self.sealed.pop(0)
+
+    def _run(self):
+        attempt = 0
+        delay = self.drain_interval
+        while not self.stopped.wait(delay):
+            with self.lock:
+                # While a backlog is waiting the open segment keeps growing rather
+                # than being cut into many small files
+                if not self.sealed:
+                    self._seal()
+            if self.drain():
+                attempt = 0
+                delay = self.drain_interval
+            else:
+                delay = max(self.drain_interval, backoff_delay(attempt))
+                attempt += 1
+
+    def _drain_segment(self, path):
+        batches = {}
+        for table, rows in read_records(path):
+            batches.setdefault(table, []).extend(rows)
+        rejected = 0
+        for table, rows in batches.items():
+            if self.prepare is not None and table not in self.prepared:
+                self.prepare(table)
+                self.prepared.add(table)
+            for start in range(0, len(rows), self.drain_rows):
+                chunk = rows[start:start + self.drain_rows]
+                try:
+                    if self.write(chunk, table) is False:
+                        self.prepared.discard(table)
+                        return False
+                except WriteRejected as e:
+                    self._reject(path, table, chunk, e)
+                    rejected += len(chunk)
+        drained = sum(len(rows) for rows in batches.values())
+        with self.lock:
+            self.pending_rows = max(0, self.pending_rows - drained)
+        SPOOL_DRAINED.inc((self.name,), drained - rejected)
+        return True
+
+    def _reject(self, path, table, rows, error):
+        # Appended to a file named after the segment, a segment replayed after a
+        # later failure can set the same rows aside twice
+        directory = os.path.join(self.directory, REJECTED_DIR)
+        os.makedirs(directory, exist_ok=True)
+        rejected_path = os.path.join(directory, os.path.basename(path))
+        with open(rejected_path, "ab") as f:
+            f.write(encode_record(table, rows))
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"Database rejected {len(rows)} rows for {table}({error}), set them aside in {rejected_path}.")
+        SPOOL_REJECTED.inc((self.name,), len(rows))
+
+    def _open_segment(self):
+        self.sequence += 1
+        path = os.path.join(self.directory, f"{self.name}-{self.sequence:010d}.wal")
+        self.segment = open(path, "ab")
+
+    def _seal(self):
+        if self.segment is None:
+            return
+        self.segment.close()
+        self.sealed.append(self.segment.name)
+        self.segment = None
+
+    def _recover(self):
+        # Segments from an earlier run, drained before anything new
+        paths = sorted(glob.glob(os.path.join(self.directory, f"{self.name}-*.wal")), key=self._sequence)
+        for path in paths:
+            self.pending_rows += sum(len(rows) for table, rows in read_records(path))
+        if paths:
+            print(f"Recovered {self.pending_rows} spooled rows from {len(paths)} segments in {self.directory}.")
+        return paths
+
+    @staticmethod
+    def _sequence(path):
+        return int(os.path.basename(path)[:-4].rsplit("-", 1)[1])
+
+
+def encode_record(table, rows):
+    payload = pickle.dumps((table, [tuple(row) for row in rows]), protocol=pickle.HIGHEST_PROTOCOL)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path):
+    # Yields (table, rows) batches in the order they were appended
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER.size:
+                print(f"Partial record at the end of {path}, skipping it.")
+                return
+            length, crc = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                # Torn write from a crash, nothing after it was acknowledged
+                print(f"Partial record at the end of {path}, skipping it.")
+                return
+            yield pickle.loads(payload)
+
+
+SPOOL_BACKLOG = Gauge("bitstamp_spool_backlog_rows", "Rows spooled but not yet written to the database.",
+                      lambda: {(spool.name,): spool.pending_rows for spool in list(spools)}, labels=("spool",))
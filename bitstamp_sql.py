@@ -2,7 +2,7 @@
 # Filename       : bitstamp_sql.py
 # Author         : Paul Jamieson
 # Created        : 01/06/2021
-# Edited         : 01/13/2021
+# Edited         : 10/17/2026
 # Python Version : 3.7.7
 # Purpose        : Perform CRUD operations for mysql database
 #
@@ -30,59 +30,644 @@
 #
 #####################################################################################
 
-import mysql.connector
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from bitstamp_metrics import Counter, Histogram
+
+# Batched writer defaults, a trade is never held in memory for longer than
+# TRADE_BATCH_INTERVAL seconds before it is committed.
+TRADE_BATCH_SIZE = 500
+TRADE_BATCH_INTERVAL = 0.05
+TRADE_BATCH_MAX_PENDING = 50000
+
+# Connection pool defaults.  Idle connections are pinged before reuse once they
+# have been idle for POOL_HEALTH_CHECK_INTERVAL seconds.
+POOL_SIZE = 8
+POOL_TIMEOUT = 30
+POOL_HEALTH_CHECK_INTERVAL = 30
+
+# Trade tables are range partitioned by month on timestamp, PARTITIONS_AHEAD
+# empty monthly partitions are kept ahead of the current month.
+PARTITIONS_AHEAD = 3
+
+# Rows fetched per query when paging through a trade table
+TRADE_PAGE_SIZE = 1000
+
+# Write errors are retried unless the database refused the rows themselves.  A
+# missing grant or table is retried too, it can be fixed without touching the rows.
+RETRY_ERRNOS = (1044, 1045, 1142, 1146)
+NO_SUCH_TABLE = 1146
+
+# Amounts of the low priced pairs, e.g. xrp and xlm, run well past 10^4.  Tables
+# created with the old decimal(12,8) amount are widened when they are ensured.
+AMOUNT_TYPE = "decimal(24,8) unsigned"
+NARROW_AMOUNT_TYPE = "decimal(12,8) unsigned"
+
+# Every unique key of a partitioned table must include the partition column,
+# so the clustered (timestamp, id) primary key is what de-duplicates trades.
+# A trade id always carries the same timestamp, live or backfilled.
+TRADE_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS `{table}` (
+  `id` int unsigned NOT NULL,
+  `buy_order_id` bigint unsigned NOT NULL,
+  `sell_order_id` bigint unsigned NOT NULL,
+  `amount` decimal(24,8) unsigned NOT NULL,
+  `price` decimal(16,8) unsigned NOT NULL,
+  `type` int unsigned NOT NULL,
+  `timestamp` int unsigned NOT NULL,
+  PRIMARY KEY (`timestamp`, `id`),
+  KEY `id_idx` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+PARTITION BY RANGE (`timestamp`) (
+{partitions}
+)'''
+
+# live_orders events, partitioned like the trade tables on the exchange datetime.
+# event is 0 for created, 1 for changed and 2 for deleted.
+ORDER_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS `{table}` (
+  `id` bigint unsigned NOT NULL,
+  `event` tinyint unsigned NOT NULL,
+  `order_type` tinyint unsigned NOT NULL,
+  `amount` decimal(24,8) unsigned NOT NULL,
+  `price` decimal(16,8) unsigned NOT NULL,
+  `datetime` int unsigned NOT NULL,
+  `microtimestamp` bigint unsigned NOT NULL,
+  PRIMARY KEY (`datetime`, `microtimestamp`, `id`, `event`),
+  KEY `id_idx` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+PARTITION BY RANGE (`datetime`) (
+{partitions}
+)'''
+
+
+# The candles table is created from the same script used to set it up by hand
+CANDLES_TABLE = "candles"
+CANDLES_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "create_candles.sql")
+
+# Candle upserts.  MySQL applies the assignments left to right, so vwap is
+# weighted with the stored volume before volume is added to.
+CANDLE_REPLACE_SQL = 'ON DUPLICATE KEY UPDATE open = VALUES(open), high = VALUES(high), low = VALUES(low), ' \
+                     'close = VALUES(close), volume = VALUES(volume), vwap = VALUES(vwap), trades = VALUES(trades)'
+CANDLE_MERGE_SQL = 'ON DUPLICATE KEY UPDATE high = GREATEST(high, VALUES(high)), low = LEAST(low, VALUES(low)), ' \
+                   'close = VALUES(close), vwap = IF(volume + VALUES(volume) > 0, ' \
+                   '(vwap * volume + VALUES(vwap) * VALUES(volume)) / (volume + VALUES(volume)), VALUES(vwap)), ' \
+                   'volume = volume + VALUES(volume), trades = trades + VALUES(trades)'
+
+
+# Metrics
+SQL_INSERT_SECONDS = Histogram("bitstamp_sql_insert_seconds", "Time to insert and commit a batch of trades.",
+                               labels=("table",))
+SQL_ROWS = Counter("bitstamp_sql_rows_total", "Trades written to the database.", labels=("table",))
+SQL_ERRORS = Counter("bitstamp_sql_errors_total", "Failed trade inserts.", labels=("table",))
+POOL_WAIT_SECONDS = Histogram("bitstamp_sql_pool_wait_seconds", "Time spent waiting for a pooled connection.")
+
+
+# mysql.connector is a large import, it is loaded on the first connect so
+# processes that never write to the database do not pay for it
+mysql = None
+
+
+def load_mysql():
+    global mysql
+    if mysql is None:
+        import mysql.connector
+    return mysql
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class WriteRejected(Exception):
+    # Raised by the batch writes when the database refused the rows themselves,
+    # e.g. a value out of range.  Writing them again will fail the same way.
+    pass
+
+
+def is_rejection(e):
+    if mysql is None or not isinstance(e, mysql.connector.Error):
+        return False
+    errors = mysql.connector.errors
+    return isinstance(e, (errors.DataError, errors.IntegrityError, errors.NotSupportedError,
+                          errors.ProgrammingError)) and e.errno not in RETRY_ERRNOS
+
+
+class ConnectionPool:
+    # Bounded pool of mysql connections.  At most size connections exist at
+    # once, callers wait up to timeout seconds for one to become free.  Broken
+    # connections are dropped and replaced by a fresh connect on next use.
+    def __init__(self, host, user, password, database, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 health_check_interval=POOL_HEALTH_CHECK_INTERVAL):
+        self.connect_args = {"host": host, "user": user, "password": password, "database": database}
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection free after {self.timeout} seconds")
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except Exception:
+            conn = self._rollback(conn)
+            raise
+        finally:
+            if conn is not None:
+                self.idle.put((conn, time.monotonic()))
+            self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                conn, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn)
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                return load_mysql().connector.connect(**self.connect_args)
+            if time.monotonic() - last_used < self.health_check_interval:
+                return conn
+            try:
+                conn.ping(reconnect=True, attempts=3, delay=1)
+                return conn
+            except mysql.connector.Error as e:
+                print(f"Dropping dead database connection({e}).")
+                self._close(conn)
+
+    def _rollback(self, conn):
+        # Returns the connection if it is still usable after the failed statement
+        if conn is None:
+            return None
+        try:
+            conn.rollback()
+            return conn
+        except mysql.connector.Error:
+            self._close(conn)
+            return None
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+
+
+# Pools shared by every BitStampMySql created with the same connection details
+pools = {}
+pools_lock = threading.Lock()
+
+
+def month_start(year, month):
+    # Unix time of the first second of the month, month may run past 12
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def monthly_partitions(now=None, ahead=PARTITIONS_AHEAD):
+    # (name, upper bound) for the current month and the next ahead months
+    now = datetime.fromtimestamp(now if now is not None else time.time(), timezone.utc)
+    partitions = []
+    for i in range(ahead + 1):
+        start = month_start(now.year, now.month + i)
+        end = month_start(now.year, now.month + i + 1)
+        partitions.append((datetime.fromtimestamp(start, timezone.utc).strftime("p%Y%m"), end))
+    return partitions
+
+
+def partition_sql(partitions):
+    return ",\n".join(f"  PARTITION {name} VALUES LESS THAN ({bound})" for name, bound in partitions)
+
+
+def check_table_name(table):
+    # Table names are interpolated into the sql, only allow currency pairs and
+    # their suffixed tables such as btcusd_orders
+    if not table.replace("_", "").isalnum():
+        raise ValueError(f"Invalid table name {table!r}.")
+    return table
+
+
+def get_pool(host, user, password, database, size=POOL_SIZE):
+    key = (host, user, database)
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(host, user, password, database, size=size)
+        return pools[key]
 
 
 class BitStampMySql:
-    def __init__(self, host, user, password, database):
-        self.conn = mysql.connector.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=database
-        )
-
-    def create_watcher(self, name, channel, currency_pair):
+    def __init__(self, host, user, password, database, pool_size=POOL_SIZE):
+        self.pool = get_pool(host, user, password, database, size=pool_size)
+        self.ensured_tables = set()
+        self.ensured_lock = threading.Lock()
+
+    def create_watcher(self, name, channel, currency_pair, output="sql"):
         try:
-            with self.conn.cursor() as cursor:
-                sql = f'INSERT IGNORE INTO watchers (name, channel, currency_pair) VALUES (%s, %s, %s)'
-                values = (name, channel, currency_pair)
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                sql = f'INSERT IGNORE INTO watchers (name, channel, currency_pair, output) VALUES (%s, %s, %s, %s)'
+                values = (name, channel, currency_pair, output)
                 cursor.execute(sql, values)
-                self.conn.commit()
+                conn.commit()
         except Exception as e:
-            self.conn.rollback()
             print(f'Failed to create watcher entry({e}).')
 
     def delete_watcher(self, name):
         try:
-            with self.conn.cursor() as cursor:
+            with self.pool.connection() as conn, conn.cursor() as cursor:
                 sql = f'DELETE FROM watchers WHERE name = %s'
                 values = (name,)
                 cursor.execute(sql, values)
-                self.conn.commit()
+                conn.commit()
         except Exception as e:
             print(f'Failed to delete watcher entry({e}).')
 
+    def ensure_watcher_output(self):
+        # Watchers tables created before outputs were stored lack the output
+        # column, their watchers keep writing to sql
+        try:
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() '
+                               'AND TABLE_NAME = %s AND COLUMN_NAME = %s', ('watchers', 'output'))
+                if not cursor.fetchone()[0]:
+                    cursor.execute("ALTER TABLE watchers ADD COLUMN `output` varchar(100) NOT NULL DEFAULT 'sql'")
+        except Exception as e:
+            print(f'Failed to add the output column to watchers({e}).')
+
     def list_watchers(self):
         try:
-            with self.conn.cursor() as cursor:
+            with self.pool.connection() as conn, conn.cursor() as cursor:
                 sql = f'SELECT * FROM watchers'
                 cursor.execute(sql)
                 results = cursor.fetchall()
                 return results
         except Exception as e:
-            print(f'Failed to delete watcher entry({e}).')
+            print(f'Failed to list watcher entries({e}).')
             return "Failed to list watchers."
 
-    def create_trade(self, trade_data, table):
+    def ensure_trade_table(self, table):
+        # Create the trade table for a pair if it is missing and top up its
+        # partitions.  Runs once per table for the life of the process, the
+        # retention job keeps the partitions topped up after that.
+        return self._ensure_table(table, TRADE_TABLE_SQL)
+
+    def ensure_order_table(self, currency_pair):
+        # Order events for a pair go to {currency_pair}_orders
+        return self._ensure_table(f"{currency_pair}_orders", ORDER_TABLE_SQL)
+
+    def _ensure_table(self, table, create_sql):
+        with self.ensured_lock:
+            if table in self.ensured_tables:
+                return True
+            try:
+                table = check_table_name(table)
+                now = time.time()
+                current = datetime.fromtimestamp(now, timezone.utc)
+                # pold takes anything older than the current month, e.g. an import
+                partitions = [("pold", month_start(current.year, current.month)), ("pmax", "MAXVALUE")]
+                with self.pool.connection() as conn, conn.cursor() as cursor:
+                    cursor.execute(create_sql.format(table=table, partitions=partition_sql(partitions)))
+                    conn.commit()
+                self.widen_amount(table)
+                self.add_partitions(table, now)
+                self.ensured_tables.add(table)
+                return True
+            except Exception as e:
+                print(f"Failed to create table {table}: {e}")
+                return False
+
+    def widen_amount(self, table):
+        # Rebuilds the table, only done once for a table created with the narrow amount
+        table = check_table_name(table)
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute('SELECT COLUMN_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() '
+                           'AND TABLE_NAME = %s AND COLUMN_NAME = %s', (table, 'amount'))
+            row = cursor.fetchone()
+            if row is not None and row[0] == NARROW_AMOUNT_TYPE:
+                print(f"Widening the amount column of {table}.")
+                cursor.execute(f'ALTER TABLE `{table}` MODIFY `amount` {AMOUNT_TYPE} NOT NULL')
+
+    def ensure_candles_table(self):
+        # Runs create_candles.sql once for the life of the process
+        with self.ensured_lock:
+            if CANDLES_TABLE in self.ensured_tables:
+                return True
+            try:
+                with open(CANDLES_TABLE_FILE) as f:
+                    sql = f.read().strip().rstrip(";")
+                with self.pool.connection() as conn, conn.cursor() as cursor:
+                    cursor.execute(sql)
+                    conn.commit()
+                self.ensured_tables.add(CANDLES_TABLE)
+                return True
+            except Exception as e:
+                print(f"Failed to create table {CANDLES_TABLE}: {e}")
+                return False
+
+    def list_partitions(self, table):
+        # [(name, upper bound)] in order, the MAXVALUE partition has a bound of None
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            sql = 'SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS ' \
+                  'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL ' \
+                  'ORDER BY PARTITION_ORDINAL_POSITION'
+            cursor.execute(sql, (table,))
+            return [(name, None if bound == "MAXVALUE" else int(bound)) for name, bound in cursor.fetchall()]
+
+    def add_partitions(self, table, now=None, ahead=PARTITIONS_AHEAD):
+        # Split monthly partitions out of pmax so new trades never land in it
+        table = check_table_name(table)
+        existing = self.list_partitions(table)
+        if not existing:
+            print(f"Table {table} is not partitioned, skipping partition maintenance.")
+            return []
+        highest = max([bound for name, bound in existing if bound is not None], default=0)
+        missing = [(name, bound) for name, bound in monthly_partitions(now, ahead) if bound > highest]
+        if not missing:
+            return []
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE `{table}` REORGANIZE PARTITION pmax INTO (\n'
+                           f'{partition_sql(missing + [("pmax", "MAXVALUE")])})')
+        return [name for name, bound in missing]
+
+    def drop_partitions(self, table, before):
+        # Drop every partition that only holds trades older than the unix time
+        # before.  Dropping a partition is a metadata change, not a row delete.
+        table = check_table_name(table)
+        names = [name for name, bound in self.list_partitions(table)
+                 if bound is not None and bound <= before]
+        if names:
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE `{table}` DROP PARTITION {", ".join(names)}')
+        return names
+
+    def delete_trades(self, table, first, last, ids):
+        # Deletes the trades with the given ids, all timestamped from first to
+        # last inclusive.  Only the listed rows go, anything else in the range
+        # stays.  The timestamp range keeps the delete on the primary key so
+        # only the rows being removed are locked.
+        table = check_table_name(table)
+        if not len(ids):
+            return 0
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            sql = f'DELETE FROM `{table}` WHERE timestamp BETWEEN %s AND %s ' \
+                  f'AND id IN ({", ".join(["%s"] * len(ids))})'
+            cursor.execute(sql, (first, last, *ids))
+            deleted = cursor.rowcount
+            conn.commit()
+        return deleted
+
+    def create_trade(self, trade, table):
         try:
-            with self.conn.cursor() as cursor:
+            with self.pool.connection() as conn, conn.cursor() as cursor:
                 sql = f'INSERT INTO {table} (id, buy_order_id, sell_order_id, amount, price, type, timestamp) ' \
-                      f'VALUES (%s, %s, %s, %s, %s, %s, %s)'
-                val = (trade_data["id"], trade_data["buy_order_id"], trade_data["sell_order_id"], trade_data["amount"],
-                       trade_data["price"], trade_data["type"], trade_data["timestamp"])
-                cursor.execute(sql, val)
-                self.conn.commit()
+                      f'VALUES (%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE id = id'
+                cursor.execute(sql, trade[:7])
+                conn.commit()
         except Exception as e:
             print(f"Failed to create trade: {e}")
 
+    def create_trades(self, trades, table):
+        # Insert many trades with a single multi-row INSERT and one commit.  Trades
+        # already stored, e.g. replayed by a backfill, are skipped by the no-op
+        # ON DUPLICATE KEY UPDATE.  Unlike INSERT IGNORE it leaves strict mode on,
+        # so a value out of range for its column fails instead of being clamped.
+        # Returns False when the write is worth retrying and raises WriteRejected
+        # when it is not.
+        if not trades:
+            return True
+        start = time.perf_counter()
+        try:
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                sql = f'INSERT INTO {table} (id, buy_order_id, sell_order_id, amount, price, type, timestamp) ' \
+                      f'VALUES (%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE id = id'
+                cursor.executemany(sql, [trade[:7] for trade in trades])
+                conn.commit()
+            SQL_INSERT_SECONDS.observe(time.perf_counter() - start, (table,))
+            SQL_ROWS.inc((table,), len(trades))
+            return True
+        except Exception as e:
+            return self._write_failed(e, table, f"{len(trades)} trades")
+
+    def load_trades_file(self, path, table):
+        # LOAD DATA LOCAL INFILE from a headerless csv in trade column order.
+        # Local infile has to be allowed per connection, so this opens its own
+        # connection rather than using the pool.  Duplicate ids are skipped.
+        start = time.perf_counter()
+        try:
+            conn = load_mysql().connector.connect(**self.pool.connect_args, allow_local_infile=True)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE `{table}` "
+                                   f"FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n' "
+                                   f"(id, buy_order_id, sell_order_id, amount, price, type, timestamp)", (path,))
+                    rows = cursor.rowcount
+                conn.commit()
+            finally:
+                conn.close()
+            SQL_INSERT_SECONDS.observe(time.perf_counter() - start, (table,))
+            SQL_ROWS.inc((table,), max(rows, 0))
+            return True
+        except Exception as e:
+            SQL_ERRORS.inc((table,))
+            print(f"Failed to load {path} into {table}: {e}")
+            return False
+
+    def get_trades(self, table, start=None, end=None, after=None, limit=TRADE_PAGE_SIZE):
+        # One page of trades in (timestamp, id) order.  after is the (timestamp, id)
+        # of the last trade of the previous page, the query seeks straight to it on
+        # the primary key instead of skipping rows with OFFSET.  start and end
+        # bound the timestamp, end is exclusive.
+        table = check_table_name(table)
+        where = []
+        values = []
+        if start is not None:
+            where.append('timestamp >= %s')
+            values.append(start)
+        if end is not None:
+            where.append('timestamp < %s')
+            values.append(end)
+        if after is not None:
+            where.append('(timestamp > %s OR (timestamp = %s AND id > %s))')
+            values.extend((after[0], after[0], after[1]))
+        sql = f'SELECT id, buy_order_id, sell_order_id, amount, price, type, timestamp FROM `{table}`'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY timestamp, id LIMIT %s'
+        values.append(limit)
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(sql, values)
+            return cursor.fetchall()
+
+    def iter_trades(self, table, start=None, end=None, after=None, limit=None, page_size=TRADE_PAGE_SIZE):
+        # Yields trades page by page, each page holds a pooled connection only
+        # while it is fetched so a slow reader does not tie one up
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            rows = self.get_trades(table, start=start, end=end, after=after, limit=size)
+            for row in rows:
+                yield row
+            if len(rows) < size:
+                return
+            after = (rows[-1][6], rows[-1][0])
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def get_latest_trades(self, table, limit=100):
+        # Newest first
+        table = check_table_name(table)
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            sql = f'SELECT id, buy_order_id, sell_order_id, amount, price, type, timestamp FROM `{table}` ' \
+                  f'ORDER BY timestamp DESC, id DESC LIMIT %s'
+            cursor.execute(sql, (limit,))
+            return cursor.fetchall()
+
+    def create_order_events(self, events, table):
+        # events are (id, event, order_type, amount, price, datetime, microtimestamp) tuples,
+        # duplicates are skipped and failures reported the same way as create_trades
+        if not events:
+            return True
+        start = time.perf_counter()
+        try:
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                sql = f'INSERT INTO {table} (id, event, order_type, amount, price, datetime, microtimestamp) ' \
+                      f'VALUES (%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE id = id'
+                cursor.executemany(sql, events)
+                conn.commit()
+            SQL_INSERT_SECONDS.observe(time.perf_counter() - start, (table,))
+            SQL_ROWS.inc((table,), len(events))
+            return True
+        except Exception as e:
+            return self._write_failed(e, table, f"{len(events)} order events")
+
+    def _write_failed(self, e, table, what):
+        SQL_ERRORS.inc((table,))
+        print(f"Failed to create {what}: {e}")
+        if getattr(e, "errno", None) == NO_SUCH_TABLE:
+            # Dropped since it was ensured, the next ensure creates it again
+            with self.ensured_lock:
+                self.ensured_tables.discard(table)
+        if is_rejection(e):
+            raise WriteRejected(f"{table}: {e}") from e
+        return False
+
+    def create_candles(self, candles, merge=False):
+        # candles are (currency_pair, interval, start, open, high, low, close, volume, vwap, trades) tuples.
+        # A candle written again replaces the earlier row, or with merge is
+        # combined with it as later trades of the same bucket.
+        self.ensure_candles_table()
+        try:
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                sql = 'INSERT INTO candles (currency_pair, `interval`, start, open, high, low, close, volume, vwap, ' \
+                      'trades) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) ' + \
+                      (CANDLE_MERGE_SQL if merge else CANDLE_REPLACE_SQL)
+                cursor.executemany(sql, candles)
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"Failed to create {len(candles)} candles: {e}")
+            if getattr(e, "errno", None) == NO_SUCH_TABLE:
+                with self.ensured_lock:
+                    self.ensured_tables.discard(CANDLES_TABLE)
+            return False
+
+
+class TradeBatchWriter:
+    # Buffers trades per table and group commits them with create_trades once
+    # batch_size rows are waiting or batch_interval seconds have passed since
+    # the oldest buffered trade arrived.  max_pending bounds memory, callers of
+    # add() block while that many rows are still waiting to be written.  Other
+    # rows are batched the same way by passing the method that writes them as
+    # write, e.g. create_order_events.
+    def __init__(self, db_conn, batch_size=TRADE_BATCH_SIZE, batch_interval=TRADE_BATCH_INTERVAL,
+                 max_pending=TRADE_BATCH_MAX_PENDING, write=None, name="trade-batch-writer"):
+        self.db_conn = db_conn
+        self.write = write if write is not None else db_conn.create_trades
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_pending = max_pending
+        self.buffers = {}
+        self.pending = 0
+        self.oldest = None
+        self.running = True
+        self.lock = threading.Condition()
+        self.flusher = threading.Thread(target=self._run, name=name, daemon=True)
+        self.flusher.start()
+
+    def add(self, trade, table):
+        with self.lock:
+            while self.running and self.pending >= self.max_pending:
+                self.lock.wait()
+            self.buffers.setdefault(table, []).append(trade)
+            self.pending += 1
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            if self.pending >= self.batch_size:
+                self.lock.notify_all()
+
+    def add_many(self, trades, table):
+        # add() for a batch, taking the lock once
+        with self.lock:
+            while self.running and self.pending >= self.max_pending:
+                self.lock.wait()
+            self.buffers.setdefault(table, []).extend(trades)
+            self.pending += len(trades)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            if self.pending >= self.batch_size:
+                self.lock.notify_all()
+
+    def flush(self):
+        # Write everything currently buffered from the calling thread
+        with self.lock:
+            buffers = self._take()
+        self._write(buffers)
+
+    def close(self):
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        self.flusher.join()
+        self.flush()
+
+    def _take(self):
+        buffers = self.buffers
+        self.buffers = {}
+        self.pending = 0
+        self.oldest = None
+        self.lock.notify_all()
+        return buffers
+
+    def _write(self, buffers):
+        for table, rows in buffers.items():
+            self.write(rows, table)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while self.running and self.pending < self.batch_size:
+                    if self.oldest is None:
+                        self.lock.wait()
+                        continue
+                    remaining = self.oldest + self.batch_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.lock.wait(remaining)
+                if not self.running:
+                    return
+                buffers = self._take()
+            self._write(buffers)
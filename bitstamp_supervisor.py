@@ -0,0 +1,402 @@
+#####################################################################################
+# Filename       : bitstamp_supervisor.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Shard watchers across worker processes, restart workers that
+#                crash and control them over a local socket.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import sys
+import os
+import getopt
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from bitstamp_metrics import Counter, metric_samples
+from bitstamp_reconnect import backoff_delay
+
+# Seconds to wait for a worker to answer a control request
+REQUEST_TIMEOUT = 30
+
+# Seconds a new worker has to open its control socket
+START_TIMEOUT = 30
+
+# A worker that stays up this long has its restart backoff reset
+HEALTHY_SECONDS = 60
+
+# Environment variable carrying the control socket key to the workers
+AUTHKEY_ENV = "BITSTAMP_WORKER_KEY"
+
+# Metrics
+WORKER_RESTARTS = Counter("bitstamp_worker_restarts_total", "Worker processes restarted after exiting.",
+                          labels=("worker",))
+
+
+class WorkerProcess:
+    # One worker process and the watchers assigned to it
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.watchers = {}
+        self.started = 0
+        self.attempt = 0
+        self.restarts = 0
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def request(self, *command):
+        # Send a command and wait for its reply, replies to requests that
+        # timed out earlier are recognised by their sequence number and skipped
+        with self.lock:
+            if self.conn is None:
+                raise ConnectionError(f"Worker {self.index} is not running.")
+            self.sequence += 1
+            self.conn.send((self.sequence,) + command)
+            deadline = time.monotonic() + REQUEST_TIMEOUT
+            while True:
+                if not self.conn.poll(max(0, deadline - time.monotonic())):
+                    raise TimeoutError(f"Worker {self.index} did not answer {command[0]}.")
+                sequence, status, result = self.conn.recv()
+                if sequence != self.sequence:
+                    continue
+                if status == "error":
+                    raise RuntimeError(result)
+                return result
+
+    def pairs(self):
+        # {currency_pair: [watcher names]}
+        pairs = {}
+        for name, (channel, currency_pair, output) in self.watchers.items():
+            pairs.setdefault(currency_pair, []).append(name)
+        return pairs
+
+
+class Supervisor:
+    # Watchers for the same currency pair share a worker so they keep sharing
+    # one order book and candle aggregator.  New pairs go to the worker with
+    # the fewest watchers and stop_watcher moves whole pairs off the busiest
+    # worker when the load drifts apart.  A worker that exits is restarted
+    # with backoff and its watchers are started again.
+    def __init__(self, processes=None):
+        self.workers = [WorkerProcess(i) for i in range(max(1, processes or os.cpu_count() or 1))]
+        self.assignments = {}
+        self.authkey = os.urandom(32)
+        self.running = False
+        self.lock = threading.RLock()
+        self.monitor = threading.Thread(target=self._monitor, name="watcher-supervisor", daemon=True)
+
+    def start(self):
+        self.running = True
+        for worker in self.workers:
+            self._spawn(worker)
+        self.monitor.start()
+        print(f"Supervisor started {len(self.workers)} watcher processes.")
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            for worker in self.workers:
+                if worker.alive():
+                    try:
+                        worker.request("shutdown")
+                    except Exception as e:
+                        print(f"Worker {worker.index} did not shut down cleanly({e}).")
+                self._reap(worker)
+
+    def start_watcher(self, name, channel, currency_pair, output):
+        with self.lock:
+            worker = self._choose(currency_pair)
+            worker.watchers[name] = (channel, currency_pair, output)
+            self.assignments[name] = worker
+            self._send(worker, "start", name, channel, currency_pair, output)
+            return worker.index
+
+    def stop_watcher(self, name, remove=True):
+        with self.lock:
+            worker = self.assignments.pop(name, None)
+            if worker is None:
+                return False
+            del worker.watchers[name]
+            self._send(worker, "stop", name, remove)
+            self.rebalance()
+            return True
+
+    def rebalance(self):
+        # Move the smallest pair that narrows the gap from the busiest worker
+        # to the idlest one until no move helps
+        with self.lock:
+            while True:
+                busiest = max(self.workers, key=lambda w: len(w.watchers))
+                idlest = min(self.workers, key=lambda w: len(w.watchers))
+                gap = len(busiest.watchers) - len(idlest.watchers)
+                movable = [names for names in busiest.pairs().values() if len(names) < gap]
+                if not movable:
+                    return
+                for name in min(movable, key=len):
+                    channel, currency_pair, output = busiest.watchers.pop(name)
+                    self._send(busiest, "stop", name, False)
+                    idlest.watchers[name] = (channel, currency_pair, output)
+                    self.assignments[name] = idlest
+                    self._send(idlest, "start", name, channel, currency_pair, output)
+                    print(f"Moved watcher {name} from worker {busiest.index} to worker {idlest.index}.")
+
+    def pair_request(self, currency_pair, *command):
+        # Ask the worker running currency_pair's watchers, None when no worker
+        # has the pair or it does not answer
+        with self.lock:
+            worker = next((worker for worker in self.workers if currency_pair in worker.pairs()), None)
+        if worker is None:
+            return None
+        try:
+            return worker.request(*command)
+        except Exception as e:
+            print(f"Failed to get {command[0]} from worker {worker.index}({e}).")
+            return None
+
+    def gather(self, *command):
+        # Results of command from every worker that answers
+        results = []
+        for worker in self.workers:
+            try:
+                results.append(worker.request(*command))
+            except Exception as e:
+                print(f"Failed to get {command[0]} from worker {worker.index}({e}).")
+        return results
+
+    def queue_stats(self):
+        stats = {}
+        for worker in self.workers:
+            try:
+                stats.update(worker.request("queue_stats"))
+            except Exception as e:
+                print(f"Failed to get queue stats from worker {worker.index}({e}).")
+        return stats
+
+    def health(self):
+        # list_watchers from every worker, a worker that is down reports its
+        # assigned watchers as down
+        watchers = []
+        for worker in self.workers:
+            try:
+                watchers.extend(worker.request("health"))
+            except Exception:
+                watchers.extend({"name": name, "channel": channel, "currency_pair": currency_pair, "output": output,
+                                 "status": "worker down", "worker": worker.index}
+                                for name, (channel, currency_pair, output) in list(worker.watchers.items()))
+        return watchers
+
+    def watcher_health(self, name):
+        # One watcher's health from the worker it is assigned to, None when no worker has it
+        with self.lock:
+            worker = self.assignments.get(name)
+            if worker is None:
+                return None
+            channel, currency_pair, output = worker.watchers[name]
+        try:
+            return worker.request("watcher", name)
+        except Exception:
+            return {"name": name, "channel": channel, "currency_pair": currency_pair, "output": output,
+                    "status": "worker down", "worker": worker.index}
+
+    def stats(self):
+        with self.lock:
+            return [{"worker": worker.index, "pid": worker.process.pid if worker.process else None,
+                     "alive": worker.alive(), "restarts": worker.restarts, "watchers": sorted(worker.watchers)}
+                    for worker in self.workers]
+
+    def _choose(self, currency_pair):
+        for worker in self.workers:
+            if currency_pair in worker.pairs():
+                return worker
+        return min(self.workers, key=lambda w: len(w.watchers))
+
+    def _send(self, worker, *command):
+        # A worker that is down picks the change up from its assignments when restarted
+        try:
+            return worker.request(*command)
+        except Exception as e:
+            print(f"Worker {worker.index} failed {command[0]} {command[1]}({e}).")
+
+    def _spawn(self, worker):
+        address = os.path.join(tempfile.gettempdir(), f"bitstamp-{os.getpid()}-worker{worker.index}.sock")
+        if os.path.exists(address):
+            os.unlink(address)
+        env = dict(os.environ)
+        env[AUTHKEY_ENV] = self.authkey.hex()
+        worker.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), f"--worker={worker.index}",
+                                           f"--address={address}"], env=env)
+        worker.started = time.monotonic()
+        deadline = worker.started + START_TIMEOUT
+        while worker.conn is None:
+            try:
+                worker.conn = Client(address, family="AF_UNIX", authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not worker.alive() or time.monotonic() > deadline:
+                    print(f"Worker {worker.index} failed to start.")
+                    self._reap(worker)
+                    return False
+                time.sleep(0.05)
+        for name, (channel, currency_pair, output) in worker.watchers.items():
+            self._send(worker, "start", name, channel, currency_pair, output)
+        return True
+
+    def _reap(self, worker):
+        if worker.conn is not None:
+            worker.conn.close()
+            worker.conn = None
+        if worker.process is not None:
+            try:
+                worker.process.wait(timeout=REQUEST_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+                worker.process.wait()
+
+    def _monitor(self):
+        while self.running:
+            time.sleep(1)
+            for worker in self.workers:
+                if not self.running or worker.alive():
+                    continue
+                code = worker.process.returncode if worker.process is not None else None
+                if time.monotonic() - worker.started >= HEALTHY_SECONDS:
+                    worker.attempt = 0
+                delay = backoff_delay(worker.attempt)
+                print(f"Worker {worker.index} exited({code}), restarting in {delay:.1f} seconds.")
+                WORKER_RESTARTS.inc((str(worker.index),))
+                with worker.lock:
+                    self._reap(worker)
+                time.sleep(delay)
+                worker.attempt += 1
+                worker.restarts += 1
+                with self.lock:
+                    if self.running:
+                        self._spawn(worker)
+
+
+def run_worker(index, address, authkey):
+    import bitstamp_workers as workers
+
+    # Each worker runs the multiplexed engine, with its own capture files and fan-out port
+    workers.WATCHER_ENGINE = 'mux'
+    workers.CAPTURE_NAME = f"worker{index}"
+    workers.SPOOL_NAME = f"worker{index}"
+    if workers.FANOUT_PORT:
+        workers.FANOUT_PORT += index
+    if workers.FANOUT_UNIX_PATH:
+        workers.FANOUT_UNIX_PATH = f"{workers.FANOUT_UNIX_PATH}.{index}"
+
+    def watcher_health(name):
+        health = workers.get_watcher_health(name)
+        return dict(health, worker=index) if health is not None else None
+
+    # Reads of the worker's in memory state for the web api, see bitstamp_workers.get_candles
+    queries = {"candles": workers.get_candles, "latest_trades": workers.get_latest_trades,
+               "analytics": workers.get_analytics, "order_book": workers.get_book_depth,
+               "orders": workers.get_order_stats, "cross_states": workers.get_cross_states,
+               "watcher": watcher_health,
+               "metrics": lambda: metric_samples(("worker",), (str(index),))}
+
+    # The supervisor handles ctrl-c and shuts the workers down in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    conn = listener.accept()
+    listener.close()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            # Supervisor has gone away
+            workers.stop_all_watchers()
+            return
+        sequence, command, args = request[0], request[1], request[2:]
+        try:
+            if command == "start":
+                workers.start_watcher(*args)
+                result = True
+            elif command == "stop":
+                result = workers.stop_watcher(*args)
+            elif command == "queue_stats":
+                result = workers.get_queue_stats()
+            elif command == "health":
+                result = [dict(health, worker=index) for health in workers.list_watchers()]
+            elif command in queries:
+                result = queries[command](*args)
+            elif command == "shutdown":
+                workers.stop_all_watchers()
+                conn.send((sequence, "ok", True))
+                return
+            else:
+                raise ValueError(f"Unknown command {command}.")
+            conn.send((sequence, "ok", result))
+        except Exception as e:
+            conn.send((sequence, "error", f"{type(e).__name__}: {e}"))
+
+
+if __name__ == "__main__":
+    worker = None
+    address = None
+    processes = None
+    cmd_example = 'bitstamp_supervisor.py -p <processes>'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hp:", ["processes=", "worker=", "address=", "help"])
+    except getopt.GetoptError:
+        print(cmd_example)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(cmd_example)
+            sys.exit(0)
+        elif opt in ("-p", "--processes"):
+            processes = int(arg)
+        elif opt == "--worker":
+            worker = int(arg)
+        elif opt == "--address":
+            address = arg
+
+    if worker is not None:
+        run_worker(worker, address, bytes.fromhex(os.environ[AUTHKEY_ENV]))
+        sys.exit(0)
+
+    # Run every watcher in the watchers table without the web api
+    import bitstamp_workers
+    bitstamp_workers.get_db().ensure_watcher_output()
+    supervisor = Supervisor(processes)
+    supervisor.start()
+    for row in bitstamp_workers.stored_watchers():
+        supervisor.start_watcher(row[1], row[2], row[3], row[4])
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        supervisor.stop()
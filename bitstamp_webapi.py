@@ -2,7 +2,7 @@
 # Filename       : bitstamp_webapi.py
 # Author         : Paul Jamieson
 # Created        : 01/08/2021
-# Edited         : 01/16/2021
+# Edited         : 10/17/2026
 # Python Version : 3.7.7
 # Purpose        : WebApi to control on server system
 #
@@ -30,14 +30,27 @@
 #
 #####################################################################################
 from markupsafe import escape
-from flask import Flask, url_for, request, redirect
-from bitstamp_workers import WatcherThread, start_all_watchers, get_all_watchers, stop_all_watchers
+from flask import Flask, url_for, request, redirect, Response
+from bitstamp_workers import start_all_watchers, stop_all_watchers, start_watcher, stop_watcher, \
+    get_watcher_health, list_watchers, get_queue_stats, get_process_stats, get_db, get_candles, get_latest_trades, \
+    get_analytics, get_book_depth, get_order_stats, get_cross_snapshots, get_worker_metrics, ORDER_BOOK_CHANNELS, \
+    VALID_CHANNELS, VALID_PAIRS
+from bitstamp_metrics import render_metrics
+from bitstamp_candles import CANDLE_INTERVALS
+from bitstamp_recent import trade_to_dict
+from bitstamp_analytics import ANALYTICS_HORIZONS
+from bitstamp_sinks import parse_outputs
+from bitstamp_sql import check_table_name
+import json
 import string
 import random
 import threading
 import signal
 import sys
 
+# Most trades a single /trades request returns, page through larger ranges with the cursor
+TRADES_MAX_LIMIT = 100000
+
 app = Flask("Bit Stamp WebAPI")
 threading.Thread(target=start_all_watchers).start()
 
@@ -58,31 +71,180 @@ def genRandomName(length):
 @app.route('/watchers', methods=['GET', 'POST', 'DELETE'])
 def watcher():
     if request.method == 'GET':
-        return {"status": "success", "watchers": get_all_watchers()}
+        return {"status": "success", "watchers": list_watchers()}
 
     if request.method == 'POST':
         form = request.form
+        # The pair names the watcher's tables, check it before anything is stored
+        if form['channel'] not in VALID_CHANNELS:
+            return {"status": "failed", "error": f"Channel must be one of {', '.join(VALID_CHANNELS)}"}, 400
+        if form['currency_pair'] not in VALID_PAIRS:
+            return {"status": "failed", "error": f"Currency pair must be one of {', '.join(VALID_PAIRS)}"}, 400
+        # One or more outputs, e.g. sql,parquet, stored with the watcher
+        try:
+            output = ",".join(parse_outputs(form.get('output', 'sql')))
+        except ValueError as e:
+            return {"status": "failed", "error": str(e)}, 400
         thread_name = f"{form['currency_pair']}-{genRandomName(5)}"
-        WatcherThread(name=thread_name, channel=form['channel'], currency_pair=form['currency_pair'],
-                      output="sql").start()
-        return {"status": "success", "watcher_status": "started", "watcher_name": thread_name}
+        start_watcher(name=thread_name, channel=form['channel'], currency_pair=form['currency_pair'], output=output)
+        return {"status": "success", "watcher_status": "started", "watcher_name": thread_name, "output": output}
 
     if request.method == 'DELETE':
         form = request.form
-        for thread in threading.enumerate():
-            if thread.getName() == form['name']:
-                thread.end()
-                break
+        if not stop_watcher(form['name']):
+            return {"status": "failed", "error": f"No watcher named {form['name']}"}, 404
         return {"status": "success", "watcher_status": "ended", "watcher_name": f"{form['name']}"}
 
 
+@app.route('/watchers/<name>')
+def watcher_health(name):
+    # In process mode only the worker the watcher is assigned to is asked
+    health = get_watcher_health(name)
+    if health is not None:
+        return {"status": "success", "watcher": health}
+    return {"status": "failed", "error": f"No watcher named {name}"}, 404
+
+
+@app.route('/candles/<currency_pair>')
+def candles(currency_pair):
+    interval = request.args.get('interval', '1m')
+    if interval not in CANDLE_INTERVALS:
+        return {"status": "failed", "error": f"Interval must be one of {', '.join(CANDLE_INTERVALS)}"}, 400
+    limit = request.args.get('limit', 100, type=int)
+    candles = get_candles(currency_pair, interval, limit)
+    if candles is None:
+        return {"status": "failed", "error": f"No candles for {currency_pair}"}, 404
+    return {"status": "success", "currency_pair": currency_pair, "interval": interval, "candles": candles}
+
+
+def pair_table(currency_pair):
+    # Trade routes only read the trade tables, not watchers or other tables
+    if currency_pair not in VALID_PAIRS:
+        raise ValueError(f"Currency pair must be one of {', '.join(VALID_PAIRS)}")
+    return check_table_name(currency_pair)
+
+
+@app.route('/trades/<currency_pair>')
+def trades(currency_pair):
+    # Trades in (timestamp, id) order.  The response is streamed as it is read
+    # from the database and ends with next_cursor, pass it back as cursor to
+    # get the following page.
+    try:
+        table = pair_table(currency_pair)
+        start = request.args.get('start', type=int)
+        end = request.args.get('end', type=int)
+        limit = min(request.args.get('limit', 1000, type=int), TRADES_MAX_LIMIT)
+        cursor = request.args.get('cursor')
+        after = tuple(int(part) for part in cursor.split("-")) if cursor else None
+        if after is not None and len(after) != 2:
+            raise ValueError("Cursor must be <timestamp>-<id>.")
+    except ValueError as e:
+        return {"status": "failed", "error": str(e)}, 400
+
+    def generate():
+        yield f'{{"currency_pair": "{table}", "trades": ['
+        count = 0
+        last = None
+        try:
+            for row in get_db().iter_trades(table, start=start, end=end, after=after, limit=limit):
+                yield ("," if count else "") + json.dumps(trade_to_dict(row))
+                count += 1
+                last = row
+        except Exception as e:
+            # Headers are already sent, report the failure in the body
+            yield f'], "status": "failed", "error": {json.dumps(str(e))}}}'
+            return
+        next_cursor = json.dumps(f"{last[6]}-{last[0]}" if last is not None and count == limit else None)
+        yield f'], "next_cursor": {next_cursor}, "status": "success"}}'
+
+    return Response(generate(), mimetype="application/json")
+
+
+@app.route('/trades/<currency_pair>/latest')
+def latest_trades(currency_pair):
+    # Served from the watchers' ring buffer, the database is only asked when
+    # the buffer holds fewer trades than requested
+    try:
+        table = pair_table(currency_pair)
+    except ValueError as e:
+        return {"status": "failed", "error": str(e)}, 400
+    limit = request.args.get('limit', 100, type=int)
+    recent = get_latest_trades(currency_pair, limit)
+    if recent is not None:
+        return {"status": "success", "currency_pair": currency_pair, "source": "memory", "trades": recent}
+    try:
+        rows = get_db().get_latest_trades(table, limit)
+    except Exception as e:
+        return {"status": "failed", "error": f"No trades for {currency_pair}({e})"}, 404
+    return {"status": "success", "currency_pair": currency_pair, "source": "database",
+            "trades": [trade_to_dict(row) for row in rows]}
+
+
+@app.route('/analytics/<currency_pair>')
+def analytics(currency_pair):
+    # Rolling windows ending at the newest trade, ?horizon=1m,5m for a subset
+    horizons = request.args.get('horizon')
+    horizons = horizons.split(",") if horizons else None
+    if horizons and any(horizon not in ANALYTICS_HORIZONS for horizon in horizons):
+        return {"status": "failed", "error": f"Horizon must be one of {', '.join(ANALYTICS_HORIZONS)}"}, 400
+    stats = get_analytics(currency_pair, horizons)
+    if stats is None:
+        return {"status": "failed", "error": f"No trades for {currency_pair}"}, 404
+    return {"status": "success", "analytics": stats}
+
+
+@app.route('/cross')
+def cross():
+    # Latest time aligned snapshots, newest first, or ?live=1 for one taken now
+    live = bool(request.args.get('live', 0, type=int))
+    limit = request.args.get('limit', 1, type=int)
+    return {"status": "success", "snapshots": get_cross_snapshots(limit, live)}
+
+
+@app.route('/metrics')
+def metrics():
+    # In process mode the worker processes' metrics carry a worker label
+    return Response(render_metrics(get_worker_metrics()), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/watchers/queues')
+def watcher_queues():
+    return {"status": "success", "queues": get_queue_stats()}
+
+
+@app.route('/watchers/processes')
+def watcher_processes():
+    return {"status": "success", "processes": get_process_stats()}
+
+
+@app.route('/order_book/<currency_pair>')
+def order_book(currency_pair):
+    # ?channel= picks the book, by default the deepest one being watched
+    channel = request.args.get('channel')
+    if channel is not None and channel not in ORDER_BOOK_CHANNELS:
+        return {"status": "failed", "error": f"Channel must be one of {', '.join(ORDER_BOOK_CHANNELS)}"}, 400
+    depth = request.args.get('depth', 10, type=int)
+    book = get_book_depth(currency_pair, channel, depth)
+    if book is None:
+        return {"status": "failed", "error": f"No order book for {currency_pair}"}, 404
+    return {"status": "success", "order_book": book}
+
+
+@app.route('/orders/<currency_pair>')
+def orders(currency_pair):
+    orders = get_order_stats(currency_pair)
+    if orders is None:
+        return {"status": "failed", "error": f"No live orders for {currency_pair}"}, 404
+    return {"status": "success", "orders": orders}
+
+
 @app.route('/kill_watcher')
 def remove_watcher():
-    for thread in threading.enumerate():
-        if thread.getName() == "ethusd-1" and type(thread) == WatcherThread:
-            print('found')
-            thread.end()
-    return {"status": "success", "watcher_status": "stopped", "watcher_name":"ethusd-1"}
+    # Legacy route, stops ?name= like DELETE /watchers on every engine
+    name = request.args.get('name', 'ethusd-1')
+    if not stop_watcher(name):
+        return {"status": "failed", "error": f"No watcher named {name}"}, 404
+    return {"status": "success", "watcher_status": "stopped", "watcher_name": name}
 
 
 @app.route('/list_threads')
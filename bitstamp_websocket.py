@@ -2,7 +2,7 @@
 # Filename       : bitstamp_websocket.py
 # Author         : Paul Jamieson
 # Created        : 01/04/2021
-# Edited         : 01/06/2021
+# Edited         : 10/17/2026
 # Python Version : 3.7.7
 # Purpose        : Open a websocket with the bitstamp public service and receive
 #                up to date data on their currency exchange.
@@ -31,17 +31,18 @@
 #
 #####################################################################################
 import sys
-import os
 import getopt
 import json
 import time
-from websocket import create_connection
-from datetime import datetime
-import pandas as pd
+from websocket import create_connection, WebSocketTimeoutException, WebSocketConnectionClosedException
 import socket
-from bitstamp_sql import BitStampMySql as SQL
-
-from bitstamp_sql import BitStampMySql
+from bitstamp_config import config
+from bitstamp_decode import loads, parse_trade
+from bitstamp_reconnect import backoff_delay, backfill_trades
+from bitstamp_capture import FrameCapture
+from bitstamp_sinks import SinkFanout, SqlSink, register_sink, close_sinks, parse_outputs, SINKS
+from bitstamp_spool import WriteAheadSpool, SPOOL_DIR
+from bitstamp_sql import BitStampMySql as SQL, TradeBatchWriter, TRADE_BATCH_SIZE, TRADE_BATCH_INTERVAL
 
 # constants
 
@@ -65,22 +66,67 @@ VALID_PAIRS = ["btcusd", "btceur", "btcgbp", "btcpax", "btcusdc", "gbpusd", "gbp
                "xlmbtc", "xlmusd", "xlmeur", "xlmgbp", "linkusd", "linkeur", "linkgbp", "linkbtc", "linketh", "omgusd",
                "omgeur", "omggbp", "omgbtc", "usdcusd", "usdceur"]
 
-# Valid outputs
-VALID_OUTPUTS = ["console", "csv", "sql"]
+# Valid outputs, several can be given separated by commas, e.g. sql,parquet
+VALID_OUTPUTS = list(SINKS)
 
 # Config file
 
-if os.path.exists('config.json'):
-    with open('config.json') as f:
-        config_file = json.loads(f.read())
+SQLHOST = config.get('sql_host')
+SQLUSER = config.get('sql_user')
+SQLPASSWD = config.get('sql_pass')
+SQLDB = config.get('sql_db')
+SQL_BATCH_SIZE = config.get('sql_batch_size', TRADE_BATCH_SIZE)
+SQL_BATCH_INTERVAL = config.get('sql_batch_interval', TRADE_BATCH_INTERVAL)
+SQL_SPOOL_DIR = config.get('sql_spool_dir', SPOOL_DIR)
+
+# Batched trade writer for the sql output, created with the sql sink
+writer = None
+
+# Sinks for the selected outputs
+sinks = None
+
+# Last trade seen per currency pair, used to backfill and de-duplicate after a reconnect
+last_trades = {}
+
+# Raw frame capture, enabled with --capture
+capture = None
+
+# Write ahead spool between the sql writer and the database
+spool = None
+
+
+def make_sql_sink():
+    global writer, spool
+    # create db connection when the sql output is used
+    db_conn = SQL(SQLHOST, SQLUSER, SQLPASSWD, SQLDB)
+    spool = WriteAheadSpool(SQL_SPOOL_DIR, db_conn.create_trades, name="cli-trades",
+                            prepare=db_conn.ensure_trade_table)
+    writer = TradeBatchWriter(db_conn, batch_size=SQL_BATCH_SIZE, batch_interval=SQL_BATCH_INTERVAL,
+                              write=spool.append)
+    return SqlSink(writer)
+
+
+register_sink(VALID_OUTPUTS[2], make_sql_sink)
+
+
+def make_sinks(output):
+    return SinkFanout("cli", output)
 
-    SQLHOST = config_file['sql_host']
-    SQLUSER = config_file['sql_user']
-    SQLPASSWD = config_file['sql_pass']
-    SQLDB = config_file['sql_db']
 
+def close_writer():
+    if sinks is not None:
+        sinks.close()
+    close_sinks()
+    if writer is not None:
+        writer.close()
+    if spool is not None:
+        spool.close()
+    if capture is not None:
+        capture.close()
 
-def main(channel, currency_pair, output):
+
+def main(channel, currency_pair):
+    attempt = 0
     # loop to reconnect if connection lost
     while True:
         try:
@@ -90,41 +136,74 @@ def main(channel, currency_pair, output):
 
             # Subscribe to a channel
             ws.send(make_subscribe_json(f"{channel}_{currency_pair}"))
+            attempt = 0
+
+            # Fill in any trades missed while disconnected
+            if channel == VALID_CHANNELS[0]:
+                backfill(currency_pair)
 
             # Monitor open socket for new data
             print(f'Monitoring socket for new data, press Ctrl-C to exit.')
-            monitor_subscription(ws, output)
+            monitor_subscription(ws)
         except KeyboardInterrupt:
             ws.close()
+            close_writer()
             print(f"ctrl-c pressed, halting program...")
             quit(0)
         except socket.gaierror:
             print(f'Network connection is down, will retry when network connection is re-established.')
-            time.sleep(10)
+        except (ConnectionError, TimeoutError) as e:
+            print(f'Unable to reach server({e}), attempting to reconnect...')
 
         except Exception as e:
             print(f"ERROR: {type(e)} {e}")
             break
 
+        # Wait before reconnecting, backing off while the server stays unreachable
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
+
+
+def backfill(currency_pair):
+    if currency_pair not in last_trades:
+        return
+    last_id, last_microtimestamp = last_trades[currency_pair]
+    try:
+        trades = backfill_trades(currency_pair, last_id, last_microtimestamp)
+    except Exception as e:
+        print(f"Failed to backfill trades for {currency_pair}({e}).")
+        return
+    if trades:
+        print(f'Backfilling {len(trades)} trades missed while disconnected.')
+    for trade in trades:
+        handle_trade(trade, currency_pair)
+
 
-def monitor_subscription(open_socket, output):
+def monitor_subscription(open_socket):
     while True:
         try:
-            resp = json.loads(open_socket.recv())
+            frame = open_socket.recv()
+            if capture is not None:
+                capture.write(frame)
+            resp = loads(frame)
             if resp:
                 data = resp['data']
                 event = resp['event']
                 channel = resp['channel']
                 if event == 'trade':
                     pair = channel.split("_")
-                    handle_trade(data, pair[2], output)
+                    handle_trade(parse_trade(data), pair[2])
             else:
                 print("empty")
+        except WebSocketTimeoutException:
+            # Nothing arrived within the socket timeout, a quiet channel is not a disconnect
+            continue
         except KeyboardInterrupt:
             open_socket.close()
+            close_writer()
             print(f"ctrl-c pressed, halting program...")
             quit(0)
-        except (ConnectionAbortedError, TimeoutError):
+        except (ConnectionAbortedError, TimeoutError, WebSocketConnectionClosedException):
             open_socket.close()
             print(f'Connection to server has been lost, attempting to reconnect...')
             break
@@ -133,39 +212,14 @@ def monitor_subscription(open_socket, output):
             break
 
 
-def handle_trade(trade_data, currency, output):
-    # Sample trade_data
-    # {"data": {"buy_order_id": 1 314 580 971 991 040, "amount_str": "0.06400000", "timestamp": "1 609 777 594",
-    #           "microtimestamp": "1609777594772000", "id": 139 255 607, "amount": 0.064,
-    #           "sell_order_id": 1314580969922560, "price_str": "30859.03", "type": 0, "price": 30859.03},
-    #           "event": "trade", "channel": "live_trades_btcusd"}
-    if output == VALID_OUTPUTS[0]:
-        print(f"Trade data")
-        print(f'    id: {trade_data["id"]}')
-        print(f'    buy_order_id: {trade_data["buy_order_id"]}')
-        print(f'    sell_order_id: {trade_data["sell_order_id"]}')
-        print(f'    amount: {trade_data["amount"]}')
-        print(f'    price: {trade_data["price"]}')
-        print(f'    time: {datetime.fromtimestamp(int(trade_data["timestamp"]))}')
-
-    if output == VALID_OUTPUTS[1]:
-        data = {"trade_pair": [currency], 'id': [trade_data['id']], 'buy_order_id': [trade_data["buy_order_id"]],
-                "sell_order_id": [trade_data["sell_order_id"]], "amount": [trade_data["amount"]],
-                "price": [trade_data["price"]], "timestamp": [trade_data["timestamp"]]}
-
-        df = pd.DataFrame(data=data)
-        if not os.path.isfile(f'{currency}.csv'):
-            df.to_csv(f'{currency}.csv', mode="w", index=False)
-        else:
-            df.to_csv(f'{currency}.csv', mode="a", index=False, header=False)
-
-    if output == VALID_OUTPUTS[2]:
-        sql_trade_data = {
-            "id": trade_data["id"], "buy_order_id": trade_data["buy_order_id"],
-            "sell_order_id": trade_data["sell_order_id"], "amount": trade_data["amount"], "price": trade_data["price"],
-            "type": trade_data["type"], "timestamp": trade_data["timestamp"]
-        }
-        db.create_trade(sql_trade_data, currency)
+def handle_trade(trade, currency):
+    # trade is the Trade record parsed from the frame data, see bitstamp_decode.parse_trade
+    # Skip trades already seen, a backfill and the live stream can overlap
+    last = last_trades.get(currency)
+    if last is not None and trade.id <= last[0]:
+        return
+    last_trades[currency] = (trade.id, trade.microtimestamp)
+    sinks.write_many([trade], currency)
 
 
 def check_currency_pair(pair):
@@ -177,7 +231,11 @@ def check_channel(channel):
 
 
 def check_output(output):
-    return False if output not in VALID_OUTPUTS else True
+    try:
+        parse_outputs(output)
+    except ValueError:
+        return False
+    return True
 
 
 def make_subscribe_json(channel):
@@ -198,14 +256,16 @@ if __name__ == "__main__":
     output = VALID_OUTPUTS[0]
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "ho:c:p:", ["channel=", "pair=", "output=", "help"])
+        opts, args = getopt.getopt(sys.argv[1:], "ho:c:p:", ["channel=", "pair=", "output=", "capture=", "uri=",
+                                                           "help"])
     except getopt.GetoptError:
         print(
             f'bitstamp_websocket.py -h -c <channel> -p <currency_pair> --channel=<channel> --pair=<currency_pair> --help')
         sys.exit(2)
     for opt, arg in opts:
-        cmd_example = (f'bitstamp_websocket.py -h -c <channel> -p <currency_pair> -o <console, csv, or sql> '
-                       f'--channel=<channel> --pair=<currency_pair> --output <console, csv, or sql> --help')
+        cmd_example = (f'bitstamp_websocket.py -h -c <channel> -p <currency_pair> -o <console, csv, sql, parquet or arrow> '
+                       f'--channel=<channel> --pair=<currency_pair> --output <one or more outputs, e.g. sql,parquet> '
+                       f'--capture=<directory for raw frames> --uri=<server, e.g. a local fan-out server> --help')
         if opt == "-h":
             print(cmd_example)
             sys.exit(0)
@@ -237,9 +297,14 @@ if __name__ == "__main__":
         elif opt in ("-o", "--output"):
             if check_output(arg):
                 output = arg
-                # create db connection of output used
-                if arg == VALID_OUTPUTS[2]:
-                    db = SQL(SQLHOST, SQLUSER, SQLPASSWD, SQLDB)
-                    db.connect()
-
-    main(channel, currency_pair, output)
+            else:
+                print(f'Output not valid.  Use one or more of {", ".join(VALID_OUTPUTS)} separated by commas.')
+                sys.exit(2)
+        elif opt == "--capture":
+            capture = FrameCapture(arg)
+        elif opt == "--uri":
+            URI = arg
+
+    sinks = make_sinks(output)
+    main(channel, currency_pair)
+    close_writer()
@@ -2,7 +2,7 @@
 # Filename       : bitstamp_workers.py
 # Author         : Paul Jamieson
 # Created        : 01/12/2021
-# Edited         : 01/16/2021
+# Edited         : 10/17/2026
 # Python Version : 3.7.7
 # Purpose        : Threads to run workers created by web api
 #
@@ -33,9 +33,23 @@
 import os
 import json
 import time
-from websocket import create_connection
 import socket
-from bitstamp_sql import BitStampMySql as SQL
+from bitstamp_config import config
+from bitstamp_decode import timed_loads, parse_trade, parse_order, ORDER_EVENTS
+from bitstamp_metrics import Counter, Histogram, Gauge
+from bitstamp_capture import FrameCapture
+from bitstamp_candles import get_candle_aggregator, candle_aggregators, CandleFlusher, CANDLE_FLUSH_INTERVAL
+from bitstamp_recent import get_recent_trades, recent_trades, trade_to_dict
+from bitstamp_analytics import get_trade_analytics, trade_analytics
+from bitstamp_cross import cross_table, merge_states, CrossSnapshotter, CROSS_SNAPSHOT_INTERVAL
+from bitstamp_orderbook import get_order_book, order_books
+from bitstamp_orders import get_open_orders, open_orders
+from bitstamp_queue import IngestQueue, QUEUE_SIZE, QUEUE_POLICIES, SPILL_DIR
+from bitstamp_reconnect import backoff_delay, backfill_trades, TRANSACTIONS_URL
+from bitstamp_sinks import SinkFanout, SqlSink, register_sink, close_sinks, SINK_QUEUE_SIZE
+from bitstamp_spool import WriteAheadSpool, SPOOL_DIR
+from bitstamp_sql import BitStampMySql as SQL, TradeBatchWriter, TRADE_BATCH_SIZE, TRADE_BATCH_INTERVAL, \
+    TRADE_BATCH_MAX_PENDING, POOL_SIZE
 import threading
 
 # constants
@@ -53,6 +67,9 @@ URI = "wss://ws.bitstamp.net/"
 
 VALID_CHANNELS = ["live_trades", "live_orders", "order_book", "detail_order_book", "diff_order_book"]
 
+# Order book channels, deepest book first
+ORDER_BOOK_CHANNELS = [VALID_CHANNELS[4], VALID_CHANNELS[3], VALID_CHANNELS[2]]
+
 # Valid currency pairs
 VALID_PAIRS = ["btcusd", "btceur", "btcgbp", "btcpax", "btcusdc", "gbpusd", "gbpeur", "eurusd", "xrpusd", "xrpeur",
                "xrpbtc", "xrpgbp", "xrppax", "ltcusd", "ltceur", "ltcbtc", "ltcgbp", "ethusd", "etheur", "ethbtc",
@@ -62,117 +79,785 @@ VALID_PAIRS = ["btcusd", "btceur", "btcgbp", "btcpax", "btcusdc", "gbpusd", "gbp
 
 # Config file
 
-if os.path.exists('config.json'):
-    with open('config.json') as f:
-        config_file = json.loads(f.read())
+SQLHOST = config.get('sql_host')
+SQLUSER = config.get('sql_user')
+SQLPASSWD = config.get('sql_pass')
+SQLDB = config.get('sql_db')
+
+# Optional trade batching settings, sql_batch_interval is the durability bound in seconds
+SQL_BATCH_SIZE = config.get('sql_batch_size', TRADE_BATCH_SIZE)
+SQL_BATCH_INTERVAL = config.get('sql_batch_interval', TRADE_BATCH_INTERVAL)
+SQL_BATCH_MAX_PENDING = config.get('sql_batch_max_pending', TRADE_BATCH_MAX_PENDING)
+
+# Every row bound for the database is first appended to a write ahead spool
+# in sql_spool_dir and drained into mysql from there
+SQL_SPOOL_DIR = config.get('sql_spool_dir', SPOOL_DIR)
+SPOOL_NAME = "spool"
+
+# Maximum number of database connections shared by all watchers and the web api
+SQL_POOL_SIZE = config.get('sql_pool_size', POOL_SIZE)
+
+# Watcher engine, "mux" multiplexes every watcher over mux_connections sockets,
+# "thread" runs one thread and socket per watcher and "process" shards the watchers
+# over watcher_processes worker processes, each running the mux engine
+WATCHER_ENGINE = config.get('watcher_engine', 'mux')
+MUX_CONNECTIONS = config.get('mux_connections', 1)
+WATCHER_PROCESSES = config.get('watcher_processes', os.cpu_count())
+
+# Ingest queue between the socket and the outputs, policy is one of block, drop_oldest or spill.
+# block only applies to the thread engine, the mux engine's event loop carries every socket
+# and must never wait on a full queue, so its watchers spill instead.
+# Each watcher drains its queue with a single worker, every channel has to be applied in
+# receive order and trades are de-duplicated against the last one handled.  Outputs get
+# their own workers through the sink fan-out.
+INGEST_QUEUE_SIZE = config.get('ingest_queue_size', QUEUE_SIZE)
+INGEST_QUEUE_POLICY = config.get('ingest_queue_policy', QUEUE_POLICIES[0])
+INGEST_SPILL_DIR = config.get('ingest_spill_dir', SPILL_DIR)
+
+# Queue in front of each sink when a watcher's output lists several, e.g. "sql,parquet".
+# spill keeps a slow sink from holding up the others without dropping trades.
+SINK_QUEUE_LENGTH = config.get('sink_queue_size', SINK_QUEUE_SIZE)
+SINK_QUEUE_POLICY = config.get('sink_queue_policy', QUEUE_POLICIES[2])
+
+# Rest endpoint used to backfill trades missed while reconnecting
+BACKFILL_URL = config.get('transactions_url', TRANSACTIONS_URL)
+
+# Directory to capture raw frames to, capture is off when not set
+CAPTURE_DIR = config.get('capture_dir')
+CAPTURE_NAME = "capture"
+
+# Re-publish received frames to local subscribers, off unless fanout_port or fanout_unix_path is set
+FANOUT_HOST = config.get('fanout_host', '127.0.0.1')
+FANOUT_PORT = config.get('fanout_port')
+FANOUT_UNIX_PATH = config.get('fanout_unix_path')
+FANOUT_CLIENT_QUEUE_SIZE = config.get('fanout_queue_size')
+
+# Seconds between writes of closed candles to the candles table
+CANDLE_FLUSH_SECONDS = config.get('candle_flush_interval', CANDLE_FLUSH_INTERVAL)
+
+# Every retention_interval seconds the trade and order tables have their partitions
+# topped up and, when retention_days is set, trades older than it are archived to
+# archive_dir and deleted from the trade tables
+RETENTION_DAYS = config.get('retention_days')
+ARCHIVE_DIR = config.get('archive_dir', 'archive')
+RETENTION_SECONDS = config.get('retention_interval', 3600)
+
+# Seconds between cross pair snapshots
+CROSS_SNAPSHOT_SECONDS = config.get('cross_snapshot_interval', CROSS_SNAPSHOT_INTERVAL)
+
+# Metrics, labelled by watcher name
+MESSAGES = Counter("bitstamp_messages_total", "Messages received.", labels=("watcher", "event"))
+CONNECTS = Counter("bitstamp_connects_total", "Times the subscription was (re)established.", labels=("watcher",))
+BACKFILLED = Counter("bitstamp_backfilled_trades_total", "Trades recovered over rest after a reconnect.",
+                     labels=("watcher",))
+PARSE_SECONDS = Histogram("bitstamp_parse_seconds", "Time to parse a decoded message and queue it.",
+                          labels=("watcher",))
+SINK_SECONDS = Histogram("bitstamp_sink_seconds", "Time for the outputs to handle one message.", labels=("watcher",))
+TRADE_LAG_SECONDS = Histogram("bitstamp_trade_lag_seconds", "Receive time minus the trade microtimestamp.",
+                              labels=("watcher",),
+                              buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+
+# Database handle shared by every watcher and the web api, backed by one connection pool
+db = None
+db_lock = threading.Lock()
+
+
+def get_db():
+    global db
+    with db_lock:
+        if db is None:
+            db = SQL(SQLHOST, SQLUSER, SQLPASSWD, SQLDB, pool_size=SQL_POOL_SIZE)
+        return db
+
+
+# Trade writer shared by every watcher so trades from all pairs are group committed
+# together, each batch goes to the trade spool which drains it into the database
+trade_writer = None
+trade_spool = None
+trade_writer_lock = threading.Lock()
+
+
+def get_trade_writer():
+    global trade_writer, trade_spool
+    with trade_writer_lock:
+        if trade_writer is None:
+            db_conn = get_db()
+            trade_spool = WriteAheadSpool(SQL_SPOOL_DIR, db_conn.create_trades, name=f"{SPOOL_NAME}-trades",
+                                          prepare=db_conn.ensure_trade_table)
+            trade_writer = TradeBatchWriter(db_conn, batch_size=SQL_BATCH_SIZE, batch_interval=SQL_BATCH_INTERVAL,
+                                            max_pending=SQL_BATCH_MAX_PENDING, write=trade_spool.append)
+        return trade_writer
+
+
+# The sql output writes through the shared trade writer
+register_sink("sql", lambda: SqlSink(get_trade_writer()))
+
+
+# Order event writer shared by every live_orders watcher, batched the same way as trades
+order_writer = None
+order_spool = None
+order_writer_lock = threading.Lock()
+
+
+def get_order_writer():
+    global order_writer, order_spool
+    with order_writer_lock:
+        if order_writer is None:
+            db_conn = get_db()
+            # Order tables are named {currency_pair}_orders
+            order_spool = WriteAheadSpool(SQL_SPOOL_DIR, db_conn.create_order_events, name=f"{SPOOL_NAME}-orders",
+                                          prepare=lambda table: db_conn.ensure_order_table(table[:-len("_orders")]))
+            order_writer = TradeBatchWriter(db_conn, batch_size=SQL_BATCH_SIZE, batch_interval=SQL_BATCH_INTERVAL,
+                                            max_pending=SQL_BATCH_MAX_PENDING, write=order_spool.append,
+                                            name="order-batch-writer")
+        return order_writer
+
+
+# Writes closed candles from every pair, started with the first watcher
+candle_flusher = None
+candle_flusher_lock = threading.Lock()
+
+
+def get_candle_flusher():
+    global candle_flusher
+    with candle_flusher_lock:
+        if candle_flusher is None:
+            candle_flusher = CandleFlusher(get_db(), flush_interval=CANDLE_FLUSH_SECONDS)
+            candle_flusher.start()
+        return candle_flusher
+
+
+# Snapshots of the cross pair table, started with the first watcher
+cross_snapshotter = None
+cross_snapshotter_lock = threading.Lock()
+
+
+def get_cross_snapshotter():
+    global cross_snapshotter
+    with cross_snapshotter_lock:
+        if cross_snapshotter is None:
+            cross_snapshotter = CrossSnapshotter(interval=CROSS_SNAPSHOT_SECONDS)
+            cross_snapshotter.start()
+        return cross_snapshotter
+
+
+# Trade table maintenance, started with the stored watchers
+retention_job = None
+retention_job_lock = threading.Lock()
+
+
+def get_retention_job():
+    global retention_job
+    with retention_job_lock:
+        if retention_job is None:
+            # pyarrow is only loaded once something is archived
+            from bitstamp_retention import RetentionJob
+            retention_job = RetentionJob(get_db(), retention_pairs, days=RETENTION_DAYS, directory=ARCHIVE_DIR,
+                                         interval=RETENTION_SECONDS, tables=retention_tables)
+            retention_job.start()
+        return retention_job
 
-    SQLHOST = config_file['sql_host']
-    SQLUSER = config_file['sql_user']
-    SQLPASSWD = config_file['sql_pass']
-    SQLDB = config_file['sql_db']
+
+def retention_pairs():
+    # Pairs with a stored live_trades watcher
+    return sorted({row[3] for row in stored_watchers() if row[2] == VALID_CHANNELS[0]})
+
+
+def retention_tables():
+    # Trade and order tables of the stored watchers
+    rows = stored_watchers()
+    return sorted({row[3] for row in rows if row[2] == VALID_CHANNELS[0]} |
+                  {f"{row[3]}_orders" for row in rows if row[2] == VALID_CHANNELS[1]})
+
+
+# Raw frame capture shared by every socket
+capture = None
+capture_lock = threading.Lock()
+
+
+def get_capture():
+    global capture
+    with capture_lock:
+        if capture is None and CAPTURE_DIR:
+            capture = FrameCapture(CAPTURE_DIR, name=CAPTURE_NAME)
+        return capture
+
+
+# Fan-out server shared by every watcher, started on first use when configured
+fanout = None
+fanout_lock = threading.Lock()
+
+
+def get_fanout():
+    global fanout
+    with fanout_lock:
+        if fanout is None and (FANOUT_PORT or FANOUT_UNIX_PATH):
+            from bitstamp_fanout import FanoutServer, FANOUT_QUEUE_SIZE
+            fanout = FanoutServer(FANOUT_HOST, FANOUT_PORT, unix_path=FANOUT_UNIX_PATH,
+                                  queue_size=FANOUT_CLIENT_QUEUE_SIZE or FANOUT_QUEUE_SIZE)
+            fanout.start()
+        return fanout
+
+
+# Supervisor of the worker processes in process mode, started on first use
+supervisor = None
+supervisor_lock = threading.Lock()
+
+
+def get_supervisor():
+    global supervisor
+    with supervisor_lock:
+        if supervisor is None:
+            from bitstamp_supervisor import Supervisor
+            supervisor = Supervisor(WATCHER_PROCESSES)
+            supervisor.start()
+        return supervisor
+
+
+# Multiplexed watcher engine, started on first use
+engine = None
+engine_lock = threading.Lock()
+
+
+def get_engine():
+    global engine
+    with engine_lock:
+        if engine is None:
+            # asyncio and websockets are only imported by processes that run the engine
+            from bitstamp_mux import WatcherEngine
+            engine = WatcherEngine(URI, connections=MUX_CONNECTIONS, capture=get_capture(), fanout=get_fanout())
+            engine.start()
+        return engine
+
+
+# Watchers running in this process keyed by name, the in memory copy of the
+# watchers table.  Entries are the Watcher itself, a WatcherThread in thread
+# mode, so lookups and stops never touch the database or scan threads.
+watcher_registry = {}
+watcher_registry_lock = threading.Lock()
+
+
+def stored_watchers():
+    # Rows of the watchers table, none when it cannot be read
+    rows = get_db().list_watchers()
+    return [] if isinstance(rows, str) else rows
 
 
 def start_all_watchers():
-    db_conn = SQL(SQLHOST, SQLUSER, SQLPASSWD, SQLDB)
-    watchers = db_conn.list_watchers()
-    for watcher in watchers:
-        WatcherThread(name=watcher[1], channel=watcher[2], currency_pair=watcher[3],
-                      output="sql").start()
+    get_db().ensure_watcher_output()
+    for row in stored_watchers():
+        try:
+            start_watcher(name=row[1], channel=row[2], currency_pair=row[3], output=row[4])
+        except Exception as e:
+            # One bad row must not keep the watchers after it from starting
+            print(f"Failed to start watcher {row[1]}({e}).")
+    get_retention_job()
 
 
 def get_all_watchers():
-    db_conn = SQL(SQLHOST, SQLUSER, SQLPASSWD, SQLDB)
-    return db_conn.list_watchers()
+    return get_db().list_watchers()
+
+
+def get_watcher(name):
+    return watcher_registry.get(name)
+
+
+def get_watcher_health(name):
+    # One watcher's live state, looked up on the worker process running it in process mode
+    if supervisor is not None:
+        return supervisor.watcher_health(name)
+    watcher = watcher_registry.get(name)
+    return watcher.health() if watcher is not None else None
+
+
+def list_watchers():
+    # Live state of every watcher, from the worker processes in process mode
+    if supervisor is not None:
+        return supervisor.health()
+    return [watcher.health() for watcher in list(watcher_registry.values())]
+
+
+def start_watcher(name, channel, currency_pair, output):
+    if WATCHER_ENGINE == 'process':
+        # The worker process creates the watcher, its row and trade table
+        return get_supervisor().start_watcher(name, channel, currency_pair, output)
+    with watcher_registry_lock:
+        if name in watcher_registry:
+            return watcher_registry[name]
+        if WATCHER_ENGINE == 'thread':
+            watcher = WatcherThread(name=name, channel=channel, currency_pair=currency_pair, output=output)
+        else:
+            watcher = Watcher(name=name, channel=channel, currency_pair=currency_pair, output=output)
+        watcher_registry[name] = watcher
+    if isinstance(watcher, WatcherThread):
+        watcher.start()
+        return watcher
+    watcher.db_conn.create_watcher(name, channel, currency_pair, output)
+    if channel == "live_trades":
+        watcher.db_conn.ensure_trade_table(currency_pair)
+    elif channel == "live_orders":
+        watcher.db_conn.ensure_order_table(currency_pair)
+    get_engine().add_watcher(watcher)
+    return watcher
+
+
+def stop_watcher(name, remove=True):
+    if supervisor is not None:
+        return supervisor.stop_watcher(name, remove=remove)
+    with watcher_registry_lock:
+        watcher = watcher_registry.pop(name, None)
+    if watcher is None:
+        return False
+    if engine is not None and not isinstance(watcher, WatcherThread):
+        engine.remove_watcher(name)
+    watcher.end(remove=remove)
+    return True
+
+
+def get_queue_stats():
+    if supervisor is not None:
+        return supervisor.queue_stats()
+    return local_queue_stats()
+
+
+def local_queue_stats():
+    return {watcher.name: watcher.queue.stats() for watcher in list(watcher_registry.values())}
+
+
+def get_process_stats():
+    return supervisor.stats() if supervisor is not None else []
+
+
+# In memory state read by the web api.  In process mode the state lives in the
+# worker running the pair's watchers and these are answered by that worker.
+# Each returns None when no watcher has seen the pair.
+
+def get_candles(currency_pair, interval, limit):
+    if supervisor is not None:
+        return supervisor.pair_request(currency_pair, "candles", currency_pair, interval, limit)
+    aggregator = candle_aggregators.get(currency_pair)
+    return aggregator.candles(interval, limit) if aggregator is not None else None
+
+
+def get_latest_trades(currency_pair, limit):
+    # None as well when fewer than limit trades are held
+    if supervisor is not None:
+        return supervisor.pair_request(currency_pair, "latest_trades", currency_pair, limit)
+    recent = recent_trades.get(currency_pair)
+    if recent is None or len(recent.trades) < limit:
+        return None
+    return [trade_to_dict(trade) for trade in recent.latest(limit)]
+
+
+def get_analytics(currency_pair, horizons):
+    if supervisor is not None:
+        return supervisor.pair_request(currency_pair, "analytics", currency_pair, horizons)
+    analytics = trade_analytics.get(currency_pair)
+    return analytics.stats(horizons) if analytics is not None else None
+
+
+def get_book_depth(currency_pair, channel, depth):
+    # The book for channel, or the deepest book being watched when channel is None
+    if supervisor is not None:
+        return supervisor.pair_request(currency_pair, "order_book", currency_pair, channel, depth)
+    for name in [channel] if channel is not None else ORDER_BOOK_CHANNELS:
+        book = order_books.get((name, currency_pair))
+        if book is not None:
+            return book.depth(depth)
+    return None
+
+
+def get_order_stats(currency_pair):
+    if supervisor is not None:
+        return supervisor.pair_request(currency_pair, "orders", currency_pair)
+    orders = open_orders.get(currency_pair)
+    return orders.stats() if orders is not None else None
+
+
+def get_cross_states(limit=1, live=False):
+    # (time, trades, books) states of this process's cross pair table, newest first
+    if live:
+        return [(time.time(),) + cross_table.state()]
+    return get_cross_snapshotter().states(limit)
+
+
+def get_cross_snapshots(limit=1, live=False):
+    # The worker tables are merged before the implied rates are worked out, so
+    # triangles can take their legs from different workers
+    if supervisor is None:
+        return [cross_table.snapshot()] if live else get_cross_snapshotter().latest(limit)
+    states = [state for states in supervisor.gather("cross_states", limit, live) for state in states]
+    if live:
+        # Each worker read its table a moment apart, merge them as one taken now
+        states = [(0, trades, books) for now, trades, books in states]
+    return [cross_table.snapshot(None if live else now, trades, books)
+            for now, trades, books in merge_states(states, limit)]
+
+
+def get_worker_metrics():
+    # metric_samples() from every worker process, for render_metrics
+    return supervisor.gather("metrics") if supervisor is not None else []
+
+
+# The gauges only cover this process, each worker process reports its own
+QUEUE_DEPTH = Gauge("bitstamp_queue_depth", "Messages waiting in the ingest queue.",
+                    lambda: {(name, ): stats["depth"] for name, stats in local_queue_stats().items()},
+                    labels=("watcher",))
+QUEUE_DROPPED = Gauge("bitstamp_queue_dropped", "Messages dropped by the ingest queue.",
+                      lambda: {(name, ): stats["dropped"] for name, stats in local_queue_stats().items()},
+                      labels=("watcher",))
+OPEN_ORDERS = Gauge("bitstamp_open_orders", "Open orders tracked from live_orders.",
+                    lambda: {(pair, side): count for pair, orders in list(open_orders.items())
+                             for side, count in orders.stats()["open_orders"].items()},
+                    labels=("currency_pair", "side"))
+FANOUT_CLIENTS = Gauge("bitstamp_fanout_clients", "Connected fan-out subscribers.",
+                       lambda: {(): fanout.stats()["clients"]} if fanout is not None else {})
 
 
 def stop_all_watchers():
-    for t in threading.enumerate():
-        if isinstance(t, WatcherThread):
-            t.end(remove=False)
-            t.join()
+    global engine, trade_writer, trade_spool, order_writer, order_spool, capture, candle_flusher, fanout, supervisor, \
+        cross_snapshotter, retention_job
+    with supervisor_lock:
+        if supervisor is not None:
+            supervisor.stop()
+            supervisor = None
+    with watcher_registry_lock:
+        running = list(watcher_registry.values())
+        watcher_registry.clear()
+    for watcher in running:
+        if isinstance(watcher, WatcherThread):
+            watcher.end(remove=False)
+            watcher.join()
+        else:
+            engine.remove_watcher(watcher.name)
+            watcher.end(remove=False)
+        watcher.join_worker()
+    with engine_lock:
+        if engine is not None:
+            engine.stop()
+            engine = None
+    with capture_lock:
+        if capture is not None:
+            capture.close()
+            capture = None
+    with fanout_lock:
+        if fanout is not None:
+            fanout.stop()
+            fanout = None
+    with candle_flusher_lock:
+        if candle_flusher is not None:
+            candle_flusher.stop()
+            candle_flusher = None
+    with cross_snapshotter_lock:
+        if cross_snapshotter is not None:
+            cross_snapshotter.stop()
+            cross_snapshotter = None
+    with retention_job_lock:
+        if retention_job is not None:
+            retention_job.stop()
+            retention_job = None
+    # Flush the file outputs, then spool any trades still waiting in the batch writer
+    # and drain what the database will take
+    close_sinks()
+    with trade_writer_lock:
+        if trade_writer is not None:
+            trade_writer.close()
+            trade_spool.close()
+            trade_writer = None
+            trade_spool = None
+    with order_writer_lock:
+        if order_writer is not None:
+            order_writer.close()
+            order_spool.close()
+            order_writer = None
+            order_spool = None
+    with db_lock:
+        if db is not None:
+            db.pool.close()
 
 
-class WatcherThread(threading.Thread):
+class Watcher:
+    # A single channel/currency pair subscription.  Messages are fed to
+    # handle_message by the connection carrying the subscription, which only
+    # decodes them onto the ingest queue.  A sink worker drains the queue and
+    # writes to the outputs so a slow output never stalls the socket.
     def __init__(self, name, channel, currency_pair, output):
-        super().__init__(name=name)
+        self.name = name
+        self.labels = (name,)
         self.running = True
         self.channel = channel
         self.currency_pair = currency_pair
         self.output = output
-        self.db_conn = SQL(SQLHOST, SQLUSER, SQLPASSWD, SQLDB)
+        # Health reported by list_watchers, updated without locks by the socket and sink threads
+        self.status = "starting"
+        self.started = time.time()
+        self.last_message = None
+        self.messages = 0
+        self.trades = 0
+        self.connects = 0
+        self.errors = 0
+        self.db_conn = get_db()
+        # Trades go to every output listed in output, only live_trades watchers have trades
+        self.sinks = SinkFanout(name, output, queue_size=SINK_QUEUE_LENGTH, policy=SINK_QUEUE_POLICY,
+                                spill_dir=INGEST_SPILL_DIR) if channel == VALID_CHANNELS[0] else None
+        self.candle_flusher = get_candle_flusher()
+        self.cross_snapshotter = get_cross_snapshotter()
+        self.order_writer = get_order_writer() if channel == VALID_CHANNELS[1] else None
+        self.order_table = f"{currency_pair}_orders"
+        # Last trade handled, used to backfill and de-duplicate after a reconnect
+        self.last_trade_id = None
+        self.last_microtimestamp = None
+        self.queue = IngestQueue(name, maxsize=INGEST_QUEUE_SIZE, policy=self.queue_policy(),
+                                 spill_dir=INGEST_SPILL_DIR)
+        self.worker = threading.Thread(target=self._drain_queue, name=f"{name}-sink", daemon=True)
+        self.worker.start()
+
+    def end(self, remove=True):
+        if remove:
+            self.db_conn.delete_watcher(self.name)
+        self.running = False
+        self.status = "stopped"
+        # Workers finish whatever is still queued and then exit
+        self.queue.close()
+
+    def join_worker(self):
+        self.worker.join()
+
+    def queue_policy(self):
+        # handle_message runs on the mux engine's event loop, blocking there would
+        # stall every socket and keepalive on the engine
+        if INGEST_QUEUE_POLICY == QUEUE_POLICIES[0]:
+            return QUEUE_POLICIES[2]
+        return INGEST_QUEUE_POLICY
+
+    def subscription_channel(self):
+        return f"{self.channel}_{self.currency_pair}"
+
+    def on_connect(self):
+        # Called each time the subscription is (re)established on a socket, queued
+        # so the workers see it in order with the messages around it
+        CONNECTS.inc(self.labels)
+        self.status = "connected"
+        self.connects += 1
+        self.queue.put(('bts:connected', None))
+
+    def on_disconnect(self):
+        if self.running:
+            self.status = "disconnected"
+
+    def health(self):
+        now = time.time()
+        return {"name": self.name, "channel": self.channel, "currency_pair": self.currency_pair,
+                "output": self.output, "status": self.status, "started": self.started,
+                "last_message": self.last_message,
+                "seconds_since_message": now - self.last_message if self.last_message is not None else None,
+                "messages": self.messages, "trades": self.trades, "connects": self.connects, "errors": self.errors,
+                "queue_depth": self.queue.depth(),
+                "sink_queues": self.sinks.stats() if self.sinks is not None else {}}
+
+    def handle_message(self, resp):
+        start = time.perf_counter()
+        data = resp['data']
+        event = resp['event']
+        MESSAGES.inc((self.name, event))
+        self.last_message = time.time()
+        self.messages += 1
+        if event == 'trade':
+            trade = parse_trade(data)
+            TRADE_LAG_SECONDS.observe(self.last_message - trade.microtimestamp / 1000000, self.labels)
+            self.queue.put((event, trade))
+        elif event == 'data':
+            self.queue.put((event, data))
+        elif event in ORDER_EVENTS:
+            self.queue.put((event, parse_order(data)))
+        PARSE_SECONDS.observe(time.perf_counter() - start, self.labels)
+
+    def _drain_queue(self):
+        while True:
+            items = self.queue.get_many()
+            if not items:
+                # Every queued trade has been handed over, let the sinks finish
+                if self.sinks is not None:
+                    self.sinks.close()
+                return
+            # Trades are handed to the sinks as one batch per run of trades
+            trades = []
+            for event, data in items:
+                start = time.perf_counter()
+                try:
+                    if event == 'trade':
+                        if self._handle_trade(data):
+                            trades.append(data)
+                    else:
+                        # Trades ahead of any other event are written before it is handled
+                        self._write_trades(trades)
+                        trades = []
+                        if event == 'data':
+                            self._handle_order_book(data)
+                        elif event in ORDER_EVENTS:
+                            self._handle_order(event, data)
+                        elif event == 'bts:connected':
+                            self._handle_connect()
+                except Exception as e:
+                    self.errors += 1
+                    print(f"ERROR: {self.name} {type(e)} {e}")
+                SINK_SECONDS.observe(time.perf_counter() - start, self.labels)
+            self._write_trades(trades)
+
+    def _write_trades(self, trades):
+        if trades:
+            self.sinks.write_many(trades, self.currency_pair)
+
+    def _check_currency_pair(self):
+        return False if self.currency_pair not in VALID_PAIRS else True
+
+    def _check_channel(self):
+        return False if self.channel not in VALID_CHANNELS else True
+
+    def _make_subscribe_json(self):
+        subscription = {
+            "event": "bts:subscribe",
+            "data": {
+                "channel": self.subscription_channel()
+            }
+        }
+        return json.dumps(subscription)
+
+    def _handle_trade(self, trade):
+        # trade is the Trade record parsed from the frame data, see bitstamp_decode.parse_trade
+        # Skip trades already seen, a backfill and the live stream can overlap.
+        # Returns whether the trade is new, new trades are then written to the sinks.
+        if self.last_trade_id is not None and trade.id <= self.last_trade_id:
+            return False
+        self.last_trade_id = trade.id
+        self.last_microtimestamp = trade.microtimestamp
+        self.trades += 1
+        get_candle_aggregator(self.currency_pair).add(trade)
+        get_recent_trades(self.currency_pair).add(trade)
+        get_trade_analytics(self.currency_pair).add(trade)
+        cross_table.update_trade(self.currency_pair, float(trade.price), trade.microtimestamp)
+        return True
+
+    def _handle_order(self, event, order):
+        # order is the Order record parsed from the frame data, see bitstamp_decode.parse_order
+        get_open_orders(self.currency_pair).apply(event, order)
+        self.order_writer.add((order.id, ORDER_EVENTS[event], order.order_type, order.amount, order.price,
+                               order.datetime, order.microtimestamp), self.order_table)
+
+    def _handle_connect(self):
+        # Any diffs missed while disconnected make the book unusable
+        if self.channel == VALID_CHANNELS[4]:
+            get_order_book(self.channel, self.currency_pair).invalidate()
+        # The same goes for the open orders, the table is rebuilt from new events
+        if self.channel == VALID_CHANNELS[1]:
+            get_open_orders(self.currency_pair).reset()
+        if self.channel == VALID_CHANNELS[0] and self.last_trade_id is not None:
+            self._backfill()
+
+    def _backfill(self):
+        # Runs on the sink worker ahead of any live trades received after the reconnect
+        try:
+            trades = backfill_trades(self.currency_pair, self.last_trade_id, self.last_microtimestamp,
+                                     url=BACKFILL_URL)
+        except Exception as e:
+            print(f"Failed to backfill trades for {self.name}({e}).")
+            return
+        if trades:
+            print(f'{self.name} backfilling {len(trades)} trades missed while disconnected.')
+            BACKFILLED.inc(self.labels, len(trades))
+        self._write_trades([trade for trade in trades if self._handle_trade(trade)])
+
+    def _handle_order_book(self, book_data):
+        # order_book and detail_order_book send the top of the book, diff_order_book sends changed levels
+        book = get_order_book(self.channel, self.currency_pair)
+        if self.channel == VALID_CHANNELS[4]:
+            book.apply_diff(book_data)
+        else:
+            book.apply_snapshot(book_data)
+        if book.synced:
+            cross_table.update_book(self.currency_pair, book.best_bid(), book.best_ask(), book.microtimestamp)
+
+
+class WatcherThread(Watcher, threading.Thread):
+    # Legacy engine, one thread and websocket per watcher
+    def __init__(self, name, channel, currency_pair, output):
+        threading.Thread.__init__(self, name=name)
+        Watcher.__init__(self, name, channel, currency_pair, output)
+        self.capture = get_capture()
+        self.fanout = get_fanout()
+        # Set by end() so a reconnect backoff does not hold up a shutdown
+        self.stopped = threading.Event()
+
+    def end(self, remove=True):
+        Watcher.end(self, remove)
+        self.stopped.set()
+
+    def queue_policy(self):
+        # The socket has a thread of its own, blocking it only holds up this watcher
+        return INGEST_QUEUE_POLICY
 
     def run(self):
+        # websocket-client is only needed by the legacy engine
+        from websocket import create_connection
+        attempt = 0
         while self.running:
             try:
-                self.db_conn.create_watcher(self.getName(), self.channel, self.currency_pair)
+                self.db_conn.create_watcher(self.getName(), self.channel, self.currency_pair, self.output)
+                if self.channel == "live_trades":
+                    self.db_conn.ensure_trade_table(self.currency_pair)
+                elif self.channel == "live_orders":
+                    self.db_conn.ensure_order_table(self.currency_pair)
                 # Open socket with server
                 ws = create_connection(URI)
                 ws.settimeout(1)
 
                 # Subscribe to a channel
                 ws.send(self._make_subscribe_json())
+                self.on_connect()
+                attempt = 0
 
                 # Monitor open socket for new data
                 self._monitor_subscription(ws)
 
             except socket.gaierror:
                 print(f'Network connection is down, will retry when network connection is re-established.')
-                time.sleep(10)
+            except (ConnectionError, TimeoutError) as e:
+                print(f'Unable to reach server({e}), attempting to reconnect...')
 
             except Exception as e:
                 print(f"ERROR: {type(e)} {e}")
+                self.status = "failed"
                 break
 
-    def end(self, remove=True):
-        if remove:
-            self.db_conn.delete_watcher(self.getName())
-        self.running = False
-
-    def _check_currency_pair(self):
-        return False if self.currency_pair not in VALID_PAIRS else True
-
-    def _check_channel(self):
-        return False if self.channel not in VALID_CHANNELS else True
-
-    def _make_subscribe_json(self):
-        subscription = {
-            "event": "bts:subscribe",
-            "data": {
-                "channel": f"{self.channel}_{self.currency_pair}"
-            }
-        }
-        return json.dumps(subscription)
+            # Wait before reconnecting, backing off while the server stays unreachable
+            self.on_disconnect()
+            if self.running:
+                self.stopped.wait(backoff_delay(attempt))
+                attempt += 1
 
     def _monitor_subscription(self, open_socket):
+        from websocket import WebSocketTimeoutException, WebSocketConnectionClosedException
         while self.running:
             try:
-                resp = json.loads(open_socket.recv())
+                frame = open_socket.recv()
+                if self.capture is not None:
+                    self.capture.write(frame)
+                resp = timed_loads(frame, self.labels)
                 if resp:
-                    data = resp['data']
-                    event = resp['event']
-                    channel = resp['channel']
-                    if event == 'trade':
-                        self._handle_trade(data)
+                    if self.fanout is not None:
+                        self.fanout.publish(resp.get('channel'), frame)
+                    self.handle_message(resp)
                 else:
                     print("empty")
-            except (ConnectionAbortedError, TimeoutError):
+            except WebSocketTimeoutException:
+                # Nothing arrived within the socket timeout, a quiet channel is not a disconnect
+                continue
+            except (ConnectionAbortedError, TimeoutError, WebSocketConnectionClosedException):
                 open_socket.close()
                 print(f'Connection to server has been lost, attempting to reconnect...')
-                break
+                return
             except Exception as e:
                 print(f"ERROR: {type(e)} {e}")
                 break
-
-    def _handle_trade(self, trade_data):
-        # Sample trade_data
-        # {"data": {"buy_order_id": 1 314 580 971 991 040, "amount_str": "0.06400000", "timestamp": "1 609 777 594",
-        #           "microtimestamp": "1609777594772000", "id": 139 255 607, "amount": 0.064,
-        #           "sell_order_id": 1314580969922560, "price_str": "30859.03", "type": 0, "price": 30859.03},
-        #           "event": "trade", "channel": "live_trades_btcusd"}
-        sql_trade_data = {
-            "id": trade_data["id"], "buy_order_id": trade_data["buy_order_id"],
-            "sell_order_id": trade_data["sell_order_id"], "amount": trade_data["amount"],
-            "price": trade_data["price"],
-            "type": trade_data["type"], "timestamp": trade_data["timestamp"]
-        }
-        self.db_conn.create_trade(sql_trade_data, self.currency_pair)
+        open_socket.close()
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS `btcusd_orders` (
+  `id` bigint unsigned NOT NULL,
+  `event` tinyint unsigned NOT NULL,
+  `order_type` tinyint unsigned NOT NULL,
+  `amount` decimal(24,8) unsigned NOT NULL,
+  `price` decimal(16,8) unsigned NOT NULL,
+  `datetime` int unsigned NOT NULL,
+  `microtimestamp` bigint unsigned NOT NULL,
+  PRIMARY KEY (`datetime`, `microtimestamp`, `id`, `event`),
+  KEY `id_idx` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+PARTITION BY RANGE (`datetime`) (
+  PARTITION pold VALUES LESS THAN (1609459200),
+  PARTITION pmax VALUES LESS THAN MAXVALUE
+);
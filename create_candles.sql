@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS `candles` (
+  `currency_pair` varchar(45) NOT NULL,
+  `interval` varchar(8) NOT NULL,
+  `start` int unsigned NOT NULL,
+  `open` decimal(16,8) unsigned NOT NULL,
+  `high` decimal(16,8) unsigned NOT NULL,
+  `low` decimal(16,8) unsigned NOT NULL,
+  `close` decimal(16,8) unsigned NOT NULL,
+  `volume` decimal(24,8) unsigned NOT NULL,
+  `vwap` decimal(16,8) unsigned NOT NULL,
+  `trades` int unsigned NOT NULL,
+  PRIMARY KEY (`currency_pair`, `interval`, `start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
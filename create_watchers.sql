@@ -3,6 +3,7 @@ CREATE TABLE `watchers` (
   `name` varchar(45) NOT NULL,
   `channel` varchar(45) NOT NULL,
   `currency_pair` varchar(45) NOT NULL,
+  `output` varchar(100) NOT NULL DEFAULT 'sql',
   PRIMARY KEY (`_id`),
   UNIQUE KEY `_id_UNIQUE` (`_id`),
   UNIQUE KEY `name_UNIQUE` (`name`)
@@ -0,0 +1,207 @@
+#####################################################################################
+# Filename       : test_bitstamp_reconnect.py
+# Author         : Paul Jamieson
+# Created        : 10/17/2026
+# Edited         : 10/17/2026
+# Python Version : 3.7.7
+# Purpose        : Reconnect, backfill and de-duplication of a live_trades watcher
+#                against a local mock websocket server and transactions endpoint.
+#
+# MIT License
+#
+# Copyright (c) 2021 Paul Jamieson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#####################################################################################
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import websockets
+import bitstamp_workers as workers
+from bitstamp_sinks import Sink, SINKS
+
+PAIR = "btcusd"
+
+# Trades 1 to LIVE_BEFORE are streamed, the socket drops, trades up to MISSED
+# happen while disconnected and the new socket starts again at RESUME
+LIVE_BEFORE = 5000
+MISSED = 5010
+RESUME = 5006
+LIVE_AFTER = 5020
+
+
+def trade_frame(trade_id, now):
+    return json.dumps({"data": {"buy_order_id": trade_id * 2, "amount_str": "0.06400000", "timestamp": str(int(now)),
+                                "microtimestamp": str(int(now * 1000000)), "id": trade_id, "amount": 0.064,
+                                "sell_order_id": trade_id * 2 + 1, "price_str": "30859.03", "type": trade_id % 2,
+                                "price": 30859.03},
+                       "event": "trade", "channel": f"live_trades_{PAIR}"})
+
+
+def transaction(trade_id, now):
+    return {"date": str(int(now)), "tid": str(trade_id), "amount": "0.06400000", "price": "30859.03",
+            "type": str(trade_id % 2)}
+
+
+class MockExchange:
+    # Websocket server that streams the first trades and drops the socket, then
+    # resumes part way into the gap on the next connection, and a transactions
+    # endpoint covering the gap with some overlap on both sides.  A quiet
+    # exchange sends a single trade and then nothing on an open socket.
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.connections = 0
+        self.requests = []
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.ready.wait(10)
+        exchange = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                exchange.requests.append(self.path)
+                now = time.time()
+                # Newest first, as the exchange returns them
+                body = json.dumps([transaction(i, now) for i in range(MISSED, LIVE_BEFORE - 10, -1)]).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        self.transactions_url = f"http://127.0.0.1:{self.http.server_address[1]}/transactions/{{currency_pair}}/" \
+                                f"?time={{time}}"
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._serve())
+        self.loop.run_forever()
+
+    async def _serve(self):
+        self.server = await websockets.serve(self._handler, "127.0.0.1", 0)
+        self.uri = f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/"
+        self.ready.set()
+
+    async def _handler(self, ws, path=None):
+        self.connections += 1
+        request = json.loads(await ws.recv())
+        assert request == {"event": "bts:subscribe", "data": {"channel": f"live_trades_{PAIR}"}}
+        if self.quiet:
+            await ws.send(trade_frame(1, time.time()))
+            await ws.wait_closed()
+            return
+        if self.connections == 1:
+            ids = range(1, LIVE_BEFORE + 1)
+        else:
+            ids = range(RESUME, LIVE_AFTER + 1)
+        for trade_id in ids:
+            await ws.send(trade_frame(trade_id, time.time()))
+        if self.connections == 1:
+            return
+        await ws.wait_closed()
+
+    async def _close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def close(self):
+        self.http.shutdown()
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class StandInDb:
+    # The calls a live_trades watcher makes on BitStampMySql
+    def create_watcher(self, name, channel, currency_pair, output):
+        pass
+
+    def delete_watcher(self, name):
+        pass
+
+    def ensure_trade_table(self, table):
+        return True
+
+    def create_candles(self, candles, merge=False):
+        return True
+
+
+class RecordingSink(Sink):
+    def __init__(self):
+        self.ids = []
+        self.done = threading.Event()
+
+    def write_many(self, trades, currency_pair):
+        self.ids.extend(trade.id for trade in trades)
+        if self.ids[-1] >= LIVE_AFTER:
+            self.done.set()
+
+
+def test_reconnect_backfills_gap_without_duplicates(monkeypatch):
+    exchange = MockExchange()
+    sink = RecordingSink()
+    monkeypatch.setitem(SINKS, "recording", lambda: sink)
+    monkeypatch.setattr(workers, "URI", exchange.uri)
+    monkeypatch.setattr(workers, "BACKFILL_URL", exchange.transactions_url)
+    monkeypatch.setattr(workers, "WATCHER_ENGINE", "mux")
+    monkeypatch.setattr(workers, "RETENTION_DAYS", None)
+    workers.db = StandInDb()
+    try:
+        workers.start_watcher("btcusd-test", workers.VALID_CHANNELS[0], PAIR, "recording")
+        assert sink.done.wait(30), f"only {len(sink.ids)} trades reached the sink"
+        # Every trade once, in order, whichever of the socket and the backfill carried it
+        assert sink.ids == list(range(1, LIVE_AFTER + 1))
+        assert exchange.connections == 2
+        assert exchange.requests == [f"/transactions/{PAIR}/?time=minute"]
+    finally:
+        # The stand in has no connection pool for stop_all_watchers to close
+        workers.db = None
+        workers.stop_all_watchers()
+        exchange.close()
+
+
+def test_quiet_channel_keeps_its_connection(monkeypatch):
+    # The thread engine reads with a socket timeout, running out of it is not a disconnect
+    exchange = MockExchange(quiet=True)
+    sink = RecordingSink()
+    monkeypatch.setitem(SINKS, "recording", lambda: sink)
+    monkeypatch.setattr(workers, "URI", exchange.uri)
+    monkeypatch.setattr(workers, "BACKFILL_URL", exchange.transactions_url)
+    monkeypatch.setattr(workers, "WATCHER_ENGINE", "thread")
+    monkeypatch.setattr(workers, "RETENTION_DAYS", None)
+    workers.db = StandInDb()
+    try:
+        workers.start_watcher("btcusd-quiet", workers.VALID_CHANNELS[0], PAIR, "recording")
+        time.sleep(3.5)
+        assert sink.ids == [1]
+        assert exchange.connections == 1
+        assert exchange.requests == []
+    finally:
+        workers.db = None
+        workers.stop_all_watchers()
+        exchange.close()